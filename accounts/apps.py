@@ -3,3 +3,22 @@ from django.apps import AppConfig
 
 class AccountsConfig(AppConfig):
     name = 'accounts'
+
+    def ready(self):
+        from django.contrib.auth import models as auth_models
+        from django.contrib.auth.signals import user_logged_in
+        from django.db.backends.signals import connection_created
+
+        from project_7.db import configure_sqlite
+
+        from .models import update_last_login
+
+        # Replace the receiver django.contrib.auth connects, which
+        # saves the whole user on every login.
+        user_logged_in.disconnect(auth_models.update_last_login,
+                                  dispatch_uid='update_last_login')
+        user_logged_in.connect(update_last_login,
+                               dispatch_uid='update_last_login')
+
+        connection_created.connect(configure_sqlite,
+                                   dispatch_uid='configure_sqlite')
@@ -0,0 +1,117 @@
+"""
+Authentication backend that loads a user and their profile in one
+query.
+
+AuthenticationMiddleware resolves request.user through the backend's
+get_user(), and nearly every signed-in page then reads
+request.user.profile. Loading both with select_related() saves that
+second query on every request.
+
+With AUTH_USER_CACHE_SIZE set, recently loaded users are also kept in a
+small per-process LRU for AUTH_USER_CACHE_TTL seconds. Saves and
+deletes of a User or Profile evict the user from this process's cache;
+other processes see the change once their copy expires.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile
+
+
+class UserCache:
+    """
+    LRU of loaded users. Users are stored pickled, so every request
+    gets its own copy to modify.
+    """
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+        return pickle.loads(entry[0])
+
+    def set(self, user):
+        data = pickle.dumps(user, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[user.pk] = (data, self.clock() + self.ttl)
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    """Return the process-wide UserCache, or None if it is disabled."""
+    global _user_cache
+    if not settings.AUTH_USER_CACHE_SIZE:
+        return None
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = UserCache(settings.AUTH_USER_CACHE_SIZE,
+                                        settings.AUTH_USER_CACHE_TTL)
+    return _user_cache
+
+
+@receiver(setting_changed)
+def reset_user_cache(setting, **kwargs):
+    global _user_cache
+    if setting.startswith('AUTH_USER_CACHE_'):
+        _user_cache = None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_user(sender, instance, **kwargs):
+    if _user_cache is not None:
+        _user_cache.delete(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def evict_profile_user(sender, instance, **kwargs):
+    if _user_cache is not None:
+        _user_cache.delete(instance.user_id)
+
+
+class ProfileModelBackend(ModelBackend):
+    """ModelBackend whose get_user() also loads the user's profile."""
+    def get_user(self, user_id):
+        cache = get_user_cache()
+        user = cache.get(user_id) if cache is not None else None
+        if user is None:
+            try:
+                user = (User._default_manager.select_related('profile')
+                        .get(pk=user_id))
+            except User.DoesNotExist:
+                return None
+            if cache is not None:
+                cache.set(user)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,140 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks run against a throwaway copy of the schema, never against
+the configured database, with private copies of the caches other
+processes share, and drive the app in-process through Django's test
+client.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.db import close_old_connections, connections
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings
+
+from project_7.sessions import stop_session_writer
+
+# Cache backends whose entries are seen by other processes.
+SHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'project_7.cache.SharedMemoryCache',
+)
+
+
+@contextmanager
+def private_caches():
+    """
+    Move the caches the running site shares across processes to a
+    temporary directory for the duration of the block. Otherwise the
+    site would find the benchmark's sessions and users there, keyed by
+    primary keys from the throwaway database, and the benchmark would
+    find the site's.
+    """
+    directory = tempfile.mkdtemp(prefix='benchmark-caches-')
+    locations = {}
+    caches = {}
+    for alias, config in settings.CACHES.items():
+        if config['BACKEND'] in SHARED_CACHE_BACKENDS:
+            location = locations.setdefault(
+                config['LOCATION'],
+                os.path.join(directory, 'cache-{}'.format(len(locations))),
+            )
+            config = dict(config, LOCATION=location)
+        caches[alias] = config
+    try:
+        with override_settings(CACHES=caches):
+            yield
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Create and migrate an empty SQLite database file for the duration
+    of the block, and point every database alias at it.
+
+    Session rows queued by SessionWriter are written out before and
+    after the block, each to the database they were saved against.
+    Nothing connects to the configured database file meanwhile, so
+    its rows and its journal mode (set by configure_sqlite on connect)
+    are left as they were.
+    """
+    stop_session_writer()
+    connection = connections['default']
+    connection.close()
+    directory = tempfile.mkdtemp(prefix='benchmark-')
+    path = os.path.join(directory, 'db.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict['TEST'].get('NAME')
+
+    # Every other alias is repointed first, so that no connection to
+    # the configured file is opened while the copy is migrated.
+    names = {}
+    for alias in connections:
+        if alias == 'default':
+            continue
+        settings_dict = connections[alias].settings_dict
+        connections[alias].close()
+        names[alias] = settings_dict['NAME']
+        settings_dict['NAME'] = (settings_dict['NAME'].replace(old_name, path)
+                                 if old_name in settings_dict['NAME']
+                                 else path)
+    connection.settings_dict['TEST']['NAME'] = path
+
+    def restore():
+        for alias, name in names.items():
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = name
+        connection.settings_dict['TEST']['NAME'] = old_test_name
+
+    try:
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+    except Exception:
+        restore()
+        raise
+    try:
+        yield path
+    finally:
+        stop_session_writer()
+        restore()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class BenchmarkClient(Client):
+    """
+    Test client that ends each request the way a WSGI server does, so
+    that CONN_MAX_AGE is honoured.
+    """
+    def request(self, **request):
+        try:
+            return super().request(**request)
+        finally:
+            close_old_connections()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles (ms) and throughput for a list of seconds."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': (percentile(latencies, 0.50) or 0) * 1000,
+        'p95_ms': (percentile(latencies, 0.95) or 0) * 1000,
+        'p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+    }
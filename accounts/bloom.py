@@ -0,0 +1,96 @@
+"""
+File-backed Bloom filter, queried through mmap.
+
+The filter file is built once, offline (manage.py build_password_filter),
+and then mapped read-only by every worker. Lookups only touch the few
+pages holding the probed bits, and those pages live in the OS page
+cache, shared between processes, rather than in each worker's heap.
+
+File layout: a fixed header (magic, number of bits, number of hash
+functions, number of entries), followed by the bit array.
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+MAGIC = b'PWBLOOM1'
+HEADER = struct.Struct('<8sQIQ')
+
+
+def normalize(word):
+    """Passwords are matched case-insensitively, like Django's list."""
+    return word.strip().lower().encode('utf-8')
+
+
+def bit_positions(word, num_bits, num_hashes):
+    """
+    Yield the ``num_hashes`` bit positions for ``word``, derived from
+    one 128-bit digest by double hashing.
+    """
+    digest = hashlib.blake2b(normalize(word), digest_size=16).digest()
+    first, second = struct.unpack('<QQ', digest)
+    second |= 1
+    for i in range(num_hashes):
+        yield (first + i * second) % num_bits
+
+
+def optimal_size(count, error_rate):
+    """Return (num_bits, num_hashes) for ``count`` entries."""
+    count = max(count, 1)
+    num_bits = math.ceil(-count * math.log(error_rate) / math.log(2) ** 2)
+    num_hashes = max(1, round(num_bits / count * math.log(2)))
+    return num_bits, num_hashes
+
+
+class BloomFilter:
+    """Read-only view of a Bloom filter file."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_bits, self.num_hashes, self.count = (
+            HEADER.unpack_from(self.map)
+        )
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError('{} is not a Bloom filter file.'.format(path))
+
+    def __contains__(self, word):
+        bits = self.map
+        offset = HEADER.size
+        for position in bit_positions(word, self.num_bits,
+                                      self.num_hashes):
+            if not bits[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def close(self):
+        self.map.close()
+
+    @classmethod
+    def build(cls, path, words, count, error_rate=0.001):
+        """
+        Write a filter holding ``words`` (an iterable of ``count``
+        strings) to ``path``. The bit array is filled through mmap, so
+        building does not need the filter to fit in memory.
+        """
+        num_bits, num_hashes = optimal_size(count, error_rate)
+        size = HEADER.size + (num_bits + 7) // 8
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        with open(temporary_path, 'w+b') as f:
+            f.truncate(size)
+            bits = mmap.mmap(f.fileno(), size)
+            added = 0
+            offset = HEADER.size
+            for word in words:
+                for position in bit_positions(word, num_bits, num_hashes):
+                    bits[offset + (position >> 3)] |= 1 << (position & 7)
+                added += 1
+            HEADER.pack_into(bits, 0, MAGIC, num_bits, num_hashes, added)
+            bits.flush()
+            bits.close()
+
+        os.replace(temporary_path, path)
+        return added
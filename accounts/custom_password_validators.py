@@ -1,6 +1,18 @@
+import logging
+import string
+import threading
+
+from django.contrib.auth.password_validation import (
+    get_default_password_validators,
+)
 from django.core.exceptions import ValidationError
+from django.utils.html import format_html, format_html_join
 from django.utils.translation import gettext, ngettext
 
+from .bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
 
 class MinimumLengthValidator:
     """
@@ -58,7 +70,7 @@ class SpecialCharacterValidator:
     """
     def __init__(self, min_length=1):
         self.min_length = min_length
-        self.special_characters = "!\"#$%&'()*+,-./:;<=>?@[\]^_`{|}~"
+        self.special_characters = string.punctuation
 
     def validate(self, password, user=None):
         if not any(character in self.special_characters
@@ -132,3 +144,231 @@ class NameSimilarityValidator:
             "Your password can't contain your username, first name, "
             "or last name."
         )
+
+
+# Character classes used by PasswordPolicyValidator.
+DIGIT = 1
+UPPERCASE = 2
+LOWERCASE = 4
+SPECIAL = 8
+
+SPECIAL_CHARACTERS = string.punctuation
+
+
+class PasswordPolicyValidator:
+    """
+    Validate the whole password policy in one pass over the password.
+
+    Checks the same rules, in the same order and with the same error
+    messages, as NameSimilarityValidator, MinimumLengthValidator,
+    SpecialCharacterValidator, NumberValidator and CaseValidator
+    chained together. ASCII characters are classified through a lookup
+    table built once, and the scan stops as soon as every required
+    character class has been seen.
+    """
+    def __init__(self, min_length=14,
+                 user_attributes=NameSimilarityValidator.USER_ATTRIBUTES,
+                 special_characters=SPECIAL_CHARACTERS,
+                 require_special=True, require_number=True,
+                 require_case=True):
+        self.min_length = min_length
+        self.user_attributes = user_attributes
+        self.special_characters = special_characters
+        self.special_set = frozenset(special_characters)
+
+        self.required = 0
+        if require_special:
+            self.required |= SPECIAL
+        if require_number:
+            self.required |= DIGIT
+        if require_case:
+            self.required |= UPPERCASE | LOWERCASE
+
+        self.classes = {
+            chr(code): self.classify(chr(code)) for code in range(128)
+        }
+
+    def classify(self, character):
+        bits = 0
+        if character.isdigit():
+            bits |= DIGIT
+        if character.isupper():
+            bits |= UPPERCASE
+        if character.islower():
+            bits |= LOWERCASE
+        if character in self.special_set:
+            bits |= SPECIAL
+        return bits
+
+    def validate(self, password, user=None):
+        errors = []
+
+        if user:
+            lowered = password.lower()
+            for attribute_name in self.user_attributes:
+                value = getattr(user, attribute_name, None)
+                if not value or not isinstance(value, str):
+                    continue
+                if value.lower() in lowered:
+                    errors.append(ValidationError(gettext(
+                        "Your password cannot contain your {}.".format(
+                            attribute_name.replace("_", " ")
+                        )
+                    )))
+                    break
+
+        if len(password) < self.min_length:
+            errors.append(ValidationError(
+                ngettext(
+                    ("This password is too short. "
+                     "It must contain at least %(min_length)d "
+                     "character."),
+                    ("This password is too short. "
+                     "It must contain at least %(min_length)d "
+                     "characters."),
+                    self.min_length
+                ),
+                code='password_too_short',
+                params={'min_length': self.min_length},
+            ))
+
+        found = 0
+        required = self.required
+        classes = self.classes
+        for character in password:
+            bits = classes.get(character)
+            if bits is None:
+                bits = self.classify(character)
+            found |= bits
+            if found & required == required:
+                break
+        missing = required & ~found
+
+        if missing & SPECIAL:
+            errors.append(ValidationError(gettext(
+                'Your password must contain at least'
+                ' one special character (such as ' +
+                self.special_characters + ')')
+            ))
+        if missing & DIGIT:
+            errors.append(ValidationError(gettext(
+                'Your password must contain at least one number.'
+            )))
+        if missing & UPPERCASE:
+            errors.append(ValidationError(gettext(
+                'Your password must contain at least one uppercase '
+                'letter.'
+            )))
+        elif missing & LOWERCASE:
+            errors.append(ValidationError(gettext(
+                'Your password must contain at least one lowercase '
+                'letter.'
+            )))
+
+        if errors:
+            raise ValidationError(errors)
+
+    def get_help_text(self):
+        return ' '.join(self.get_help_texts())
+
+    def get_help_texts(self):
+        """One help text per rule, as the replaced validators gave."""
+        help_texts = [
+            "Your password can't contain your username, first name, "
+            "or last name.",
+            ngettext(
+                ("Your password must contain at least %(min_length)d "
+                 "character."),
+                ("Your password must contain at least %(min_length)d "
+                 "characters."),
+                self.min_length
+            ) % {'min_length': self.min_length},
+        ]
+        if self.required & SPECIAL:
+            help_texts.append(
+                'Your password must contain at least one special '
+                'character (such as ' + self.special_characters + ')'
+            )
+        if self.required & DIGIT:
+            help_texts.append(
+                "Your password must contain at least one number."
+            )
+        if self.required & UPPERCASE:
+            help_texts.append(
+                "Your password must contain at least one uppercase "
+                "and one lowercase letter."
+            )
+        return help_texts
+
+
+def password_validators_help_texts(password_validators=None):
+    """
+    Django's password_validators_help_texts(), with a separate entry
+    for each rule of validators that have get_help_texts().
+    """
+    if password_validators is None:
+        password_validators = get_default_password_validators()
+    help_texts = []
+    for validator in password_validators:
+        if hasattr(validator, 'get_help_texts'):
+            help_texts.extend(validator.get_help_texts())
+        else:
+            help_texts.append(validator.get_help_text())
+    return help_texts
+
+
+def password_validators_help_text_html(password_validators=None):
+    """password_validators_help_texts() as an HTML list."""
+    help_items = format_html_join(
+        '', '<li>{}</li>',
+        ((help_text,) for help_text
+         in password_validators_help_texts(password_validators)),
+    )
+    return format_html('<ul>{}</ul>', help_items) if help_items else ''
+
+
+class BreachedPasswordValidator:
+    """
+    Validate whether the password is on a list of breached or common
+    passwords.
+
+    The list is a Bloom filter file built with
+    ``manage.py build_password_filter`` and mapped read-only with mmap,
+    so it is shared by every worker through the page cache instead of
+    being loaded into each one. A Bloom filter has no false negatives;
+    at the default build settings about 1 in 1000 passwords that are
+    not on the list is rejected anyway.
+
+    If the filter file does not exist the check is skipped, with a
+    warning.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.filter = None
+        self.missing = False
+        self.lock = threading.Lock()
+
+    def get_filter(self):
+        if self.filter is None and not self.missing:
+            with self.lock:
+                if self.filter is None and not self.missing:
+                    try:
+                        self.filter = BloomFilter(self.path)
+                    except FileNotFoundError:
+                        logger.warning(
+                            'Password filter %s not found; breached '
+                            'passwords will not be rejected.', self.path
+                        )
+                        self.missing = True
+        return self.filter
+
+    def validate(self, password, user=None):
+        password_filter = self.get_filter()
+        if password_filter is not None and password in password_filter:
+            raise ValidationError(
+                gettext("This password is too common."),
+                code='password_too_common',
+            )
+
+    def get_help_text(self):
+        return "Your password can't be a commonly used password."
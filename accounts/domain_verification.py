@@ -0,0 +1,379 @@
+"""
+Verify that e-mail domains can receive mail, by checking for MX
+records on the domain (requires dnspython).
+
+Lookups go through a bounded, in-process LRU cache so that the
+resolver is only hit the first time a domain is seen, or once its
+record TTL has run out.
+
+The ASGI entry point (project_7.asgi) fills the cache ahead of the
+view through DomainVerificationCache.averify(), which queries the
+nameservers from the event loop with AsyncDNSResolver.
+
+dnspython and asyncio are imported on first use, not with this module:
+accounts.forms imports it, and between them they add about 40ms to
+every process that loads the URLconf. project_7.warmup imports them
+ahead of forking workers.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from project_7.instrumentation import timed
+
+from .metrics import EMAIL_DOMAIN_LOOKUP_SECONDS, EMAIL_DOMAIN_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class DomainLookupError(Exception):
+    """The resolver could not give a definite answer for a domain."""
+
+
+class DNSResolver:
+    """
+    Look up MX records with dnspython.
+
+    Returns ``(exists, ttl)``: whether the domain has MX records and,
+    if it does, the TTL of the record set. NXDOMAIN and empty answers
+    count as "does not exist"; anything else (timeouts, unreachable
+    nameservers) raises DomainLookupError.
+    """
+    def __init__(self, timeout=3.0):
+        import dns.resolver
+
+        self.resolver = dns.resolver.Resolver()
+        self.resolver.timeout = timeout
+        self.resolver.lifetime = timeout
+
+    def __call__(self, domain):
+        import dns.exception
+        import dns.resolver
+
+        try:
+            answer = self.resolver.query(domain, 'MX')
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return False, None
+        except dns.exception.DNSException as error:
+            raise DomainLookupError(str(error)) from error
+        return True, answer.rrset.ttl
+
+
+class DNSProtocol:
+    """
+    asyncio datagram protocol waiting for the response to one query on
+    a connected UDP socket.
+    """
+    def __init__(self, query, future):
+        self.query = query
+        self.future = future
+
+    def connection_made(self, transport):
+        pass
+
+    def datagram_received(self, data, addr):
+        import dns.exception
+        import dns.message
+
+        try:
+            response = dns.message.from_wire(data)
+        except dns.exception.DNSException:
+            return
+        # Anything but the answer to our query (a stray or spoofed
+        # packet) is ignored.
+        if self.query.is_response(response) and not self.future.done():
+            self.future.set_result(response)
+
+    def error_received(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    def connection_lost(self, error):
+        if not self.future.done():
+            self.future.set_exception(
+                error or ConnectionError('DNS socket closed'))
+
+
+class AsyncDNSResolver:
+    """
+    DNSResolver for asyncio code: same results, but the query is sent
+    from the event loop, so waiting for it doesn't hold a thread.
+
+    ``timeout`` bounds the whole lookup. The nameservers (by default
+    those of /etc/resolv.conf) are tried in turn, each given an equal
+    share of what is left of it. Truncated answers are retried over
+    TCP by DNSResolver, in a thread.
+    """
+    def __init__(self, timeout=3.0, nameservers=None, port=53):
+        self.timeout = timeout
+        self.nameservers = nameservers
+        self.port = port
+
+    async def __call__(self, domain):
+        import asyncio
+        import dns.flags
+        import dns.rcode
+        import dns.rdatatype
+        import dns.resolver
+
+        loop = asyncio.get_event_loop()
+        if self.nameservers is None:
+            self.nameservers = dns.resolver.get_default_resolver().nameservers
+        deadline = loop.time() + self.timeout
+        errors = []
+        for n, nameserver in enumerate(self.nameservers):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                response = await self.query(
+                    loop, domain, nameserver,
+                    remaining / (len(self.nameservers) - n),
+                )
+            except (asyncio.TimeoutError, OSError) as error:
+                errors.append('{}: {}'.format(
+                    nameserver, str(error) or 'timed out'))
+                continue
+
+            if response.flags & dns.flags.TC:
+                return await loop.run_in_executor(
+                    None, DNSResolver(max(deadline - loop.time(), 0.1)),
+                    domain,
+                )
+            rcode = response.rcode()
+            if rcode == dns.rcode.NXDOMAIN:
+                return False, None
+            if rcode != dns.rcode.NOERROR:
+                errors.append('{}: {}'.format(
+                    nameserver, dns.rcode.to_text(rcode)))
+                continue
+            # The MX set may follow a CNAME, under the CNAME's target.
+            for rrset in response.answer:
+                if rrset.rdtype == dns.rdatatype.MX:
+                    return True, rrset.ttl
+            return False, None
+        raise DomainLookupError('; '.join(errors) or 'timed out')
+
+    async def query(self, loop, domain, nameserver, timeout):
+        import asyncio
+        import dns.message
+        import dns.rdatatype
+
+        query = dns.message.make_query(domain, dns.rdatatype.MX,
+                                       use_edns=0, payload=4096)
+        future = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DNSProtocol(query, future),
+            remote_addr=(nameserver, self.port),
+        )
+        try:
+            transport.sendto(query.to_wire())
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            transport.close()
+
+
+class StubResolver:
+    """
+    Resolver that answers from a fixed set of domains, without any
+    network access. Stands in for DNSResolver in tests and benchmarks.
+    """
+    DOMAINS = ('example.com', 'example.org', 'example.net')
+
+    def __init__(self, domains=DOMAINS, ttl=3600, delay=0):
+        self.domains = {domain.lower() for domain in domains}
+        self.ttl = ttl
+        self.delay = delay
+        self.queries = 0
+
+    def __call__(self, domain):
+        self.queries += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if domain in self.domains:
+            return True, self.ttl
+        return False, None
+
+
+class DomainVerificationCache:
+    """
+    Bounded LRU cache of domain verification results.
+
+    Positive results are kept for the TTL of the MX record set (capped
+    at ``max_ttl``), non-existent domains for ``negative_ttl``. Lookup
+    errors are not cached. ``hits`` and ``misses`` count how often the
+    resolver was avoided.
+
+    averify() uses ``async_resolver`` when there is one, and otherwise
+    runs ``resolver`` in the event loop's default executor. Concurrent
+    averify() calls for the same domain share one lookup. With
+    ``store_negative=False`` a domain found not to exist isn't cached,
+    so lookups made on behalf of unauthenticated requests can't fill
+    the cache with negative answers.
+    """
+    def __init__(self, resolver, max_size=1024, negative_ttl=300,
+                 max_ttl=86400, clock=time.monotonic, async_resolver=None):
+        self.resolver = resolver
+        self.async_resolver = async_resolver
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Lookups in progress in averify(), by domain.
+        self._pending = {}
+
+    def cached(self, domain):
+        """Return the cached result for ``domain``, or None."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(domain)
+            hit = entry is not None and entry[1] > now
+            if hit:
+                self._entries.move_to_end(domain)
+                self.hits += 1
+            else:
+                self.misses += 1
+        EMAIL_DOMAIN_LOOKUPS.inc(result='hit' if hit else 'miss')
+        return entry[0] if hit else None
+
+    def verify(self, domain):
+        """Return True if ``domain`` has MX records."""
+        domain = domain.lower().rstrip('.')
+        exists = self.cached(domain)
+        if exists is not None:
+            return exists
+
+        try:
+            with timed('dns'), EMAIL_DOMAIN_LOOKUP_SECONDS.time():
+                exists, ttl = self.resolver(domain)
+        except DomainLookupError as error:
+            logger.warning('MX lookup for %s failed: %s', domain, error)
+            return False
+        return self.record(domain, exists, ttl)
+
+    async def averify(self, domain, store_negative=True):
+        """verify(), without blocking the event loop on the lookup."""
+        import asyncio
+
+        domain = domain.lower().rstrip('.')
+        exists = self.cached(domain)
+        if exists is not None:
+            return exists
+
+        pending = self._pending.get(domain)
+        if pending is None:
+            pending = self._pending[domain] = asyncio.ensure_future(
+                self._alookup(domain, store_negative))
+            pending.add_done_callback(
+                lambda _: self._pending.pop(domain, None))
+        return await asyncio.shield(pending)
+
+    async def _alookup(self, domain, store_negative):
+        import asyncio
+
+        try:
+            with EMAIL_DOMAIN_LOOKUP_SECONDS.time():
+                if self.async_resolver is not None:
+                    exists, ttl = await self.async_resolver(domain)
+                else:
+                    exists, ttl = await asyncio.get_event_loop(
+                        ).run_in_executor(None, self.resolver, domain)
+        except DomainLookupError as error:
+            logger.warning('MX lookup for %s failed: %s', domain, error)
+            return False
+        if not exists and not store_negative:
+            return False
+        return self.record(domain, exists, ttl)
+
+    def record(self, domain, exists, ttl):
+        """Cache the resolver's answer for ``domain``, and return it."""
+        if exists:
+            ttl = min(ttl, self.max_ttl)
+        else:
+            ttl = self.negative_ttl
+        self.store(domain, exists, ttl)
+        return exists
+
+    def store(self, domain, exists, ttl):
+        """Cache a result for ``domain`` for ``ttl`` seconds."""
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[domain] = (exists, self.clock() + ttl)
+            self._entries.move_to_end(domain)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_domain_cache = None
+_domain_cache_lock = threading.Lock()
+
+
+def get_resolver():
+    """Build the resolver named by settings.EMAIL_DOMAIN_RESOLVER."""
+    resolver_class = import_string(settings.EMAIL_DOMAIN_RESOLVER)
+    if resolver_class is DNSResolver:
+        return resolver_class(timeout=settings.EMAIL_DOMAIN_RESOLVER_TIMEOUT)
+    return resolver_class()
+
+
+def get_async_resolver():
+    """
+    The asyncio counterpart of get_resolver(), or None if the
+    configured resolver has none.
+    """
+    if import_string(settings.EMAIL_DOMAIN_RESOLVER) is DNSResolver:
+        return AsyncDNSResolver(
+            timeout=settings.EMAIL_DOMAIN_RESOLVER_TIMEOUT)
+    return None
+
+
+def get_domain_cache():
+    """Return the process-wide DomainVerificationCache."""
+    global _domain_cache
+    if _domain_cache is None:
+        with _domain_cache_lock:
+            if _domain_cache is None:
+                _domain_cache = DomainVerificationCache(
+                    get_resolver(),
+                    max_size=settings.EMAIL_DOMAIN_CACHE_SIZE,
+                    negative_ttl=settings.EMAIL_DOMAIN_NEGATIVE_TTL,
+                    async_resolver=get_async_resolver(),
+                )
+    return _domain_cache
+
+
+def verify_domain(domain):
+    """Return True if ``domain`` has MX records, using the cache."""
+    return get_domain_cache().verify(domain)
+
+
+@receiver(setting_changed)
+def reset_domain_cache(setting, **kwargs):
+    global _domain_cache
+    if setting.startswith('EMAIL_DOMAIN_'):
+        _domain_cache = None
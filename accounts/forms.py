@@ -1,13 +1,36 @@
 from datetime import datetime
 from django import forms
+from django.conf import settings
+from django.contrib.auth.forms import PasswordChangeForm, UserCreationForm
 from django.contrib.auth.models import User
 
+from project_7.instrumentation import timed
+
+from .custom_password_validators import password_validators_help_text_html
+from .domain_verification import verify_domain
+from .metrics import AVATAR_PROCESSING_SECONDS, AVATAR_UPLOAD_BYTES
 from .models import Profile
 
 import logging
 logger = logging.getLogger(__name__)
 
-import dns.resolver, dns.exception
+
+class SignUpForm(UserCreationForm):
+    """UserCreationForm listing each password rule separately."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['password1'].help_text = (
+            password_validators_help_text_html()
+        )
+
+
+class ChangePasswordForm(PasswordChangeForm):
+    """PasswordChangeForm listing each password rule separately."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['new_password1'].help_text = (
+            password_validators_help_text_html()
+        )
 
 
 class UserForm(forms.ModelForm):
@@ -28,13 +51,11 @@ class UserForm(forms.ModelForm):
             raise forms.ValidationError("E-mails do not match!")
 
         # Check to make sure email has a valid domain, by checking for
-        # MX records on the email domain (requires dnspython).
+        # MX records on the email domain. Results are cached, so most
+        # domains never reach the resolver.
         domain = confirm_email.split('@')[1]
-        try:
-            logger.debug('Checking domain %s', domain)
-            results = dns.resolver.query(domain, 'MX')
-
-        except dns.exception.DNSException:
+        logger.debug('Checking domain %s', domain)
+        if not verify_domain(domain):
             logger.debug('Domain does not exist.')
 
             raise forms.ValidationError("That domain could"
@@ -43,6 +64,15 @@ class UserForm(forms.ModelForm):
         return confirm_email
 
 
+class AvatarField(forms.ImageField):
+    """ImageField whose Pillow check is timed as request phase 'image'."""
+    def to_python(self, data):
+        if not data:
+            return super().to_python(data)
+        with timed('image'), AVATAR_PROCESSING_SECONDS.time(step='check'):
+            return super().to_python(data)
+
+
 class ProfileForm(forms.ModelForm):
     """Form for editing info in Profile model"""
     birthday = forms.DateField(
@@ -52,17 +82,44 @@ class ProfileForm(forms.ModelForm):
         ))
     )
     bio = forms.CharField(required=False, widget=forms.Textarea)
-    avatar = forms.ImageField(required=False)
+    avatar = AvatarField(required=False)
 
     class Meta:
         model = Profile
         fields = ('birthday', 'bio', 'avatar')
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Errors found by AvatarUploadHandler while the upload streamed.
+        self.upload_errors = upload_errors or {}
+
+    def store_avatar(self):
+        """
+        Write a newly uploaded avatar to storage, so that save() only
+        has to update the row.
+        """
+        avatar = self.instance.avatar
+        if avatar and not avatar._committed:
+            AVATAR_UPLOAD_BYTES.observe(avatar.size)
+            with timed('image'), AVATAR_PROCESSING_SECONDS.time(step='store'):
+                avatar.save(avatar.name, avatar.file, save=False)
+
+    def clean_avatar(self):
+        if 'avatar' in self.upload_errors:
+            raise forms.ValidationError(self.upload_errors['avatar'])
+        return self.cleaned_data['avatar']
+
     def clean_bio(self):
         bio = self.cleaned_data['bio']
         if len(bio) < 10 and len(bio) != 0:
             raise forms.ValidationError(
                 "Bio must be at least 10 characters!"
             )
+        if len(bio) > settings.PROFILE_BIO_MAX_LENGTH:
+            raise forms.ValidationError(
+                "Bio can be at most {} characters!".format(
+                    settings.PROFILE_BIO_MAX_LENGTH
+                )
+            )
         return bio
 
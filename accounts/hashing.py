@@ -0,0 +1,134 @@
+"""
+Bounded pool for password hashing.
+
+PooledPBKDF2PasswordHasher runs every PBKDF2 computation (hashing a new
+password, and checking one, which re-hashes it) on a small thread pool
+instead of on the request thread. hashlib releases the GIL while it
+hashes, so the pool caps how many cores hashing can take at once,
+leaving the rest for other views.
+
+The pool admits at most PASSWORD_HASHING_WORKERS running plus
+PASSWORD_HASHING_QUEUE_DEPTH waiting hashes. Past that it raises
+HashingPoolSaturated straight away, which HashingPoolMiddleware turns
+into a 503, rather than letting requests queue indefinitely.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from project_7.instrumentation import timed
+
+from .metrics import PASSWORD_HASH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class HashingPoolSaturated(Exception):
+    """Every worker and queue slot of the hashing pool is taken."""
+
+
+class HashingPool:
+    """
+    Run hash functions on a bounded thread pool and time them.
+
+    ``stats()`` reports, per iteration count, how many hashes ran and
+    their total and longest duration in seconds.
+    """
+    def __init__(self, workers, queue_depth):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password-hashing'
+        )
+        self.slots = threading.BoundedSemaphore(workers + queue_depth)
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.rejected = 0
+
+    def run(self, iterations, function, *args):
+        """Run ``function(*args)`` on the pool and return its result."""
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise HashingPoolSaturated()
+        try:
+            return self.executor.submit(
+                self._timed, iterations, function, *args
+            ).result()
+        finally:
+            self.slots.release()
+
+    def _timed(self, iterations, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            duration = time.perf_counter() - started
+            self.record(iterations, duration)
+            PASSWORD_HASH_SECONDS.observe(duration)
+            logger.debug('Hashed %d iterations in %.1f ms',
+                         iterations, duration * 1000)
+
+    def record(self, iterations, duration):
+        with self.lock:
+            count, total, longest = self.timings.get(iterations, (0, 0, 0))
+            self.timings[iterations] = (
+                count + 1, total + duration, max(longest, duration)
+            )
+
+    def stats(self):
+        with self.lock:
+            return {
+                'rejected': self.rejected,
+                'timings': {
+                    iterations: {'count': count, 'total': total,
+                                 'max': longest}
+                    for iterations, (count, total, longest)
+                    in self.timings.items()
+                },
+            }
+
+
+_hashing_pool = None
+_hashing_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    """Return the process-wide HashingPool."""
+    global _hashing_pool
+    if _hashing_pool is None:
+        with _hashing_pool_lock:
+            if _hashing_pool is None:
+                _hashing_pool = HashingPool(
+                    settings.PASSWORD_HASHING_WORKERS,
+                    settings.PASSWORD_HASHING_QUEUE_DEPTH,
+                )
+    return _hashing_pool
+
+
+@receiver(setting_changed)
+def reset_hashing_pool(setting, **kwargs):
+    global _hashing_pool
+    if setting.startswith('PASSWORD_HASHING_'):
+        with _hashing_pool_lock:
+            pool, _hashing_pool = _hashing_pool, None
+        if pool is not None:
+            # Hashes already submitted finish on the old threads.
+            pool.executor.shutdown(wait=False)
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2PasswordHasher that hashes on the shared HashingPool. Uses the
+    same algorithm name, so existing pbkdf2_sha256 hashes still verify.
+    """
+    def encode(self, password, salt, iterations=None):
+        iterations = iterations or self.iterations
+        with timed('hash'):
+            return get_hashing_pool().run(
+                iterations, super().encode, password, salt, iterations
+            )
@@ -0,0 +1,304 @@
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from accounts.benchmarks import (BenchmarkClient, private_caches,
+                                 summarize, throwaway_database)
+
+PASSWORDS = ('Benchmark-Password-1', 'Benchmark-Password-2')
+
+ENDPOINTS = ('sign_up', 'sign_in', 'profile', 'profile_edit',
+             'change_password')
+
+DEFAULT_MIX = 'sign_up=1,sign_in=3,profile=10,profile_edit=3,change_password=1'
+
+# Status code each endpoint answers a successful request with.
+EXPECTED_STATUS = {
+    'sign_up': 302,
+    'sign_in': 302,
+    'profile': 200,
+    'profile_edit': 302,
+    'change_password': 302,
+}
+
+
+def parse_mix(value):
+    """Parse 'name=weight,...' into a dict of endpoint weights."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise CommandError('Unknown endpoint {!r} in --mix.'.format(name))
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError('Bad weight for {!r} in --mix.'.format(name))
+    return mix
+
+
+def make_avatar(size):
+    """A ``size`` x ``size`` JPEG of random noise, as bytes."""
+    from PIL import Image
+
+    image = Image.frombytes('RGB', (size, size),
+                            bytes(random.getrandbits(8)
+                                  for _ in range(size * size * 3)))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+class QueryCounter:
+    """execute_wrapper counting the queries run on the current thread."""
+    def __init__(self):
+        self.local = threading.local()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+        return execute(sql, params, many, context)
+
+    def take(self):
+        count = getattr(self.local, 'count', 0)
+        self.local.count = 0
+        return count
+
+
+class VirtualUser:
+    """A signed-up user driving the accounts pages through one client."""
+    def __init__(self, name, avatar):
+        self.name = name
+        self.avatar = avatar
+        self.password = PASSWORDS[0]
+        self.client = BenchmarkClient()
+        self.edits = 0
+
+    def sign_up(self, client=None, name=None):
+        client = client or self.client
+        name = name or self.name
+        return client.post(reverse('accounts:sign_up'), {
+            'username': name,
+            'password1': PASSWORDS[0],
+            'password2': PASSWORDS[0],
+        })
+
+    def sign_in(self):
+        return self.client.post(reverse('accounts:sign_in'), {
+            'username': self.name, 'password': self.password,
+        })
+
+    def profile(self):
+        return self.client.get(reverse('accounts:profile'))
+
+    def profile_edit(self):
+        self.edits += 1
+        data = {
+            'username': self.name,
+            'email': '{}@example.com'.format(self.name),
+            'confirm_email': '{}@example.com'.format(self.name),
+            'first_name': 'Ada',
+            'last_name': 'Lovelace',
+            'bio': 'Benchmark bio, revision {}.'.format(self.edits),
+        }
+        if self.avatar is not None and self.edits % 4 == 1:
+            data['avatar'] = SimpleUploadedFile(
+                '{}.jpg'.format(self.name), self.avatar, 'image/jpeg'
+            )
+        return self.client.post(reverse('accounts:profile_edit'), data)
+
+    def change_password(self):
+        new_password = PASSWORDS[self.password == PASSWORDS[0]]
+        response = self.client.post(reverse('accounts:change_password'), {
+            'old_password': self.password,
+            'new_password1': new_password,
+            'new_password2': new_password,
+        })
+        if response.status_code == EXPECTED_STATUS['change_password']:
+            self.password = new_password
+        return response
+
+
+class Command(BaseCommand):
+    help = ("Drive a weighted mix of the accounts pages from concurrent "
+            "clients against a throwaway copy of the database, and "
+            "report per-endpoint latency percentiles, throughput, SQL "
+            "queries and peak RSS as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Requests per client, after signing up.')
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help='Relative weight of each endpoint (default: %(default)s).',
+        )
+        parser.add_argument('--avatar-size', type=int, default=800,
+                            help='Width and height of uploaded avatars, '
+                                 'in pixels; 0 for no uploads.')
+        parser.add_argument('--fast-hashing', action='store_true',
+                            help='Hash passwords with MD5, to leave PBKDF2 '
+                                 'out of the numbers.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the request mix.')
+        parser.add_argument('--output',
+                            help='Write the JSON report here instead of '
+                                 'to stdout.')
+        parser.add_argument(
+            '--baseline',
+            help='JSON report of an earlier run; fail if any endpoint '
+                 'is slower at p95 by more than --tolerance.',
+        )
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95 slowdown against --baseline, '
+                                 'as a fraction (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        overrides = {
+            'ALLOWED_HOSTS': ['testserver'],
+            'EMAIL_DOMAIN_RESOLVER':
+                'accounts.domain_verification.StubResolver',
+            'LOGIN_THROTTLE_IP_LIMIT': 10 ** 9,
+        }
+        if options['fast_hashing']:
+            overrides['PASSWORD_HASHERS'] = [
+                'django.contrib.auth.hashers.MD5PasswordHasher'
+            ]
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        overrides['METRICS_DIR'] = os.path.join(media_root, 'metrics')
+        try:
+            with override_settings(MEDIA_ROOT=media_root, **overrides), \
+                    private_caches(), throwaway_database():
+                report = self.run(mix, options)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    def run(self, mix, options):
+        avatar = (make_avatar(options['avatar_size'])
+                  if options['avatar_size'] else None)
+        counter = QueryCounter()
+
+        samples = defaultdict(list)
+        queries = defaultdict(list)
+        errors = defaultdict(lambda: defaultdict(int))
+        lock = threading.Lock()
+        names, weights = zip(*mix.items())
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        def timed(endpoint, call):
+            counter.take()
+            started = time.perf_counter()
+            try:
+                response = call()
+            except Exception as error:
+                status = type(error).__name__
+            else:
+                status = response.status_code
+            duration = time.perf_counter() - started
+            count = counter.take()
+            with lock:
+                if status == EXPECTED_STATUS[endpoint]:
+                    samples[endpoint].append(duration)
+                    queries[endpoint].append(count)
+                else:
+                    errors[endpoint][str(status)] += 1
+
+        def client_loop(n):
+            # Connections are per thread, so each thread installs the
+            # counter on its own.
+            for alias in connections:
+                connections[alias].execute_wrappers.append(counter)
+            chooser = random.Random(options['seed'] + n)
+            user = VirtualUser('bench{}'.format(n), avatar)
+            timed('sign_up', user.sign_up)
+            for i in range(options['requests']):
+                endpoint = chooser.choices(names, weights)[0]
+                if endpoint == 'sign_up':
+                    name = 'bench{}x{}'.format(n, i)
+                    timed('sign_up', lambda: user.sign_up(
+                        BenchmarkClient(), name))
+                else:
+                    timed(endpoint, getattr(user, endpoint))
+
+        threads = [threading.Thread(target=client_loop, args=(n,))
+                   for n in range(options['clients'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            if endpoint not in samples and endpoint not in errors:
+                continue
+            counts = queries[endpoint]
+            endpoints[endpoint] = dict(
+                summarize(samples[endpoint], elapsed),
+                errors=sum(errors[endpoint].values()),
+                # Status code or exception name of each failure.
+                error_statuses=dict(errors[endpoint]),
+                queries_mean=sum(counts) / len(counts) if counts else 0,
+                queries_max=max(counts, default=0),
+            )
+        return {
+            'settings': {
+                'profile': settings.PROFILE,
+                'clients': options['clients'],
+                'requests_per_client': options['requests'],
+                'mix': mix,
+                'avatar_size': options['avatar_size'],
+                'password_hasher': settings.PASSWORD_HASHERS[0],
+            },
+            'elapsed_s': elapsed,
+            'throughput': sum(len(v) for v in samples.values()) / elapsed,
+            # ru_maxrss is in kilobytes on Linux.
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            'rss_growth_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss - rss_before,
+            'endpoints': endpoints,
+        }
+
+    def compare(self, report, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for endpoint, stats in report['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(endpoint)
+            if not before or not before['p95_ms']:
+                continue
+            change = stats['p95_ms'] / before['p95_ms'] - 1
+            self.stderr.write('{:<16} p95 {:8.1f} ms -> {:8.1f} ms '
+                              '({:+.0%})'.format(endpoint, before['p95_ms'],
+                                                 stats['p95_ms'], change))
+            if change > tolerance:
+                regressions.append(endpoint)
+        if regressions:
+            raise CommandError('p95 regressed by more than {:.0%}: {}'.format(
+                tolerance, ', '.join(regressions)))
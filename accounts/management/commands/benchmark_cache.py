@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from accounts.benchmarks import percentile
+from project_7.cache import SharedMemoryCache
+
+
+class Command(BaseCommand):
+    help = ("Compare get() hit latency and incr() of SharedMemoryCache "
+            "with LocMemCache and FileBasedCache.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keys', type=int, default=1000,
+            help='Number of keys to store and read back.',
+        )
+        parser.add_argument(
+            '--value-size', type=int, default=1024,
+            help='Size in bytes of each cached value.',
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=20,
+            help='Number of passes over every key.',
+        )
+
+    def handle(self, *args, **options):
+        keys = ['key-{}'.format(i) for i in range(options['keys'])]
+        value = 'x' * options['value_size']
+        directory = tempfile.mkdtemp(prefix='benchmark-cache-')
+        params = {'TIMEOUT': 300,
+                  'OPTIONS': {'MAX_ENTRIES': len(keys) * 4}}
+        try:
+            backends = [
+                ('LocMemCache', LocMemCache('benchmark', params)),
+                ('FileBasedCache', FileBasedCache(
+                    os.path.join(directory, 'files'), params)),
+                ('SharedMemoryCache', SharedMemoryCache(
+                    os.path.join(directory, 'shared'),
+                    {'TIMEOUT': 300, 'OPTIONS': {
+                        'MAX_ENTRIES': len(keys) * 4,
+                        'SLOT_SIZE': options['value_size'] + 256,
+                    }})),
+            ]
+            for name, cache in backends:
+                self.run_backend(name, cache, keys, value,
+                                 options['iterations'])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run_backend(self, name, cache, keys, value, iterations):
+        for key in keys:
+            cache.set(key, value)
+        latencies = []
+        misses = 0
+        for _ in range(iterations):
+            for key in keys:
+                started = time.perf_counter()
+                if cache.get(key) is None:
+                    misses += 1
+                latencies.append(time.perf_counter() - started)
+        latencies.sort()
+
+        cache.set('counter', 0)
+        started = time.perf_counter()
+        for _ in range(len(keys)):
+            cache.incr('counter')
+        incr_time = (time.perf_counter() - started) / len(keys)
+
+        self.stdout.write(
+            '{:<18} get p50 {:7.1f} us  p99 {:7.1f} us  '
+            'incr {:7.1f} us  misses {}'.format(
+                name,
+                percentile(latencies, 0.5) * 1e6,
+                percentile(latencies, 0.99) * 1e6,
+                incr_time * 1e6,
+                misses,
+            )
+        )
@@ -0,0 +1,86 @@
+import timeit
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+
+from accounts.custom_password_validators import (
+    CaseValidator, MinimumLengthValidator, NameSimilarityValidator,
+    NumberValidator, PasswordPolicyValidator, SpecialCharacterValidator,
+)
+
+SAMPLE_PASSWORDS = (
+    'Correct-Horse-Battery-9',
+    'correct horse battery staple',
+    'CORRECTHORSEBATTERY1!',
+    'short1!A',
+    'alicealicealice1!A',
+    'Ünïcödé-pässwörd-42',
+    'x' * 200,
+    'Tr0ub4dor&3-' * 10,
+)
+
+
+def run_chain(validators, password, user):
+    """Run validators like django's validate_password, collecting errors."""
+    errors = []
+    for validator in validators:
+        try:
+            validator.validate(password, user)
+        except ValidationError as error:
+            errors.extend(error.messages)
+    return errors
+
+
+class Command(BaseCommand):
+    help = ("Compare PasswordPolicyValidator with the chain of custom "
+            "validators it replaces.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=20000,
+            help='Number of times to validate each sample password.',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        user = User(username='alice', first_name='Alice',
+                    last_name='Liddell')
+        chain = [
+            NameSimilarityValidator(),
+            MinimumLengthValidator(),
+            SpecialCharacterValidator(),
+            NumberValidator(),
+            CaseValidator(),
+        ]
+        policy = [PasswordPolicyValidator()]
+
+        for password in SAMPLE_PASSWORDS:
+            if run_chain(chain, password, user) != run_chain(
+                    policy, password, user):
+                self.stderr.write(
+                    'Errors differ for {!r}'.format(password)
+                )
+
+        chain_time = timeit.timeit(
+            lambda: [run_chain(chain, password, user)
+                     for password in SAMPLE_PASSWORDS],
+            number=iterations,
+        )
+        policy_time = timeit.timeit(
+            lambda: [run_chain(policy, password, user)
+                     for password in SAMPLE_PASSWORDS],
+            number=iterations,
+        )
+
+        calls = iterations * len(SAMPLE_PASSWORDS)
+        self.stdout.write(
+            'Validator chain:  {:8.2f} us per password'.format(
+                chain_time / calls * 1e6
+            )
+        )
+        self.stdout.write(
+            'Policy validator: {:8.2f} us per password ({:.1f}x)'.format(
+                policy_time / calls * 1e6, chain_time / policy_time
+            )
+        )
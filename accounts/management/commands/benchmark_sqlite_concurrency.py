@@ -0,0 +1,108 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from accounts.benchmarks import (BenchmarkClient, private_caches,
+                                 summarize, throwaway_database)
+
+PASSWORD = 'Benchmark-Password-1'
+
+
+class Command(BaseCommand):
+    help = ("Run sign-ins and profile edits from concurrent clients "
+            "against a throwaway copy of the database, and report "
+            "latency, throughput and 'database is locked' errors. Run "
+            "it with and without DJANGO_PROFILE=production to compare.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Sign-in/edit rounds per client.')
+
+    def handle(self, *args, **options):
+        # Cheap hashing and a stub resolver keep the numbers about the
+        # database rather than PBKDF2 or DNS.
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+            EMAIL_DOMAIN_RESOLVER='accounts.domain_verification.StubResolver',
+            METRICS_DIR=None,
+        ), private_caches(), throwaway_database():
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+            self.stdout.write('Profile: {}, journal_mode: {}'.format(
+                settings.PROFILE, journal_mode
+            ))
+            self.run(options['clients'], options['iterations'])
+
+    def run(self, clients, iterations):
+        password = make_password(PASSWORD)
+        for n in range(clients):
+            User.objects.create(username='bench{}'.format(n),
+                                email='bench{}@example.com'.format(n),
+                                password=password)
+        connection.close()
+
+        latencies = {'sign_in': [], 'profile_edit': []}
+        errors = {'locked': 0, 'other': 0}
+        lock = threading.Lock()
+
+        def client_loop(n):
+            client = BenchmarkClient()
+            username = 'bench{}'.format(n)
+            for i in range(iterations):
+                for name, path, data in (
+                    ('sign_in', reverse('accounts:sign_in'),
+                     {'username': username, 'password': PASSWORD}),
+                    ('profile_edit', reverse('accounts:profile_edit'),
+                     {'username': username,
+                      'email': '{}@example.com'.format(username),
+                      'confirm_email': '{}@example.com'.format(username),
+                      'bio': 'Benchmark bio, revision {}.'.format(i)}),
+                ):
+                    started = time.perf_counter()
+                    try:
+                        response = client.post(path, data)
+                    except OperationalError as error:
+                        with lock:
+                            key = ('locked' if 'locked' in str(error)
+                                   else 'other')
+                            errors[key] += 1
+                        continue
+                    duration = time.perf_counter() - started
+                    with lock:
+                        if response.status_code == 302:
+                            latencies[name].append(duration)
+                        else:
+                            errors['other'] += 1
+
+        threads = [threading.Thread(target=client_loop, args=(n,))
+                   for n in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        for name, values in latencies.items():
+            self.stdout.write(
+                '{name:<13} {requests:6d} ok  {throughput:8.1f} req/s  '
+                'p50 {p50_ms:7.1f} ms  p95 {p95_ms:7.1f} ms  '
+                'p99 {p99_ms:7.1f} ms'.format(
+                    name=name, **summarize(values, elapsed)
+                )
+            )
+        self.stdout.write(
+            "'database is locked' errors: {locked}, other failures: "
+            "{other}".format(**errors)
+        )
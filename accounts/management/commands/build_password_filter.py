@@ -0,0 +1,60 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.bloom import BloomFilter
+
+
+def open_list(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='ignore')
+    return open(path, 'rt', encoding='utf-8', errors='ignore')
+
+
+def read_words(path):
+    with open_list(path) as f:
+        for line in f:
+            word = line.strip()
+            if word:
+                yield word
+
+
+class Command(BaseCommand):
+    help = ("Build the Bloom filter file used by BreachedPasswordValidator "
+            "from a plain-text password list, one password per line.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('source',
+                            help='Password list (.txt or .txt.gz).')
+        parser.add_argument('output', help='Filter file to write.')
+        parser.add_argument(
+            '--error-rate', type=float, default=0.001,
+            help='Target false positive rate.',
+        )
+        parser.add_argument(
+            '--count', type=int,
+            help=('Number of passwords in the list. Counted with an '
+                  'extra pass over the list if not given.'),
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = options['count']
+        if count is None:
+            count = sum(1 for _ in read_words(options['source']))
+
+        added = BloomFilter.build(
+            options['output'], read_words(options['source']), count,
+            error_rate=options['error_rate'],
+        )
+
+        password_filter = BloomFilter(options['output'])
+        self.stdout.write(
+            'Wrote {} passwords to {} ({} bits, {} hashes) in '
+            '{:.1f}s.'.format(
+                added, options['output'], password_filter.num_bits,
+                password_filter.num_hashes, time.monotonic() - started,
+            )
+        )
+        password_filter.close()
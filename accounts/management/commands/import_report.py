@@ -0,0 +1,126 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter, so nothing is imported yet. Prints a
+# JSON line with its timings; -X importtime writes to stderr.
+SCRIPT = '''
+import json, sys, time
+from wsgiref.util import setup_testing_defaults
+started = time.time()
+module, path, host, warm = sys.argv[1:]
+import django
+django.setup()
+from importlib import import_module
+application = import_module(module).application
+result = {'loaded': time.time(), 'load_ms': (time.time() - started) * 1000}
+if warm == '1':
+    from project_7.warmup import warmup
+    warmup_started = time.perf_counter()
+    warmup()
+    result['warmup_ms'] = (time.perf_counter() - warmup_started) * 1000
+for attempt in ('first', 'second'):
+    environ = {'PATH_INFO': path, 'HTTP_HOST': host}
+    setup_testing_defaults(environ)
+    statuses = []
+    request_started = time.perf_counter()
+    response = application(environ, lambda status, headers, *args:
+                           statuses.append(status))
+    b''.join(response)
+    if hasattr(response, 'close'):
+        response.close()
+    result[attempt + '_request_ms'] = (
+        (time.perf_counter() - request_started) * 1000)
+    result[attempt + '_status'] = statuses[0]
+print(json.dumps(result))
+'''
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def parse_importtime(output):
+    """Return ``(name, self_us, cumulative_us, depth)`` per import."""
+    imports = []
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, int(self_us), int(cumulative_us),
+                            len(indent) // 2))
+    return imports
+
+
+class Command(BaseCommand):
+    help = ("Start the WSGI application in a fresh interpreter under "
+            "python -X importtime, and report how long it takes to "
+            "load and to answer its first request, and which imports "
+            "cost the most.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20,
+                            help='Number of imports to list.')
+        parser.add_argument('--path', default='/',
+                            help='Path of the first request '
+                                 '(default: %(default)s).')
+        parser.add_argument('--warmup', action='store_true',
+                            help='Run project_7.warmup.warmup() before '
+                                 'the first request, as a preforking '
+                                 'server would.')
+
+    def handle(self, *args, **options):
+        module = settings.WSGI_APPLICATION.rpartition('.')[0]
+        host = (settings.ALLOWED_HOSTS[0].lstrip('.')
+                if settings.ALLOWED_HOSTS else 'localhost')
+        metrics_dir = tempfile.mkdtemp(prefix='import-report-')
+        # The application records metrics as a server would, but not
+        # into the site's METRICS_DIR.
+        env = dict(os.environ,
+                   DJANGO_SETTINGS_MODULE=os.environ.get(
+                       'DJANGO_SETTINGS_MODULE', 'project_7.settings'),
+                   DJANGO_METRICS_DIR=metrics_dir)
+        started = time.time()
+        try:
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', SCRIPT, module,
+                 options['path'], host, '1' if options['warmup'] else '0'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, env=env,
+                cwd=settings.BASE_DIR,
+            )
+        finally:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+        if process.returncode:
+            raise CommandError('The application failed to start:\n' +
+                               process.stderr[-2000:])
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        imports = parse_importtime(process.stderr)
+
+        write = self.stdout.write
+        write('Process start to application loaded: {:.0f} ms'.format(
+            (result['loaded'] - started) * 1000))
+        write('  of which django.setup() and {}: {:.0f} ms'.format(
+            module, result['load_ms']))
+        if 'warmup_ms' in result:
+            write('warmup(): {:.0f} ms'.format(result['warmup_ms']))
+        for attempt in ('first', 'second'):
+            write('{} request to {}: {:.1f} ms ({})'.format(
+                attempt.capitalize(), options['path'],
+                result[attempt + '_request_ms'],
+                result[attempt + '_status']))
+        write('Imported {} modules in {:.0f} ms in all.'.format(
+            len(imports),
+            sum(self_us for _, self_us, _, _ in imports) / 1000))
+
+        write('\nSlowest imports (cumulative ms, self ms, module):')
+        slowest = sorted(imports, key=lambda i: i[2], reverse=True)
+        for name, self_us, cumulative_us, depth in slowest[:options['top']]:
+            write('{:9.1f} {:8.1f}  {}{}'.format(
+                cumulative_us / 1000, self_us / 1000, '  ' * depth, name))
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+
+from project_7.sessions import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = ("Delete expired sessions in small batches, without holding "
+            "the database lock for the whole run. Use instead of "
+            "clearsessions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.SESSION_WRITE_BEHIND_BATCH_SIZE,
+            help='Number of sessions to delete per transaction.',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.05,
+            help='Seconds to sleep between batches.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        deleted = purge_expired_sessions(
+            Session, options['batch_size'], options['pause']
+        )
+        self.stdout.write('Deleted {} expired sessions in {:.1f}s.'.format(
+            deleted, time.monotonic() - started))
@@ -0,0 +1,106 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.domain_verification import DomainLookupError, get_resolver
+from accounts.models import Profile
+
+
+class Command(BaseCommand):
+    help = ("Re-check the e-mail domain of every user for MX records "
+            "and store the result on their profile.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of users to read and update at a time.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=16,
+            help='Number of concurrent DNS lookups.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        resolver = get_resolver()
+        # Each domain is only looked up once per run.
+        results = {}
+        counts = {'users': 0, 'verified': 0, 'unverified': 0,
+                  'skipped': 0}
+        started = time.monotonic()
+
+        users = (User.objects.order_by('pk')
+                 .values_list('pk', 'email')
+                 .iterator(chunk_size=batch_size))
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            batch = []
+            for row in users:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self.process_batch(batch, resolver, pool, results,
+                                       counts)
+                    batch = []
+            if batch:
+                self.process_batch(batch, resolver, pool, results, counts)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            "Checked {users} users across {domains} domains in "
+            "{elapsed:.2f}s ({rate:.0f} users/s): {verified} verified, "
+            "{unverified} unverified, {skipped} skipped.".format(
+                domains=len(results),
+                elapsed=elapsed,
+                rate=counts['users'] / elapsed if elapsed else 0,
+                **counts
+            )
+        )
+
+    def process_batch(self, batch, resolver, pool, results, counts):
+        domains_by_user = {}
+        for pk, email in batch:
+            if '@' in email:
+                domains_by_user[pk] = email.rsplit('@', 1)[1].lower()
+
+        new_domains = set(domains_by_user.values()) - set(results)
+        for domain, verified in zip(
+                new_domains, pool.map(self.check_domain,
+                                      [resolver] * len(new_domains),
+                                      new_domains)):
+            results[domain] = verified
+
+        verified_ids = []
+        unverified_ids = []
+        for pk, domain in domains_by_user.items():
+            if results[domain] is True:
+                verified_ids.append(pk)
+            elif results[domain] is False:
+                unverified_ids.append(pk)
+
+        now = timezone.now()
+        Profile.objects.filter(user_id__in=verified_ids).update(
+            email_domain_verified=True, email_domain_checked_at=now
+        )
+        Profile.objects.filter(user_id__in=unverified_ids).update(
+            email_domain_verified=False, email_domain_checked_at=now
+        )
+
+        counts['users'] += len(batch)
+        counts['verified'] += len(verified_ids)
+        counts['unverified'] += len(unverified_ids)
+        counts['skipped'] += (
+            len(batch) - len(verified_ids) - len(unverified_ids)
+        )
+
+    def check_domain(self, resolver, domain):
+        """Return whether domain has MX records, or None on error."""
+        try:
+            exists, ttl = resolver(domain)
+        except DomainLookupError as error:
+            self.stderr.write(
+                "Could not check {}: {}".format(domain, error)
+            )
+            return None
+        return exists
@@ -0,0 +1,38 @@
+"""
+Metrics recorded by the accounts app (see project_7.metrics).
+"""
+from project_7.metrics import Counter, Histogram
+
+# Upload sizes, from 16 KB to 16 MB.
+BYTE_BUCKETS = tuple(2 ** power for power in range(14, 25, 2))
+
+LOGIN_ATTEMPTS = Counter(
+    'accounts_login_attempts_total',
+    'Sign-in attempts, by result (success, failure or throttled).',
+    ['result'],
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    'accounts_password_hash_seconds',
+    'Time taken to hash a password on the hashing pool.',
+)
+EMAIL_DOMAIN_LOOKUPS = Counter(
+    'accounts_email_domain_lookups_total',
+    'E-mail domain checks, by whether the MX cache answered them '
+    '(hit) or the resolver was asked (miss).',
+    ['result'],
+)
+EMAIL_DOMAIN_LOOKUP_SECONDS = Histogram(
+    'accounts_email_domain_lookup_seconds',
+    'Time taken by MX lookups that missed the cache.',
+)
+AVATAR_UPLOAD_BYTES = Histogram(
+    'accounts_avatar_upload_bytes',
+    'Size of accepted avatar uploads.',
+    buckets=BYTE_BUCKETS,
+)
+AVATAR_PROCESSING_SECONDS = Histogram(
+    'accounts_avatar_processing_seconds',
+    'Time ProfileForm spends on an avatar upload, by step (check: '
+    'Pillow verifying the image, store: writing it to storage).',
+    ['step'],
+)
@@ -0,0 +1,22 @@
+from django.http import HttpResponse
+
+from .hashing import HashingPoolSaturated
+
+
+class HashingPoolMiddleware:
+    """Answer 503 when the password hashing pool is saturated."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, HashingPoolSaturated):
+            response = HttpResponse(
+                'The server is busy. Please try again shortly.',
+                content_type='text/plain', status=503,
+            )
+            response['Retry-After'] = 1
+            return response
+        return None
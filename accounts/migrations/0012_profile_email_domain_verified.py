@@ -0,0 +1,23 @@
+# Generated by Django 2.0.5 on 2026-10-18 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_auto_20180523_1405'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='email_domain_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='email_domain_verified',
+            field=models.NullBooleanField(),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.0.5 on 2026-10-18 14:32
+
+import accounts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_profile_email_domain_verified'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=accounts.storage.ContentHashStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.5 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_profile_avatar_content_hash_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='bio_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.0.5 on 2026-10-18 14:53
+
+from django.db import migrations, transaction
+from django.template.defaultfilters import linebreaksbr
+
+BATCH_SIZE = 500
+
+
+def backfill_bio_html(apps, schema_editor):
+    Profile = apps.get_model('accounts', 'Profile')
+    db_alias = schema_editor.connection.alias
+    profiles = Profile.objects.using(db_alias).exclude(bio='')
+    last_pk = 0
+    while True:
+        batch = list(profiles.filter(pk__gt=last_pk)
+                     .order_by('pk')
+                     .values_list('pk', 'bio')[:BATCH_SIZE])
+        if not batch:
+            break
+        # Commit each batch on its own, to keep write locks short.
+        with transaction.atomic(using=db_alias):
+            for pk, bio in batch:
+                Profile.objects.using(db_alias).filter(pk=pk).update(
+                    bio_html=linebreaksbr(bio, autoescape=True)
+                )
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0014_profile_bio_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_bio_html, migrations.RunPython.noop),
+    ]
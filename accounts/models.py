@@ -1,19 +1,128 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.template.defaultfilters import linebreaksbr
+from django.utils import timezone
+
+from .profile_cache import bump_profile_version
+from .storage import ContentHashStorage
+from .thumbnails import schedule_thumbnails
 
 # Create your models here.
 
 
+def render_bio(bio):
+    """Render a bio as it is displayed: escaped, with <br> for breaks."""
+    return linebreaksbr(bio, autoescape=True)
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     birthday = models.DateField(blank=True, null=True)
     bio = models.TextField(blank=True)
-    avatar = models.ImageField(null=True, blank=True)
+    # bio rendered for display; kept up to date by save().
+    bio_html = models.TextField(blank=True, editable=False)
+    avatar = models.ImageField(null=True, blank=True,
+                               storage=ContentHashStorage())
+    # Result of the last bulk MX check (manage.py verify_email_domains).
+    email_domain_verified = models.NullBooleanField()
+    email_domain_checked_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance.prep_values(field_names)
+        return instance
+
+    def prep_values(self, names=None):
+        """
+        The named fields' values (all of them by default) in the form
+        they are saved in, e.g. the file name for the avatar.
+        """
+        return {
+            field.attname: field.get_prep_value(getattr(self, field.attname))
+            for field in self._meta.concrete_fields
+            if names is None or field.attname in names
+        }
+
+    def save(self, *args, **kwargs):
+        changed = self.changed_fields()
+        update_fields = kwargs.get('update_fields')
+        if changed is None or 'bio' in changed:
+            self.bio_html = render_bio(self.bio)
+            if update_fields is not None and 'bio' in update_fields:
+                update_fields = set(update_fields) | {'bio_html'}
+        if update_fields is not None:
+            # auto_now only reaches the database if the field is saved.
+            kwargs['update_fields'] = set(update_fields) | {'updated_at'}
+        super().save(*args, **kwargs)
+        self._loaded_values = self.prep_values()
+
+    def changed_fields(self):
+        """
+        Names of the fields that differ from the database, or None if
+        this profile wasn't loaded from or saved to the database.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        current = self.prep_values(loaded)
+        return [name for name, value in loaded.items()
+                if current[name] != value]
 
     @receiver(post_save, sender=User)
     def update_user_profile(sender, instance, created, **kwargs):
         if created:
             Profile.objects.create(user=instance)
-        instance.profile.save()
+            return
+
+        # Only save a profile that has been loaded and changed along
+        # with the user; saving the user alone leaves it alone.
+        if not User.profile.related.is_cached(instance):
+            return
+        profile = instance.profile
+        changed = profile.changed_fields()
+        if changed is None:
+            profile.save()
+        elif changed:
+            profile.save(update_fields=changed)
+
+
+@receiver(post_save, sender=Profile)
+def schedule_avatar_thumbnails(sender, instance, raw=False, **kwargs):
+    """Render avatar thumbnails once the save has been committed."""
+    if instance.avatar and not raw:
+        avatar = instance.avatar
+        user_id = instance.user_id
+        transaction.on_commit(lambda: schedule_thumbnails(
+            avatar, callback=lambda: bump_profile_version(user_id)
+        ))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_profile_page(sender, instance, **kwargs):
+    bump_profile_version(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_page(sender, instance, **kwargs):
+    bump_profile_version(instance.user_id)
+
+
+def update_last_login(sender, user, **kwargs):
+    """
+    Stand-in for django.contrib.auth's update_last_login receiver that
+    only writes last_login once it is LAST_LOGIN_UPDATE_INTERVAL
+    seconds old, with a single UPDATE that skips the post_save
+    receivers.
+    """
+    now = timezone.now()
+    interval = timedelta(seconds=settings.LAST_LOGIN_UPDATE_INTERVAL)
+    if user.last_login is None or now - user.last_login >= interval:
+        User.objects.filter(pk=user.pk).update(last_login=now)
+        user.last_login = now
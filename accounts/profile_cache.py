@@ -0,0 +1,63 @@
+"""
+Versioned cache of the rendered profile page body.
+
+profile.html wraps the profile in a {% cache %} fragment that varies
+on the user and on their current profile version. Saving the User or
+Profile replaces the version, so the next view renders (and caches)
+the body afresh, and the old fragment simply ages out.
+
+Fragments and versions live in the 'template_fragments' cache, which
+must be shared by every worker (for example a FileBasedCache or
+project_7.cache.SharedMemoryCache). A version bumped by one worker has
+to be seen by all of them, or the others keep serving the fragment
+cached under their own version. Without such an alias, or if it is a
+per-process backend such as LocMemCache, profile_version() returns
+None and the profile body isn't cached.
+"""
+import uuid
+
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Backends whose entries no other process can see.
+PER_PROCESS_BACKENDS = (DummyCache, LocMemCache)
+
+
+def get_fragment_cache():
+    """The 'template_fragments' cache, or None if it isn't shared."""
+    try:
+        cache = caches['template_fragments']
+    except InvalidCacheBackendError:
+        return None
+    if isinstance(cache, PER_PROCESS_BACKENDS):
+        return None
+    return cache
+
+
+def version_key(user_id):
+    return 'accounts.profile.version.{}'.format(user_id)
+
+
+def profile_version(user_id):
+    """
+    Return the current profile version of a user, or None if profile
+    fragments aren't cached.
+    """
+    cache = get_fragment_cache()
+    if cache is None:
+        return None
+    version = cache.get(version_key(user_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        # Another process may have set it meanwhile; keep theirs.
+        if not cache.add(version_key(user_id), version, timeout=None):
+            version = cache.get(version_key(user_id), version)
+    return version
+
+
+def bump_profile_version(user_id):
+    """Invalidate the cached profile body of a user."""
+    cache = get_fragment_cache()
+    if cache is not None:
+        cache.set(version_key(user_id), uuid.uuid4().hex, timeout=None)
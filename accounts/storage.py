@@ -0,0 +1,111 @@
+"""
+Content-addressed storage for avatars.
+
+Files are named after the SHA-256 of their contents instead of the
+name the client sent, so identical uploads share one file and a name
+never changes content. That makes the URLs safe to cache forever. The
+extension comes from the image format Pillow finds in the file, not
+from the client's file name.
+
+In development, project_7.views.serve_media marks these files (and
+their thumbnails) immutable. In production MEDIA_ROOT is served by the
+web server, which has to send the header itself, for example with
+nginx::
+
+    location ~ ^/media/(thumbnails/)?avatars/[0-9a-f]{2}/[0-9a-f]{64} {
+        root /srv/project_7;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+    location /media/ {
+        root /srv/project_7;
+    }
+"""
+import hashlib
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME_RE = re.compile(r'^avatars/[0-9a-f]{2}/[0-9a-f]{64}(_\d+)?\.\w+$')
+
+# File extension of each image format, where it isn't the format's
+# name in lower case.
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'MPO': '.jpg'}
+
+
+def is_immutable_name(name):
+    """Whether ``name`` is a content-hashed avatar or thumbnail."""
+    if name.startswith('thumbnails/'):
+        name = name[len('thumbnails/'):]
+    return bool(HASHED_NAME_RE.match(name))
+
+
+def image_extension(content):
+    """
+    File extension for the image in ``content``, from its format.
+    Raises ValueError if Pillow doesn't recognize it as an image.
+    """
+    # forms.ImageField leaves the image it verified on the file.
+    image = getattr(content, 'image', None)
+    if image is None:
+        from PIL import Image
+
+        content.seek(0)
+        try:
+            with Image.open(content) as opened:
+                image_format = opened.format
+        except (IOError, SyntaxError) as error:
+            raise ValueError(
+                '{} is not an image.'.format(content.name)) from error
+        finally:
+            content.seek(0)
+    else:
+        image_format = image.format
+    return FORMAT_EXTENSIONS.get(image_format,
+                                 '.' + image_format.lower())
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """
+    Store files as ``avatars/<first two hex digits>/<sha256><ext>``.
+
+    Saving a file whose contents are already stored returns the
+    existing name without writing anything, even when another process
+    stores the same contents at the same time.
+    """
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        try:
+            return self._save(name, content)
+        except FileExistsError:
+            # Written since exists() was checked; same name, so same
+            # contents.
+            return name
+
+    def get_available_name(self, name, max_length=None):
+        # FileSystemStorage._save() asks for another name when ``name``
+        # already exists. A hashed name already holds these contents,
+        # so let save() use it as it is.
+        raise FileExistsError(name)
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        hexdigest = digest.hexdigest()
+        extension = image_extension(content)
+        return 'avatars/{}/{}{}'.format(hexdigest[:2], hexdigest, extension)
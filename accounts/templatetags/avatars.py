@@ -0,0 +1,22 @@
+from django import template
+
+from ..thumbnails import avatar_variants
+
+register = template.Library()
+
+
+@register.inclusion_tag('accounts/avatar.html')
+def avatar(profile, size='large', css_class='circle--primary--avatar'):
+    """
+    Render a profile's avatar at one of the AVATAR_THUMBNAIL_SIZES,
+    as WebP with a JPEG fallback.
+
+    Usage: {% avatar profile 'small' %}
+    """
+    webp_url, fallback_url = avatar_variants(profile.avatar, size)
+    return {
+        'alt': '{} avatar'.format(profile.user.username),
+        'css_class': css_class,
+        'webp_url': webp_url,
+        'fallback_url': fallback_url,
+    }
@@ -1,3 +1,1422 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             MemoryFileUploadHandler)
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management import call_command
+from django.db import connection
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .domain_verification import (DomainLookupError,
+                                  DomainVerificationCache, StubResolver)
+
+
+def image_bytes(width=64, height=64, image_format='JPEG'):
+    from PIL import Image
+
+    output = BytesIO()
+    Image.new('RGB', (width, height), (200, 80, 40)).save(output,
+                                                          image_format)
+    return output.getvalue()
+
+
+class TemporaryMediaMixin:
+    """Point MEDIA_ROOT at a directory removed after each test."""
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp(prefix='accounts-tests-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class SlowStubResolver(StubResolver):
+    def __init__(self):
+        super().__init__(delay=0.3)
+
+
+class ScriptedResolver:
+    """Answers each domain from ``answers``; a DomainLookupError raises."""
+    def __init__(self, answers):
+        self.answers = answers
+        self.queries = []
+
+    def __call__(self, domain):
+        self.queries.append(domain)
+        answer = self.answers[domain]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class DomainVerificationCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.resolver = ScriptedResolver({
+            'example.com': (True, 600),
+            'long.example': (True, 10 ** 6),
+            'nowhere.test': (False, None),
+            'broken.test': DomainLookupError('timed out'),
+        })
+        self.cache = DomainVerificationCache(
+            self.resolver, max_size=2, negative_ttl=30, max_ttl=3600,
+            clock=lambda: self.now,
+        )
+
+    def test_positive_results_expire_with_their_ttl(self):
+        self.assertTrue(self.cache.verify('Example.com.'))
+        self.now = 599
+        self.assertTrue(self.cache.verify('example.com'))
+        self.assertEqual(len(self.resolver.queries), 1)
+        self.now = 600
+        self.assertTrue(self.cache.verify('example.com'))
+        self.assertEqual(len(self.resolver.queries), 2)
+
+    def test_ttl_is_capped_at_max_ttl(self):
+        self.cache.verify('long.example')
+        self.now = 3599
+        self.cache.verify('long.example')
+        self.assertEqual(len(self.resolver.queries), 1)
+        self.now = 3600
+        self.cache.verify('long.example')
+        self.assertEqual(len(self.resolver.queries), 2)
+
+    def test_missing_domains_are_cached_for_the_negative_ttl(self):
+        self.assertFalse(self.cache.verify('nowhere.test'))
+        self.now = 29
+        self.assertFalse(self.cache.verify('nowhere.test'))
+        self.assertEqual(len(self.resolver.queries), 1)
+        self.now = 30
+        self.assertFalse(self.cache.verify('nowhere.test'))
+        self.assertEqual(len(self.resolver.queries), 2)
+
+    def test_lookup_errors_are_not_cached(self):
+        with self.assertLogs('accounts.domain_verification', 'WARNING'):
+            self.assertFalse(self.cache.verify('broken.test'))
+            self.assertFalse(self.cache.verify('broken.test'))
+        self.assertEqual(len(self.resolver.queries), 2)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_domain_is_evicted(self):
+        self.cache.verify('example.com')
+        self.cache.verify('nowhere.test')
+        self.cache.verify('example.com')
+        self.cache.verify('long.example')
+        self.assertEqual(self.cache.stats(),
+                         {'size': 2, 'hits': 1, 'misses': 3})
+        self.cache.verify('example.com')
+        self.assertEqual(len(self.resolver.queries), 3)
+        self.cache.verify('nowhere.test')
+        self.assertEqual(len(self.resolver.queries), 4)
+
+
+@override_settings(
+    EMAIL_DOMAIN_RESOLVER='accounts.domain_verification.StubResolver'
+)
+class VerifyEmailDomainsTests(TestCase):
+    def test_results_are_written_to_profiles(self):
+        User.objects.create(username='ann', email='ann@example.com')
+        User.objects.create(username='bob', email='bob@EXAMPLE.com')
+        User.objects.create(username='cat', email='cat@nowhere.test')
+        User.objects.create(username='dan', email='')
+
+        out = StringIO()
+        call_command('verify_email_domains', batch_size=2, stdout=out)
+
+        verified = {
+            user.username: user.profile.email_domain_verified
+            for user in User.objects.select_related('profile')
+        }
+        self.assertEqual(verified, {
+            'ann': True, 'bob': True, 'cat': False, 'dan': None,
+        })
+        self.assertIn('Checked 4 users across 2 domains', out.getvalue())
+
+
+@override_settings(LOGIN_THROTTLE_USERNAME_LIMIT=2)
+class SignInThrottleTests(TestCase):
+    def test_attempts_over_the_limit_skip_authentication(self):
+        User.objects.create_user('ann', password='Right-Password-1')
+        url = reverse('accounts:sign_in')
+        for _ in range(2):
+            response = self.client.post(
+                url, {'username': 'ann', 'password': 'wrong'}
+            )
+            self.assertEqual(response.status_code, 200)
+
+        with mock.patch('accounts.views.AuthenticationForm.is_valid') \
+                as is_valid:
+            response = self.client.post(
+                url, {'username': 'ann', 'password': 'Right-Password-1'}
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(is_valid.called)
+
+    def test_long_usernames_are_counted(self):
+        from django.core.cache import caches
+
+        from .throttling import CacheSlidingWindowLimiter, LoginThrottle
+
+        username = 'Ann' * 2000
+        key = LoginThrottle.username_key(username)
+        self.assertLessEqual(len(key), 50)
+        self.assertEqual(
+            LoginThrottle.username_key(' {} '.format(username.upper())), key)
+
+        limiter = CacheSlidingWindowLimiter(2, 300, caches['default'])
+        throttle = LoginThrottle(limiter, limiter)
+        for ip in ('10.0.0.1', '10.0.0.2'):
+            self.assertTrue(throttle.allow(username, ip))
+            throttle.record_failure(username, ip)
+        self.assertFalse(throttle.allow(username.lower(), '10.0.0.3'))
+
+
+class SignUpTests(TestCase):
+    def test_new_user_is_signed_in_with_the_profile_backend(self):
+        response = self.client.post(reverse('accounts:sign_up'), {
+            'username': 'bea',
+            'password1': 'Fresh-Password-42!',
+            'password2': 'Fresh-Password-42!',
+        })
+        self.assertRedirects(response, reverse('accounts:profile'),
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY],
+                         'accounts.backends.ProfileModelBackend')
+
+
+class HashingPoolTests(SimpleTestCase):
+    def test_setting_change_shuts_down_the_old_pool(self):
+        from .hashing import get_hashing_pool
+
+        pool = get_hashing_pool()
+        with self.settings(PASSWORD_HASHING_WORKERS=1):
+            self.assertIsNot(get_hashing_pool(), pool)
+        self.assertTrue(pool.executor._shutdown)
+
+
+class ProfileModelBackendTests(TestCase):
+    def setUp(self):
+        from .backends import ProfileModelBackend
+
+        self.backend = ProfileModelBackend()
+        self.user = User.objects.create_user('ann',
+                                             password='Right-Password-1')
+
+    def test_user_and_profile_load_in_one_query(self):
+        with self.assertNumQueries(1):
+            user = self.backend.get_user(self.user.pk)
+            self.assertEqual(user.profile.user_id, self.user.pk)
+        self.assertIsNone(self.backend.get_user(self.user.pk + 1))
+
+    @override_settings(AUTH_USER_CACHE_SIZE=10)
+    def test_cached_user_is_evicted_by_a_password_change(self):
+        self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            cached = self.backend.get_user(self.user.pk)
+        self.assertTrue(cached.check_password('Right-Password-1'))
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('accounts:change_password'), {
+            'old_password': 'Right-Password-1',
+            'new_password1': 'Newer-Password-42!',
+            'new_password2': 'Newer-Password-42!',
+        })
+        self.assertRedirects(response, reverse('accounts:profile'),
+                             fetch_redirect_response=False)
+
+        with self.assertNumQueries(1):
+            user = self.backend.get_user(self.user.pk)
+        self.assertTrue(user.check_password('Newer-Password-42!'))
+        self.assertEqual(self.client.get(
+            reverse('accounts:profile')).status_code, 200)
+
+
+@override_settings(
+    EMAIL_DOMAIN_RESOLVER='accounts.tests.SlowStubResolver'
+)
+class ProfileEditTransactionTests(TestCase):
+    def test_slow_mx_lookup_runs_outside_the_transaction(self):
+        user = User.objects.create_user('ann', 'ann@example.com')
+        self.client.force_login(user)
+
+        # Time from each SAVEPOINT to its RELEASE / ROLLBACK.
+        opened = []
+        durations = []
+
+        def time_savepoints(execute, sql, params, many, context):
+            if sql.startswith('SAVEPOINT'):
+                opened.append(time.monotonic())
+            elif 'SAVEPOINT' in sql and opened:
+                durations.append(time.monotonic() - opened.pop())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(time_savepoints):
+            response = self.client.post(reverse('accounts:profile_edit'), {
+                'username': 'ann',
+                'email': 'ann@example.com',
+                'confirm_email': 'ann@example.com',
+                'bio': 'Long enough to be a bio.',
+            })
+
+        self.assertRedirects(response, reverse('accounts:profile'))
+        self.assertTrue(durations)
+        self.assertLess(max(durations), 0.1)
+
+
+def updates(queries, tables=('auth_user', 'accounts_profile')):
+    """The captured UPDATE statements on ``tables``; sessions aside."""
+    return [query['sql'] for query in queries
+            if query['sql'].startswith(tuple(
+                'UPDATE "{}"'.format(table) for table in tables))]
+
+
+@override_settings(SESSION_WRITE_BEHIND_INTERVAL=0,
+                   EMAIL_DOMAIN_RESOLVER=(
+                       'accounts.domain_verification.StubResolver'))
+class WriteAmplificationTests(TestCase):
+    def test_last_login_is_written_once_per_interval(self):
+        User.objects.create_user('ann', password='Right-Password-1')
+        url = reverse('accounts:sign_in')
+        credentials = {'username': 'ann', 'password': 'Right-Password-1'}
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, credentials)
+        self.assertEqual(len(updates(queries)), 1)
+        self.assertIn('"last_login"', updates(queries)[0])
+
+        self.client.logout()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, credentials)
+        self.assertEqual(updates(queries), [])
+
+    def test_profile_edit_saves_the_profile_once(self):
+        user = User.objects.create_user('ann', 'ann@example.com')
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('accounts:profile_edit'), {
+                'username': 'ann',
+                'email': 'ann@example.com',
+                'confirm_email': 'ann@example.com',
+                'bio': 'Long enough to be a bio.',
+            })
+        self.assertRedirects(response, reverse('accounts:profile'),
+                             fetch_redirect_response=False)
+        self.assertEqual(len(updates(queries, ['accounts_profile'])), 1)
+        user.profile.refresh_from_db()
+        self.assertEqual(user.profile.bio, 'Long enough to be a bio.')
+
+    def test_saving_a_new_user_leaves_its_profile_alone(self):
+        user = User.objects.create_user('ann', 'ann@example.com')
+        updated_at = user.profile.updated_at
+        self.assertEqual(user.profile.changed_fields(), [])
+
+        user.first_name = 'Ann'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(updates(queries, ['accounts_profile']), [])
+        user.profile.refresh_from_db()
+        self.assertEqual(user.profile.updated_at, updated_at)
+
+
+class ProfileBioTests(TestCase):
+    def test_render_bio_escapes_and_breaks_lines(self):
+        from .models import render_bio
+
+        self.assertEqual(
+            render_bio('<b>Hi</b> & "you"\nSecond line'),
+            '&lt;b&gt;Hi&lt;/b&gt; &amp; &quot;you&quot;<br>Second line',
+        )
+
+    def test_bio_html_follows_bio(self):
+        user = User.objects.create_user('ann')
+        profile = user.profile
+        profile.bio = 'Line one\n<script>'
+        profile.save()
+        profile.refresh_from_db()
+        self.assertEqual(profile.bio_html, 'Line one<br>&lt;script&gt;')
+
+        profile.bio = 'Changed'
+        profile.save(update_fields=['bio'])
+        profile.refresh_from_db()
+        self.assertEqual(profile.bio_html, 'Changed')
+
+    def test_backfill_migration_renders_existing_bios(self):
+        from importlib import import_module
+
+        from django.apps import apps
+
+        from .models import Profile
+
+        migration = import_module('accounts.migrations.0015_backfill_bio_html')
+        for n in range(5):
+            User.objects.create_user('user{}'.format(n))
+        Profile.objects.filter(user__username__in=['user1', 'user3']).update(
+            bio='a < b\nc')
+        Profile.objects.update(bio_html='stale')
+
+        with mock.patch.object(migration, 'BATCH_SIZE', 1):
+            migration.backfill_bio_html(apps, mock.Mock(connection=connection))
+        self.assertEqual(
+            dict(Profile.objects.values_list('user__username', 'bio_html')),
+            {'user0': 'stale', 'user1': 'a &lt; b<br>c', 'user2': 'stale',
+             'user3': 'a &lt; b<br>c', 'user4': 'stale'},
+        )
+
+    @override_settings(PROFILE_BIO_MAX_LENGTH=20)
+    def test_bio_length_is_capped(self):
+        from .forms import ProfileForm
+
+        self.assertTrue(ProfileForm({'bio': 'x' * 20}).is_valid())
+        form = ProfileForm({'bio': 'x' * 21})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['bio'],
+                         ['Bio can be at most 20 characters!'])
+
+
+@override_settings(SESSION_WRITE_BEHIND_INTERVAL=0)
+class SessionEngineTests(TestCase):
+    def test_unchanged_sessions_are_not_written(self):
+        from django.contrib.sessions.models import Session
+        from project_7.sessions import SessionStore
+
+        session = SessionStore()
+        session['answer'] = 42
+        session.save()
+        self.assertTrue(Session.objects.filter(
+            session_key=session.session_key).exists())
+
+        session = SessionStore(session.session_key)
+        self.assertEqual(session['answer'], 42)
+        with self.assertNumQueries(0):
+            session.save()
+
+        session['answer'] = 43
+        session.save()
+        stored = Session.objects.get(session_key=session.session_key)
+        self.assertEqual(stored.get_decoded(), {'answer': 43})
+
+        key = session.session_key
+        session.flush()
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+
+
+@override_settings(SESSION_WRITE_BEHIND_INTERVAL=60)
+class SessionWriterTests(TestCase):
+    def setUp(self):
+        from django.contrib.sessions.models import Session
+        from project_7.sessions import SessionWriter
+
+        self.writer = SessionWriter(Session, 60, 500)
+        self.addCleanup(self.writer.stop)
+
+    def session(self, key):
+        from django.contrib.sessions.models import Session
+
+        return Session(session_key=key, session_data='',
+                       expire_date=timezone.now() + timedelta(days=1))
+
+    def test_stop_writes_queued_sessions(self):
+        from django.contrib.sessions.models import Session
+        from project_7.sessions import SessionStore, stop_session_writer
+
+        session = SessionStore()
+        session['answer'] = 42
+        session.save()
+        self.assertFalse(Session.objects.filter(
+            session_key=session.session_key).exists())
+
+        stop_session_writer()
+        self.assertTrue(Session.objects.filter(
+            session_key=session.session_key).exists())
+
+    def test_writes_stay_with_the_database_they_were_queued_for(self):
+        from django.contrib.sessions.models import Session
+
+        self.writer.write(self.session('moved'))
+        with mock.patch.dict(connection.settings_dict, NAME='elsewhere'):
+            self.assertEqual(self.writer.get('moved'), (False, None))
+            with self.assertLogs('project_7.sessions', 'WARNING'):
+                self.writer.flush()
+        self.assertEqual(self.writer.stats()['dropped'], 1)
+        self.assertFalse(Session.objects.filter(
+            session_key='moved').exists())
+
+    def test_forked_child_starts_its_own_thread(self):
+        self.writer.write(self.session('parent'))
+        parent_thread, parent_wakeup = self.writer.thread, self.writer.wakeup
+        self.assertTrue(parent_thread.is_alive())
+
+        # As seen from a forked child.
+        with mock.patch('os.getpid', return_value=self.writer.pid + 1):
+            self.assertEqual(self.writer.get('parent'), (False, None))
+            self.writer.write(self.session('child'))
+            self.assertIsNot(self.writer.thread, parent_thread)
+            self.assertTrue(self.writer.thread.is_alive())
+            self.assertEqual(self.writer.stats()['pending'], 1)
+            self.writer.stop()
+        parent_wakeup.set()
+        parent_thread.join()
+
+
+# Runs a management command in a fresh interpreter, with the database
+# file given on the command line standing in for the configured one.
+COMMAND_SCRIPT = '''
+import sys
+import django
+from django.conf import settings
+path, command = sys.argv[1:3]
+settings.DATABASES['default']['NAME'] = path
+if 'readonly' in settings.DATABASES:
+    settings.DATABASES['readonly']['NAME'] = 'file:{}?mode=ro'.format(path)
+django.setup()
+from django.core.management import call_command
+call_command(command, *sys.argv[3:])
+'''
+
+
+class ThrowawayDatabaseTests(SimpleTestCase):
+    """Benchmarks leave the configured database as they found it."""
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='accounts-tests-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'db.sqlite3')
+        shutil.copy(os.path.join(settings.BASE_DIR, 'db.sqlite3'),
+                    self.path)
+
+    def snapshot(self):
+        """
+        Row count of every table, the journal mode, and a digest of the
+        production profile's shared cache files.
+        """
+        import glob
+        import sqlite3
+
+        shared_cache = {}
+        for path in glob.glob(os.path.join(settings.BASE_DIR,
+                                           'shared_cache.mmap.*')):
+            with open(path, 'rb') as f:
+                shared_cache[path] = hashlib.md5(f.read()).hexdigest()
+
+        db = sqlite3.connect(self.path)
+        try:
+            tables = [name for name, in db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")]
+            return {
+                'counts': {table: db.execute(
+                    'SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]
+                    for table in tables},
+                'journal_mode': db.execute(
+                    'PRAGMA journal_mode').fetchone()[0],
+                'shared_cache': shared_cache,
+            }
+        finally:
+            db.close()
+
+    def run_command(self, *args):
+        import subprocess
+        import sys
+
+        # The production profile is the one that switches to WAL.
+        env = dict(os.environ, DJANGO_PROFILE='production',
+                   DJANGO_SETTINGS_MODULE='project_7.settings')
+        # Set here once project_7.wsgi has been imported.
+        env.pop('DJANGO_METRICS_DIR', None)
+        process = subprocess.run(
+            [sys.executable, '-c', COMMAND_SCRIPT, self.path] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, env=env, cwd=settings.BASE_DIR,
+        )
+        self.assertEqual(process.returncode, 0, process.stderr[-2000:])
+        return process.stdout
+
+    def test_benchmark_sqlite_concurrency(self):
+        before = self.snapshot()
+        output = self.run_command('benchmark_sqlite_concurrency',
+                                  '--clients', '2', '--iterations', '2')
+        self.assertIn('journal_mode: wal', output)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_benchmark_accounts(self):
+        before = self.snapshot()
+        output = self.run_command(
+            'benchmark_accounts', '--clients', '2', '--requests', '6',
+            '--avatar-size', '0', '--fast-hashing',
+        )
+        endpoints = json.loads(output)['endpoints']
+        self.assertEqual(endpoints['sign_up']['errors'], 0)
+        self.assertEqual(self.snapshot(), before)
+
+
+@override_settings(
+    EMAIL_DOMAIN_RESOLVER='accounts.tests.SlowStubResolver'
+)
+class ASGIPrewarmTests(TestCase):
+    def setUp(self):
+        from accounts.domain_verification import get_domain_cache
+
+        self.cache = get_domain_cache()
+        self.cache.clear()
+        self.cache.resolver.queries = 0
+
+    def post(self, email, cookie=None, count=1, chunks=1, headers=()):
+        """
+        POST a profile_edit form to the ASGI application ``count`` times
+        at once, in ``chunks`` messages each; return the statuses.
+        """
+        import asyncio
+        from project_7.asgi import application
+
+        body = (b'--b\r\nContent-Disposition: form-data; '
+                b'name="confirm_email"\r\n\r\n' + email.encode() +
+                b'\r\n--b--\r\n')
+        scope = {
+            'type': 'http', 'method': 'POST', 'headers': [
+                (b'content-type', b'multipart/form-data; boundary=b'),
+            ] + list(headers),
+            'path': reverse('accounts:profile_edit'),
+            'server': ('testserver', 80),
+        }
+        if cookie:
+            scope['headers'].append((b'cookie', cookie.encode()))
+        size = -(-len(body) // chunks)
+
+        async def post():
+            messages = []
+            parts = [body[i:i + size] for i in range(0, len(body), size)]
+
+            async def receive():
+                part = parts.pop(0)
+                return {'type': 'http.request', 'body': part,
+                        'more_body': bool(parts)}
+
+            async def send(message):
+                messages.append(message)
+
+            await application(scope, receive, send)
+            return messages[0]['status']
+
+        async def post_many():
+            return await asyncio.gather(*(post() for _ in range(count)))
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(post_many())
+        finally:
+            loop.close()
+
+    def test_signed_in_lookups_are_shared_and_cached(self):
+        started = time.monotonic()
+        cookie = '{}=abc'.format(settings.SESSION_COOKIE_NAME)
+        statuses = self.post('ann@Example.com', cookie=cookie, count=20)
+
+        # The session is unknown, so redirected; the lookup was still
+        # made, once.
+        self.assertEqual(set(statuses), {302})
+        self.assertLess(time.monotonic() - started, 0.3 * 5)
+        self.assertEqual(self.cache.resolver.queries, 1)
+        self.assertIs(self.cache.cached('example.com'), True)
+
+    def test_no_lookup_without_a_session_cookie(self):
+        self.assertEqual(self.post('ann@example.com', cookie='other=1'),
+                         [302])
+        self.assertEqual(self.cache.resolver.queries, 0)
+        self.assertIsNone(self.cache.cached('example.com'))
+
+    def test_missing_domains_are_not_cached(self):
+        cookie = '{}=abc'.format(settings.SESSION_COOKIE_NAME)
+        self.post('ann@missing.example', cookie=cookie)
+        self.assertEqual(self.cache.resolver.queries, 1)
+        self.assertIsNone(self.cache.cached('missing.example'))
+
+    def test_repeated_cookie_headers_are_joined(self):
+        from project_7.asgi import wsgi_environ
+
+        environ = wsgi_environ({
+            'type': 'http', 'method': 'GET', 'path': '/',
+            'headers': [(b'cookie', b'sessionid=abc'),
+                        (b'accept', b'text/html'),
+                        (b'cookie', b'csrftoken=def'),
+                        (b'accept', b'*/*')],
+        }, BytesIO(), 0)
+        self.assertEqual(environ['HTTP_COOKIE'],
+                         'sessionid=abc; csrftoken=def')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,*/*')
+        request = WSGIRequest(environ)
+        self.assertEqual(request.COOKIES,
+                         {'sessionid': 'abc', 'csrftoken': 'def'})
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=20,
+                       AVATAR_MAX_UPLOAD_SIZE=20)
+    def test_oversized_bodies_are_refused(self):
+        # By their Content-Length, before any of the body is read...
+        self.assertEqual(self.post('ann@example.com',
+                                   headers=[(b'content-length', b'41')]),
+                         [413])
+        # ...or once more than the limit has arrived.
+        self.assertEqual(self.post('ann@example.com', chunks=4), [413])
+
+
+class SharedFragmentCacheMixin:
+    """Configure a 'template_fragments' cache shared between processes."""
+    def setUp(self):
+        super().setUp()
+        location = tempfile.mkdtemp(prefix='accounts-fragments-')
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        settings_override = self.settings(CACHES=dict(
+            settings.CACHES, template_fragments={
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            },
+        ))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ProfileFragmentCacheTests(SharedFragmentCacheMixin, TestCase):
+    def test_versions_need_a_shared_cache(self):
+        from .profile_cache import get_fragment_cache, profile_version
+
+        user = User.objects.create_user('ann')
+        version = profile_version(user.pk)
+        self.assertIsNotNone(version)
+        user.save()
+        self.assertNotEqual(profile_version(user.pk), version)
+
+        caches = dict(settings.CACHES)
+        caches['template_fragments'] = {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+        with self.settings(CACHES=caches):
+            self.assertIsNone(get_fragment_cache())
+            self.assertIsNone(profile_version(user.pk))
+        del caches['template_fragments']
+        with self.settings(CACHES=caches):
+            self.assertIsNone(profile_version(user.pk))
+
+    def test_profile_page_renders_with_and_without_fragment_cache(self):
+        user = User.objects.create_user('ann', first_name='Ann')
+        self.client.force_login(user)
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertContains(response, 'Name: Ann')
+
+        caches = dict(settings.CACHES)
+        del caches['template_fragments']
+        with self.settings(CACHES=caches):
+            response = self.client.get(reverse('accounts:profile'))
+        self.assertContains(response, 'Name: Ann')
+
+
+@override_settings(EMAIL_DOMAIN_RESOLVER=(
+    'accounts.domain_verification.StubResolver'))
+class ProfileConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ann', 'ann@example.com')
+        self.client.force_login(self.user)
+        self.url = reverse('accounts:profile')
+        self.response = self.client.get(self.url)
+        self.assertEqual(self.response.status_code, 200)
+
+    def test_matching_etag_is_not_modified(self):
+        from .profile_cache import bump_profile_version
+
+        # The ETag doesn't depend on the (per-cache) fragment version.
+        bump_profile_version(self.user.pk)
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=self.response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], self.response['ETag'])
+
+    def test_unmodified_since_is_not_modified(self):
+        response = self.client.get(
+            self.url,
+            HTTP_IF_MODIFIED_SINCE=self.response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_edit_changes_the_etag(self):
+        response = self.client.post(reverse('accounts:profile_edit'), {
+            'username': 'ann',
+            'first_name': 'Ann',
+            'email': 'ann@example.com',
+            'confirm_email': 'ann@example.com',
+            'bio': 'Long enough to be a bio.',
+        })
+        self.assertRedirects(response, self.url)
+
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=self.response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], self.response['ETag'])
+        self.assertContains(response, 'Name: Ann')
+
+
+@override_settings(AVATAR_THUMBNAIL_WORKERS=0)
+class ThumbnailTests(SharedFragmentCacheMixin, TemporaryMediaMixin,
+                     TestCase):
+    def test_rendering_thumbnails_bumps_the_profile_version(self):
+        from .profile_cache import bump_profile_version, profile_version
+        from .thumbnails import avatar_variants, schedule_thumbnails
+
+        user = User.objects.create_user('ann')
+        avatar = user.profile.avatar
+        avatar.save('ann.jpg', ContentFile(image_bytes(300, 200)),
+                    save=False)
+        self.assertEqual(avatar_variants(avatar, 'large'),
+                         (None, avatar.url))
+        version = profile_version(user.pk)
+
+        schedule_thumbnails(
+            avatar, callback=lambda: bump_profile_version(user.pk))
+
+        self.assertNotEqual(profile_version(user.pk), version)
+        webp_url, jpeg_url = avatar_variants(avatar, 'large')
+        self.assertTrue(webp_url.endswith('.webp'))
+        self.assertTrue(jpeg_url.endswith('.jpg'))
+        # Known to be rendered now, so storage isn't asked again.
+        with mock.patch.object(avatar.storage, 'exists') as exists:
+            avatar_variants(avatar, 'small')
+        self.assertFalse(exists.called)
+
+
+class CountingUploadHandler(FileUploadHandler):
+    """Counts the bytes that reach the handlers after the avatar's."""
+    received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+@override_settings(AVATAR_MAX_UPLOAD_SIZE=256 * 2 ** 10)
+class AvatarUploadHandlerTests(SimpleTestCase):
+    def upload(self, content):
+        from .upload_handlers import AvatarUploadHandler
+
+        request = RequestFactory().post('/', {
+            'avatar': SimpleUploadedFile('avatar.jpg', content),
+        })
+        avatar_upload = AvatarUploadHandler(request)
+        counter = CountingUploadHandler(request)
+        request.upload_handlers = [avatar_upload, counter,
+                                   MemoryFileUploadHandler(request)]
+        return request.FILES, avatar_upload, counter
+
+    def test_oversized_upload_is_skipped_once_past_the_limit(self):
+        content = image_bytes() + bytes(4 * 2 ** 20)
+        files, avatar_upload, counter = self.upload(content)
+
+        self.assertNotIn('avatar', files)
+        self.assertIn('smaller than', avatar_upload.errors['avatar'])
+        # Reading stopped at the chunk that crossed the limit, and that
+        # chunk wasn't passed on.
+        self.assertLessEqual(counter.received,
+                             settings.AVATAR_MAX_UPLOAD_SIZE)
+        self.assertLessEqual(avatar_upload.received,
+                             settings.AVATAR_MAX_UPLOAD_SIZE +
+                             avatar_upload.chunk_size)
+
+    def test_non_image_is_skipped_after_its_first_chunk(self):
+        files, avatar_upload, counter = self.upload(b'MZ' * 2 ** 20)
+
+        self.assertNotIn('avatar', files)
+        self.assertEqual(avatar_upload.errors['avatar'],
+                         'Upload a JPEG, PNG, GIF or WebP image.')
+        self.assertEqual(counter.received, 0)
+        self.assertLessEqual(avatar_upload.received,
+                             avatar_upload.chunk_size)
+
+
+    @override_settings(AVATAR_MAX_UPLOAD_SIZE=5 * 2 ** 20)
+    def test_webp_past_the_header_limit_is_accepted(self):
+        from PIL import Image
+
+        from .upload_handlers import HEADER_LIMIT
+
+        # VP8L, VP8 and, with an alpha channel, VP8X first chunks.
+        for mode, options in (('RGB', {'lossless': True}),
+                              ('RGB', {'quality': 100}),
+                              ('RGBA', {'quality': 100})):
+            with self.subTest(mode=mode, **options):
+                image = Image.frombytes(mode, (800, 600), os.urandom(
+                    800 * 600 * len(mode)))
+                output = BytesIO()
+                image.save(output, 'WEBP', **options)
+                content = output.getvalue()
+                self.assertGreater(len(content), HEADER_LIMIT)
+
+                files, avatar_upload, counter = self.upload(content)
+                self.assertEqual(avatar_upload.errors, {})
+                self.assertEqual(avatar_upload.dimensions, (800, 600))
+                self.assertEqual(files['avatar'].size, len(content))
+
+
+class ContentHashStorageTests(TemporaryMediaMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        from .storage import ContentHashStorage
+
+        self.storage = ContentHashStorage()
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(settings.MEDIA_ROOT)
+                for name in names]
+
+    def test_names_come_from_contents_and_image_format(self):
+        from .storage import HASHED_NAME_RE, is_immutable_name
+        from .thumbnails import thumbnail_name
+
+        png = image_bytes(image_format='PNG')
+        name = self.storage.save('photo.JPG', ContentFile(png))
+
+        self.assertRegex(name, HASHED_NAME_RE)
+        self.assertTrue(name.endswith('.png'))
+        self.assertIn(hashlib.sha256(png).hexdigest(), name)
+        self.assertTrue(is_immutable_name(
+            thumbnail_name(name, 100, 'webp')))
+        self.assertFalse(is_immutable_name('avatars/photo.jpg'))
+
+    def test_identical_uploads_share_one_file(self):
+        content = image_bytes()
+        first = self.storage.save('a.jpg', ContentFile(content))
+        second = self.storage.save('b.jpeg', ContentFile(content))
+        other = self.storage.save('a.jpg', ContentFile(image_bytes(65)))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_concurrent_save_of_the_same_contents_keeps_one_file(self):
+        content = image_bytes()
+        first = self.storage.save('a.jpg', ContentFile(content))
+        # As if another process wrote it after exists() was checked.
+        with mock.patch.object(self.storage, 'exists', return_value=False):
+            second = self.storage.save('b.jpg', ContentFile(content))
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_non_images_are_refused(self):
+        with self.assertRaises(ValueError):
+            self.storage.save('a.jpg', ContentFile(b'not an image'))
+
+
+class PasswordPolicyValidatorTests(SimpleTestCase):
+    def setUp(self):
+        from .custom_password_validators import (
+            CaseValidator, MinimumLengthValidator, NameSimilarityValidator,
+            NumberValidator, PasswordPolicyValidator,
+            SpecialCharacterValidator,
+        )
+
+        self.chain = [
+            NameSimilarityValidator(),
+            MinimumLengthValidator(),
+            SpecialCharacterValidator(),
+            NumberValidator(),
+            CaseValidator(),
+        ]
+        self.policy = PasswordPolicyValidator()
+
+    def errors(self, validators, password, user):
+        """(code, message) of every error, as validate_password sees them."""
+        errors = []
+        for validator in validators:
+            try:
+                validator.validate(password, user)
+            except ValidationError as error:
+                errors.extend((e.code, message) for e in error.error_list
+                              for message in e.messages)
+        return errors
+
+    def test_errors_match_the_validator_chain(self):
+        from .management.commands.benchmark_password_validators import (
+            SAMPLE_PASSWORDS,
+        )
+
+        users = [None, User(username='alice', first_name='Alice',
+                            last_name='Liddell')]
+        passwords = SAMPLE_PASSWORDS + (
+            '', 'a', 'A', '1', '!', 'ALICE-liddell-2019!',
+            'Liddell is 14 chars!', 'ÅÄÖ-åäö-12345678',
+        )
+        for user in users:
+            for password in passwords:
+                with self.subTest(user=user, password=password):
+                    self.assertEqual(
+                        self.errors([self.policy], password, user),
+                        self.errors(self.chain, password, user),
+                    )
+
+    def test_help_texts_list_each_rule(self):
+        from .custom_password_validators import (
+            password_validators_help_text_html,
+            password_validators_help_texts,
+        )
+
+        help_texts = password_validators_help_texts([self.policy])
+        self.assertEqual(help_texts, [validator.get_help_text()
+                                      for validator in self.chain])
+        self.assertEqual(
+            password_validators_help_text_html([self.policy]).count('<li>'),
+            len(self.chain),
+        )
+
+
+class PasswordFilterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.source = os.path.join(directory, 'passwords.txt')
+        self.path = os.path.join(directory, 'passwords.bloom')
+        with open(self.source, 'w') as f:
+            f.write('password\nLetMeIn123\n\n  dragon  \n')
+
+    def test_build_password_filter(self):
+        from .bloom import BloomFilter
+        from .custom_password_validators import BreachedPasswordValidator
+
+        out = StringIO()
+        call_command('build_password_filter', self.source, self.path,
+                     stdout=out)
+        self.assertIn('Wrote 3 passwords', out.getvalue())
+
+        password_filter = BloomFilter(self.path)
+        self.addCleanup(password_filter.close)
+        self.assertEqual(password_filter.count, 3)
+        self.assertIn('dragon', password_filter)
+        self.assertIn('LETMEIN123', password_filter)
+
+        validator = BreachedPasswordValidator(self.path)
+        with self.assertRaises(ValidationError) as error:
+            validator.validate('letmein123')
+        self.assertEqual(error.exception.code, 'password_too_common')
+        validator.validate('Correct horse battery staple 9!')
+        validator.filter.close()
+
+    def test_not_a_filter_file(self):
+        from .bloom import BloomFilter
+
+        with self.assertRaises(ValueError):
+            BloomFilter(self.source)
+
+    def test_missing_filter_file_skips_the_check(self):
+        from .custom_password_validators import BreachedPasswordValidator
+
+        validator = BreachedPasswordValidator(self.path)
+        with self.assertLogs('accounts.custom_password_validators',
+                             'WARNING'):
+            validator.validate('password')
+        self.assertTrue(validator.missing)
+
+
+def increment_shared_counter(location, times):
+    """Target of the processes in SharedMemoryCacheTests."""
+    from project_7.cache import SharedMemoryCache
+
+    cache = SharedMemoryCache(location, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SharedMemoryCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='accounts-tests-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.location = os.path.join(directory, 'cache.mmap')
+
+    def cache(self, **options):
+        from project_7 import cache
+
+        shared_cache = cache.SharedMemoryCache(self.location,
+                                               {'OPTIONS': options})
+        shared_map = shared_cache._map
+
+        def close():
+            cache._maps.pop(shared_map.path, None)
+            shared_map.map.close()
+            os.close(shared_map.fd)
+        self.addCleanup(close)
+        return shared_cache
+
+    def test_incr_is_exact_across_processes(self):
+        import multiprocessing
+
+        cache = self.cache()
+        cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=increment_shared_counter,
+                            args=(self.location, 200))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(cache.get('counter'), 800)
+
+    def test_entries_and_file_size_are_bounded(self):
+        from project_7.cache import HEADER
+
+        cache = self.cache(MAX_ENTRIES=16, WAYS=4, SLOT_SIZE=256)
+        for n in range(200):
+            cache.set('key{}'.format(n), n)
+        self.assertEqual(os.path.getsize(cache._map.path),
+                         HEADER.size + 16 * 256)
+        live = [n for n in range(200) if cache.has_key('key{}'.format(n))]
+        self.assertLessEqual(len(live), 16)
+        self.assertIn(199, live)
+
+        # Too big for a slot: not cached, and no older value left.
+        with self.assertLogs('project_7.cache', 'WARNING'):
+            cache.set('key199', 'x' * 256)
+        self.assertIsNone(cache.get('key199'))
+
+    def test_long_keys_are_hashed(self):
+        cache = self.cache(SLOT_SIZE=512)
+        keys = ['throttle:' + 'a' * 1000, 'throttle:' + 'a' * 999 + 'b']
+        for n, key in enumerate(keys):
+            cache.set(key, n)
+            cache.incr(key)
+        self.assertEqual([cache.get(key) for key in keys], [1, 2])
+
+    def test_each_layout_has_its_own_file(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from project_7.cache import layout_path
+
+        small = self.cache(MAX_ENTRIES=16, WAYS=4, SLOT_SIZE=256)
+        small.set('key', 'small')
+        large = self.cache(MAX_ENTRIES=32, WAYS=4, SLOT_SIZE=256)
+        self.assertNotEqual(small._map.path, large._map.path)
+        self.assertIsNone(large.get('key'))
+        # The other layout's file, still mapped, is left alone.
+        self.assertEqual(small.get('key'), 'small')
+
+        # A file with this layout's name but other contents is refused.
+        with open(layout_path(self.location, 8, 4, 512), 'wb') as f:
+            f.write(b'not a cache file')
+        with self.assertRaises(ImproperlyConfigured):
+            self.cache(MAX_ENTRIES=32, WAYS=4, SLOT_SIZE=512)
+
+    def test_full_bucket_evicts_the_entry_expiring_soonest(self):
+        # Four slots in a single bucket.
+        cache = self.cache(MAX_ENTRIES=4, WAYS=4, SLOT_SIZE=256)
+        cache.set('forever', 1, timeout=None)
+        cache.set('soon', 2, timeout=10)
+        cache.set('later', 3, timeout=100)
+        cache.set('latest', 4, timeout=1000)
+        cache.set('new', 5, timeout=1000)
+        self.assertIsNone(cache.get('soon'))
+        self.assertEqual(
+            [cache.get(key) for key in ('forever', 'later', 'latest', 'new')],
+            [1, 3, 4, 5],
+        )
+
+
+class PrecompressedStaticFilesTests(SimpleTestCase):
+    def setUp(self):
+        from project_7.staticfiles import PrecompressedStaticFiles
+
+        root = tempfile.mkdtemp(prefix='accounts-tests-')
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        for name, content in (('site.css', b'body{color:red}' * 20),
+                              ('site.css.gz', b'gzip bytes'),
+                              ('site.css.br', b'br')):
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(content)
+        self.application = PrecompressedStaticFiles(
+            lambda environ, start_response: [], root=root, prefix='/static/')
+
+    def get(self, path, **headers):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+        environ.update(headers)
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        response['content'] = b''.join(self.application(environ,
+                                                        start_response))
+        return response
+
+    def test_accept_encoding_picks_the_variant(self):
+        for accept_encoding, encoding, content in (
+            ('gzip, deflate, br', 'br', b'br'),
+            ('gzip', 'gzip', b'gzip bytes'),
+            ('br;q=0, gzip;q=0.5', 'gzip', b'gzip bytes'),
+            ('', None, b'body{color:red}' * 20),
+        ):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.get('/static/site.css',
+                                    HTTP_ACCEPT_ENCODING=accept_encoding)
+                headers = response['headers']
+                self.assertEqual(response['status'], '200 OK')
+                self.assertEqual(headers.get('Content-Encoding'), encoding)
+                self.assertEqual(headers['Content-Type'], 'text/css')
+                self.assertEqual(headers['Vary'], 'Accept-Encoding')
+                self.assertEqual(response['content'], content)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get('/static/site.css',
+                        HTTP_ACCEPT_ENCODING='gzip')['headers']['ETag']
+        response = self.get('/static/site.css', HTTP_ACCEPT_ENCODING='gzip',
+                            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response['status'], '304 Not Modified')
+        self.assertEqual(response['content'], b'')
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+
+        # Another variant has another ETag.
+        response = self.get('/static/site.css', HTTP_ACCEPT_ENCODING='br',
+                            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response['status'], '200 OK')
+
+    def test_compressed_copies_are_served_as_downloads(self):
+        for name, content_type in (('site.css.gz', 'application/gzip'),
+                                   ('site.css.br', 'application/x-brotli')):
+            with self.subTest(name=name):
+                headers = self.get('/static/' + name,
+                                   HTTP_ACCEPT_ENCODING='gzip, br')['headers']
+                self.assertEqual(headers['Content-Type'], content_type)
+                self.assertNotIn('Content-Encoding', headers)
+
+
+class CriticalCSSTests(SimpleTestCase):
+    def test_keeps_font_faces_and_layout_rules(self):
+        from project_7.staticfiles import critical_rules
+
+        css = critical_rules('''
+            @import url("https://example.com/remote.css");
+            /* .circle--header { color: blue } */
+            @font-face { font-family: "Sans"; src: url("a;b.woff2") }
+            .circle--header a, form { color: red; }
+            form input { border: 0; }
+            .circle--headers { color: green; }
+            @media (min-width: 550px) {
+                .grid-50 { width: 50%; }
+                .form-error { display: none; }
+            }
+            @media print { textarea { display: none; } }
+        ''')
+        self.assertEqual(
+            css,
+            '@font-face{font-family:"Sans";src:url("a;b.woff2")}'
+            '.circle--header a,form{color:red}'
+            '@media (min-width:550px){.grid-50{width:50%}}',
+        )
+
+    def test_layout_inlines_critical_css_with_local_fonts(self):
+        from django.template.loader import render_to_string
+
+        html = render_to_string('layout.html',
+                                request=RequestFactory().get('/'))
+        self.assertIn('<style>@font-face{', html)
+        self.assertIn('url("/static/fonts/work-sans-400.woff2")', html)
+        self.assertNotIn('fonts.googleapis.com', html)
+        self.assertNotIn('fonts.gstatic.com', html)
+
+    def test_collectstatic_writes_critical_css(self):
+        from project_7.staticfiles import CRITICAL_CSS_NAME, get_critical_css
+
+        root = tempfile.mkdtemp(prefix='accounts-tests-')
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        with override_settings(
+            PROFILE='production', STATIC_ROOT=root,
+            STATICFILES_STORAGE=('project_7.staticfiles.'
+                                 'BundledManifestStaticFilesStorage'),
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with open(os.path.join(root, CRITICAL_CSS_NAME),
+                      encoding='utf-8') as f:
+                css = f.read()
+            self.assertEqual(get_critical_css(), css)
+        self.assertRegex(
+            css, r'url\("/static/fonts/work-sans-400\.[0-9a-f]{12}\.woff2"\)')
+        self.assertIn('.circle--header{', css)
+
+    @override_settings(PROFILE='development')
+    def test_extracted_again_only_when_the_source_changes(self):
+        from django.contrib.staticfiles import finders
+        from project_7 import staticfiles
+
+        source = finders.find(staticfiles.CRITICAL_CSS_SOURCE)
+        stat = os.stat(source)
+        self.addCleanup(os.utime, source,
+                        ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        with mock.patch.object(staticfiles, 'absolute_urls',
+                               wraps=staticfiles.absolute_urls) as extract:
+            css = staticfiles.get_critical_css()
+            self.assertEqual(staticfiles.get_critical_css(), css)
+            self.assertEqual(extract.call_count, 1)
+
+            os.utime(source, ns=(stat.st_atime_ns,
+                                 stat.st_mtime_ns + 10 ** 9))
+            self.assertEqual(staticfiles.get_critical_css(), css)
+            self.assertEqual(extract.call_count, 2)
+
+
+class ServerTimingTests(TestCase):
+    @override_settings(SERVER_TIMING=False, INTERNAL_IPS=['10.0.0.1'])
+    def test_only_internal_ips_get_timings(self):
+        url = reverse('accounts:sign_in')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+        response = self.client.get(url, REMOTE_ADDR='10.0.0.1')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing_setting_sends_them_to_everyone(self):
+        response = self.client.get(reverse('accounts:sign_in'))
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_profile_file_names_are_slugified_and_truncated(self):
+        from project_7.instrumentation import (PROFILE_PATH_LENGTH,
+                                               InstrumentationMiddleware)
+
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        with self.settings(INSTRUMENTATION_PROFILE_DIR=profile_dir):
+            middleware = InstrumentationMiddleware(None)
+        profiler = mock.Mock()
+        factory = RequestFactory()
+        for path, slug in [
+            ('/', 'root'),
+            ('/accounts/sign-in/', 'accounts-sign-in'),
+            ('/../%00é<x>/', 'ex'),
+            ('/' + 'a/' * 100, '-'.join('a' * 25)),
+        ]:
+            request = factory.get(path)
+            saved = middleware.save_profile(profiler, request, 0.5)
+            self.assertEqual(os.path.dirname(saved), profile_dir)
+            self.assertEqual(os.path.basename(saved).split('-', 2)[2],
+                             slug + '-500ms.prof')
+            self.assertLessEqual(len(slug), PROFILE_PATH_LENGTH)
+            profiler.dump_stats.assert_called_with(saved)
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='accounts-tests-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write_exited_process_file(self, key, value):
+        """A metrics file left by a process that has exited."""
+        import subprocess
+        import sys
+
+        from project_7.metrics import MetricsFile
+
+        pid = subprocess.run([sys.executable, '-c', 'import os; '
+                              'print(os.getpid())'],
+                             stdout=subprocess.PIPE).stdout.strip()
+        metrics_file = MetricsFile(os.path.join(
+            self.directory, 'metrics-{}.db'.format(int(pid))))
+        metrics_file.add(key, value)
+        metrics_file.close()
+
+    def test_nothing_is_recorded_without_metrics_dir(self):
+        from accounts.metrics import LOGIN_ATTEMPTS
+        from project_7.metrics import registry
+
+        with self.settings(METRICS_DIR=None):
+            LOGIN_ATTEMPTS.inc(result='success')
+            self.assertIsNone(registry.file)
+            self.assertEqual(registry.collect(), {})
+
+    def test_files_of_exited_processes_are_merged(self):
+        from accounts.metrics import LOGIN_ATTEMPTS
+        from project_7.metrics import registry, sample_key
+
+        key = sample_key('accounts_login_attempts_total',
+                         {'result': 'success'})
+        self.write_exited_process_file(key, 3)
+        self.write_exited_process_file(key, 4)
+        with self.settings(METRICS_DIR=self.directory):
+            self.assertEqual(registry.collect(), {key: 7.0})
+            LOGIN_ATTEMPTS.inc(result='success')
+            self.assertEqual(registry.collect(), {key: 8.0})
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory)
+                   if name.endswith('.db')),
+            sorted(['metrics-merged.db',
+                    'metrics-{}.db'.format(os.getpid())]),
+        )
+
+    def test_token_replaces_ip_allowlist(self):
+        def status(**headers):
+            return self.client.get(reverse('metrics'), **headers).status_code
+
+        with self.settings(METRICS_DIR=self.directory, METRICS_TOKEN=None):
+            self.assertEqual(status(), 200)
+            self.assertEqual(status(REMOTE_ADDR='10.0.0.1'), 404)
+        with self.settings(METRICS_DIR=self.directory,
+                           METRICS_TOKEN='secret'):
+            self.assertEqual(status(), 404)
+            self.assertEqual(status(HTTP_AUTHORIZATION='Bearer wrong'), 404)
+            self.assertEqual(status(REMOTE_ADDR='10.0.0.1',
+                                    HTTP_AUTHORIZATION='Bearer secret'), 200)
+
+
+class WarmupTests(SimpleTestCase):
+    def test_warmup_does_the_first_request_work(self):
+        from django.db import connections
+        from django.template.engine import Engine
+        from django.urls import clear_url_caches, get_resolver
+
+        from project_7.warmup import warmup
+
+        clear_url_caches()
+        self.addCleanup(clear_url_caches)
+        with mock.patch.object(Engine, 'get_template', autospec=True,
+                               side_effect=Engine.get_template) as compile, \
+                mock.patch.object(connections, 'close_all') as close_all, \
+                self.assertLogs('project_7.warmup', 'INFO'):
+            warmup()
+
+        compiled = {args[1] for args, _ in compile.call_args_list}
+        self.assertLessEqual({'layout.html', 'accounts/profile.html',
+                              'accounts/profile_body.html'}, compiled)
+        # reverse() tables built, so the first reverse() doesn't.
+        self.assertTrue(get_resolver()._populated)
+        close_all.assert_called_once_with()
+
+    # The test runner adds 'testserver', which the child process,
+    # loading the settings afresh, wouldn't allow.
+    @override_settings(ALLOWED_HOSTS=[])
+    def test_import_report_starts_the_application(self):
+        output = StringIO()
+        call_command('import_report', '--top', '3', '--warmup',
+                     stdout=output)
+        output = output.getvalue()
+        self.assertIn('warmup():', output)
+        self.assertRegex(output, r'First request to /: [\d.]+ ms \(200 OK\)')
+        self.assertRegex(output, r'Second request to /: [\d.]+ ms \(200 OK\)')
+        slowest = output.split('Slowest imports')[1].strip().splitlines()
+        self.assertEqual(len(slowest), 1 + 3)
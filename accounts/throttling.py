@@ -0,0 +1,186 @@
+"""
+Sign-in throttling.
+
+Failed sign-ins are counted per username and per client IP over a
+sliding window. Once either count reaches its limit, sign_in turns
+attempts away before AuthenticationForm runs, so a credential-stuffing
+burst costs a few dictionary or cache lookups per request instead of a
+password hash.
+
+Counts are kept in-process by default. Set LOGIN_THROTTLE_CACHE to a
+CACHES alias to share them between workers.
+"""
+import hashlib
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class SlidingWindowLimiter:
+    """
+    In-process limiter: remembers the time of every event per key for
+    ``window`` seconds.
+    """
+    def __init__(self, limit, window, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.events = defaultdict(deque)
+        self.lock = threading.Lock()
+        self.last_purge = clock()
+
+    def _expire(self, events, now):
+        while events and events[0] <= now - self.window:
+            events.popleft()
+
+    def _purge(self, now):
+        """Drop keys whose events have all expired."""
+        for key in [key for key, events in self.events.items()
+                    if not events or events[-1] <= now - self.window]:
+            del self.events[key]
+        self.last_purge = now
+
+    def is_limited(self, key):
+        now = self.clock()
+        with self.lock:
+            events = self.events.get(key)
+            if not events:
+                return False
+            self._expire(events, now)
+            return len(events) >= self.limit
+
+    def hit(self, key):
+        now = self.clock()
+        with self.lock:
+            if now - self.last_purge > self.window:
+                self._purge(now)
+            events = self.events[key]
+            self._expire(events, now)
+            events.append(now)
+
+    def reset(self, key):
+        with self.lock:
+            self.events.pop(key, None)
+
+
+class CacheSlidingWindowLimiter:
+    """
+    Limiter backed by a Django cache, shared by every worker using it.
+
+    Uses a sliding window counter: events are counted in fixed buckets
+    of ``window`` seconds, and the previous bucket is weighted by how
+    much of it still overlaps the window.
+    """
+    def __init__(self, limit, window, cache, clock=time.time):
+        self.limit = limit
+        self.window = window
+        self.cache = cache
+        self.clock = clock
+
+    def _keys(self, key, now):
+        bucket = int(now // self.window)
+        return ('login-throttle:{}:{}'.format(key, bucket),
+                'login-throttle:{}:{}'.format(key, bucket - 1))
+
+    def is_limited(self, key):
+        now = self.clock()
+        current_key, previous_key = self._keys(key, now)
+        counts = self.cache.get_many([current_key, previous_key])
+        overlap = 1 - (now % self.window) / self.window
+        estimate = (counts.get(current_key, 0) +
+                    counts.get(previous_key, 0) * overlap)
+        return estimate >= self.limit
+
+    def hit(self, key):
+        current_key, _ = self._keys(key, self.clock())
+        self.cache.add(current_key, 0, timeout=self.window * 2)
+        try:
+            self.cache.incr(current_key)
+        except ValueError:
+            # Expired between add() and incr().
+            self.cache.set(current_key, 1, timeout=self.window * 2)
+
+    def reset(self, key):
+        now = self.clock()
+        self.cache.delete_many(self._keys(key, now))
+
+
+class LoginThrottle:
+    """Limit failed sign-ins per username and per client IP."""
+    def __init__(self, username_limiter, ip_limiter):
+        self.username_limiter = username_limiter
+        self.ip_limiter = ip_limiter
+        self.allowed = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def username_key(username):
+        # Hashed, so that any username gives a short cache key.
+        return 'user:{}'.format(hashlib.sha1(
+            username.strip().lower().encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def ip_key(ip):
+        return 'ip:{}'.format(ip)
+
+    def allow(self, username, ip):
+        """Return whether a sign-in attempt may go ahead."""
+        limited = (self.ip_limiter.is_limited(self.ip_key(ip)) or
+                   self.username_limiter.is_limited(
+                       self.username_key(username)))
+        with self.lock:
+            if limited:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        return not limited
+
+    def record_failure(self, username, ip):
+        self.username_limiter.hit(self.username_key(username))
+        self.ip_limiter.hit(self.ip_key(ip))
+
+    def record_success(self, username):
+        self.username_limiter.reset(self.username_key(username))
+
+    def stats(self):
+        with self.lock:
+            return {'allowed': self.allowed, 'rejected': self.rejected}
+
+
+_login_throttle = None
+_login_throttle_lock = threading.Lock()
+
+
+def build_limiter(limit):
+    window = settings.LOGIN_THROTTLE_WINDOW
+    if settings.LOGIN_THROTTLE_CACHE:
+        return CacheSlidingWindowLimiter(
+            limit, window, caches[settings.LOGIN_THROTTLE_CACHE]
+        )
+    return SlidingWindowLimiter(limit, window)
+
+
+def get_login_throttle():
+    """Return the process-wide LoginThrottle."""
+    global _login_throttle
+    if _login_throttle is None:
+        with _login_throttle_lock:
+            if _login_throttle is None:
+                _login_throttle = LoginThrottle(
+                    build_limiter(settings.LOGIN_THROTTLE_USERNAME_LIMIT),
+                    build_limiter(settings.LOGIN_THROTTLE_IP_LIMIT),
+                )
+    return _login_throttle
+
+
+@receiver(setting_changed)
+def reset_login_throttle(setting, **kwargs):
+    global _login_throttle
+    if setting.startswith('LOGIN_THROTTLE_'):
+        _login_throttle = None
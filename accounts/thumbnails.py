@@ -0,0 +1,167 @@
+"""
+Fixed-size thumbnails of Profile.avatar.
+
+After a profile with an avatar is saved, its thumbnails are rendered
+by a pool of worker processes, so profile_edit never waits on Pillow.
+Each size in settings.AVATAR_THUMBNAIL_SIZES is written as WebP and as
+a JPEG fallback. Until they exist, templates fall back to the original
+upload.
+
+Avatar names are content hashes (see accounts.storage), so once an
+avatar's thumbnails exist they stay there. Each process remembers the
+avatars it has seen rendered, and only asks storage about the others.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from project_7.instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+# (extension, Pillow format, save options)
+THUMBNAIL_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True,
+                     'progressive': True}),
+)
+
+# How many rendered avatars each process remembers.
+RENDERED_CACHE_SIZE = 4096
+
+_pool = None
+_pool_lock = threading.Lock()
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+
+
+def thumbnail_name(name, size, extension):
+    """Storage name of the ``size`` thumbnail of ``name``."""
+    root, _ = os.path.splitext(name)
+    return 'thumbnails/{}_{}.{}'.format(root, size, extension)
+
+
+def thumbnail_names(name):
+    """Map (size, extension) to the storage name of every thumbnail."""
+    return {
+        (size, extension): thumbnail_name(name, size, extension)
+        for size in settings.AVATAR_THUMBNAIL_SIZES.values()
+        for extension, _, _ in THUMBNAIL_FORMATS
+    }
+
+
+def mark_rendered(name):
+    """Remember that every thumbnail of avatar ``name`` exists."""
+    with _rendered_lock:
+        _rendered[name] = True
+        _rendered.move_to_end(name)
+        while len(_rendered) > RENDERED_CACHE_SIZE:
+            _rendered.popitem(last=False)
+
+
+def thumbnails_rendered(field_file):
+    """Whether every thumbnail of ``field_file`` has been rendered."""
+    if field_file.name in _rendered:
+        return True
+    storage = field_file.storage
+    if all(storage.exists(name)
+           for name in thumbnail_names(field_file.name).values()):
+        mark_rendered(field_file.name)
+        return True
+    return False
+
+
+def render_thumbnails(source_path, targets):
+    """
+    Render every thumbnail of the image at ``source_path``.
+
+    ``targets`` maps (size, extension) to an output path. Runs in a
+    worker process, so it only deals in paths.
+    """
+    from PIL import Image, ImageOps
+
+    formats = {extension: (image_format, options)
+               for extension, image_format, options in THUMBNAIL_FORMATS}
+    with Image.open(source_path) as image:
+        image.draft('RGB', (max(size for size, _ in targets),) * 2)
+        image = image.convert('RGB')
+        for (size, extension), path in targets.items():
+            image_format, options = formats[extension]
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+            thumbnail.save(temporary_path, image_format, **options)
+            os.replace(temporary_path, path)
+    return sorted(targets.values())
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Imported here: it costs more than the rest of the
+                # module, and most processes never render a thumbnail.
+                from concurrent.futures import ProcessPoolExecutor
+
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.AVATAR_THUMBNAIL_WORKERS
+                )
+    return _pool
+
+
+def schedule_thumbnails(field_file, callback=None):
+    """
+    Queue thumbnail rendering for an avatar, unless every thumbnail
+    already exists. ``callback`` is called without arguments once they
+    have been rendered. Returns the Future, or None if nothing was
+    queued.
+    """
+    storage = field_file.storage
+    targets = {
+        key: storage.path(name)
+        for key, name in thumbnail_names(field_file.name).items()
+        if not storage.exists(name)
+    }
+    if not targets:
+        mark_rendered(field_file.name)
+        return None
+
+    source_path = storage.path(field_file.name)
+    if not settings.AVATAR_THUMBNAIL_WORKERS:
+        with timed('image'):
+            render_thumbnails(source_path, targets)
+        mark_rendered(field_file.name)
+        if callback is not None:
+            callback()
+        return None
+
+    def done(future):
+        error = future.exception()
+        if error is not None:
+            logger.error('Rendering avatar thumbnails failed: %r', error)
+            return
+        mark_rendered(field_file.name)
+        if callback is not None:
+            callback()
+
+    future = get_pool().submit(render_thumbnails, source_path, targets)
+    future.add_done_callback(done)
+    return future
+
+
+def avatar_variants(field_file, size_name):
+    """
+    Return ``(webp_url, fallback_url)`` for the named thumbnail size.
+    ``webp_url`` is None while the thumbnails have not been rendered,
+    in which case ``fallback_url`` is the original upload.
+    """
+    if not thumbnails_rendered(field_file):
+        return None, field_file.url
+    size = settings.AVATAR_THUMBNAIL_SIZES[size_name]
+    storage = field_file.storage
+    return (storage.url(thumbnail_name(field_file.name, size, 'webp')),
+            storage.url(thumbnail_name(field_file.name, size, 'jpg')))
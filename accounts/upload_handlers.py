@@ -0,0 +1,165 @@
+"""
+Upload handler that validates avatar uploads while they stream in.
+
+AvatarUploadHandler sits in front of Django's default handlers and
+passes every chunk through to them. For the avatar field it checks the
+file signature on the first bytes, reads the pixel dimensions from the
+image header without decoding the image, and counts bytes as they
+arrive. As soon as one of those checks fails the rest of the file is
+skipped, so a large or bogus upload is never buffered or written out.
+"""
+import struct
+import sys
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+from project_7.instrumentation import timed
+
+# File signatures of the image formats we accept, and where they sit.
+IMAGE_SIGNATURES = (
+    (0, b'\xff\xd8\xff'),
+    (0, b'\x89PNG\r\n\x1a\n'),
+    (0, b'GIF87a'),
+    (0, b'GIF89a'),
+    (8, b'WEBP'),
+)
+SIGNATURE_LENGTH = 12
+
+# How much of the file may be read looking for the image dimensions.
+HEADER_LIMIT = 256 * 2 ** 10
+
+# RIFF header and first chunk header of a WebP file, and enough of the
+# chunk to hold the dimensions in each of its three encodings.
+WEBP_HEADER_LENGTH = 30
+
+
+def matches_signature(header):
+    return any(header[offset:offset + len(signature)] == signature
+               for offset, signature in IMAGE_SIGNATURES)
+
+
+def read_webp_dimensions(header):
+    """
+    Return the (width, height) from the first chunk of a WebP file, or
+    None if it is incomplete or not one of VP8, VP8L and VP8X.
+    """
+    if len(header) < WEBP_HEADER_LENGTH:
+        return None
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and header[23:26] == b'\x9d\x01\x2a':
+        # Keyframe start code, then 14-bit width and height.
+        width, height = struct.unpack_from('<HH', header, 26)
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L' and header[20] == 0x2f:
+        # 14 bits each of width - 1 and height - 1.
+        bits = struct.unpack_from('<I', header, 21)[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X':
+        # 24 bits each of canvas width - 1 and height - 1.
+        return (int.from_bytes(header[24:27], 'little') + 1,
+                int.from_bytes(header[27:30], 'little') + 1)
+    return None
+
+
+def read_dimensions(header):
+    """
+    Return the (width, height) from an image header, or None if the
+    header is incomplete. Pillow only parses the header here; pixel
+    data is never decoded. Pillow can't open a truncated WebP file, so
+    its dimensions are read from the chunk header instead.
+    """
+    from PIL import Image
+
+    if header[8:12] == b'WEBP':
+        return read_webp_dimensions(header)
+
+    try:
+        with Image.open(BytesIO(header)) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        # Far past any sensible avatar size; report it as oversized.
+        return sys.maxsize, sys.maxsize
+    except (IOError, SyntaxError, ValueError):
+        return None
+
+
+class AvatarUploadHandler(FileUploadHandler):
+    """
+    Reject avatar uploads that are too large, are not images, or have
+    too many pixels, before they are stored. Rejections are collected
+    in ``errors`` (field name -> message) for the form to report.
+    """
+    def __init__(self, request=None, field_name='avatar'):
+        super().__init__(request)
+        self.field_name = field_name
+        self.max_size = settings.AVATAR_MAX_UPLOAD_SIZE
+        self.max_width, self.max_height = settings.AVATAR_MAX_DIMENSIONS
+        self.errors = {}
+        self.active = False
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name == self.field_name
+        self.received = 0
+        self.header = bytearray()
+        self.dimensions = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.reject(
+                'Avatar files must be smaller than {} MB.'.format(
+                    self.max_size // 2 ** 20
+                )
+            )
+
+        if self.dimensions is None:
+            self.header.extend(raw_data[:HEADER_LIMIT - len(self.header)])
+            self.check_header(complete=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.active and self.dimensions is None:
+            try:
+                self.check_header(complete=True)
+            except SkipFile:
+                # Too late to skip a file that has already been read;
+                # the form reports the error from self.errors instead.
+                pass
+        self.active = False
+        # Let the next handler build the uploaded file.
+        return None
+
+    def check_header(self, complete):
+        if len(self.header) >= SIGNATURE_LENGTH or complete:
+            if not matches_signature(bytes(self.header[:SIGNATURE_LENGTH])):
+                self.reject('Upload a JPEG, PNG, GIF or WebP image.')
+
+        with timed('image'):
+            self.dimensions = read_dimensions(bytes(self.header))
+        if self.dimensions is None:
+            if complete or len(self.header) >= HEADER_LIMIT:
+                self.reject('The avatar could not be read as an image.')
+            return
+
+        self.header = bytearray()
+        width, height = self.dimensions
+        if width > self.max_width or height > self.max_height:
+            self.reject(
+                'Avatars can be at most {}x{} pixels.'.format(
+                    self.max_width, self.max_height
+                )
+            )
+
+    def reject(self, message):
+        self.errors[self.field_name] = message
+        self.active = False
+        self.header = bytearray()
+        # Stops the parser from passing the rest of the file to any
+        # handler; the partial file is discarded.
+        raise SkipFile(message)
@@ -1,27 +1,54 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import (authenticate, login, logout,
-                                 update_session_auth_hash)
+from django.contrib.auth import login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.forms import (AuthenticationForm,
-                                       UserCreationForm,
-                                       PasswordChangeForm)
+from django.contrib.auth.forms import AuthenticationForm
 from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
-from .forms import ProfileForm, UserForm
+from .forms import ChangePasswordForm, ProfileForm, SignUpForm, UserForm
+from .metrics import LOGIN_ATTEMPTS
+from .profile_cache import profile_version
+from .throttling import get_login_throttle
+from .thumbnails import thumbnails_rendered
+from .upload_handlers import AvatarUploadHandler
 
 
 def sign_in(request):
     form = AuthenticationForm()
     if request.method == 'POST':
+        # Turn away throttled attempts before any password is hashed.
+        throttle = get_login_throttle()
+        username = request.POST.get('username', '')
+        ip = request.META.get('REMOTE_ADDR', '')
+        if not throttle.allow(username, ip):
+            LOGIN_ATTEMPTS.inc(result='throttled')
+            messages.error(
+                request,
+                "Too many failed sign-in attempts. "
+                "Please try again later."
+            )
+            response = render(request, 'accounts/sign_in.html',
+                              {'form': form}, status=429)
+            response['Retry-After'] = settings.LOGIN_THROTTLE_WINDOW
+            return response
+
         form = AuthenticationForm(data=request.POST)
         if form.is_valid():
+            throttle.record_success(username)
             if form.user_cache is not None:
                 user = form.user_cache
                 if user.is_active:
                     login(request, user)
+                    LOGIN_ATTEMPTS.inc(result='success')
                     return HttpResponseRedirect(
                         reverse('accounts:profile')
                     )
@@ -35,20 +62,22 @@ def sign_in(request):
                     request,
                     "Username or password is incorrect."
                 )
+        else:
+            throttle.record_failure(username, ip)
+            LOGIN_ATTEMPTS.inc(result='failure')
     return render(request, 'accounts/sign_in.html', {'form': form})
 
 
 def sign_up(request):
-    form = UserCreationForm()
+    form = SignUpForm()
     if request.method == 'POST':
-        form = UserCreationForm(data=request.POST)
+        form = SignUpForm(data=request.POST)
         if form.is_valid():
-            form.save()
-            user = authenticate(
-                username=form.cleaned_data['username'],
-                password=form.cleaned_data['password1']
-            )
-            login(request, user)
+            # The new user is signed in as is; authenticating them again
+            # would only hash the password a second time.
+            user = form.save()
+            login(request, user,
+                  backend='accounts.backends.ProfileModelBackend')
             messages.success(
                 request,
                 "You're now a user! You've been signed in, too."
@@ -65,24 +94,78 @@ def sign_out(request):
     return HttpResponseRedirect(reverse('home'))
 
 
+def profile_etag(user, profile):
+    """
+    ETag of a profile page, from the stored fields it displays and
+    whether its avatar thumbnails are ready. The same in every process
+    and across restarts.
+    """
+    avatar_ready = bool(profile.avatar) and thumbnails_rendered(
+        profile.avatar)
+    state = '\0'.join(str(value) for value in (
+        user.pk, user.username, user.first_name, user.last_name,
+        user.email, profile.updated_at.isoformat(), profile.birthday,
+        profile.avatar.name, avatar_ready,
+    ))
+    return quote_etag(hashlib.md5(state.encode()).hexdigest())
+
+
 @login_required
 def profile(request):
     """Displays user's profile"""
     profile = request.user.profile
-    return render(request, 'accounts/profile.html', {'profile': profile})
+    etag = profile_etag(request.user, profile)
+    last_modified = int(profile.updated_at.timestamp())
+
+    # A page with pending messages has to be rendered to show them.
+    response = None
+    if not len(messages.get_messages(request)):
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+    if response is None:
+        response = render(request, 'accounts/profile.html', {
+            'profile': profile,
+            'profile_version': profile_version(request.user.pk),
+            'cache_timeout': settings.PROFILE_FRAGMENT_CACHE_TIMEOUT,
+        })
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
 
 
 @login_required
-@transaction.atomic
+@csrf_exempt
 def profile_edit(request):
     """Edit information in User and Profile models"""
+    # Upload handlers have to be in place before anything reads
+    # request.POST, which CsrfViewMiddleware would otherwise do; CSRF
+    # is checked by _profile_edit instead.
+    avatar_upload = AvatarUploadHandler(request)
+    request.upload_handlers.insert(0, avatar_upload)
+    return _profile_edit(request, avatar_upload)
+
+
+@csrf_protect
+def _profile_edit(request, avatar_upload):
     if request.method == 'POST':
         user_form = UserForm(request.POST, instance=request.user)
         profile_form = ProfileForm(request.POST, request.FILES,
-                                   instance=request.user.profile)
+                                   instance=request.user.profile,
+                                   upload_errors=avatar_upload.errors)
+        # Validation (the MX lookup and image checks) and writing the
+        # avatar file happen outside the transaction, which only
+        # covers the row updates.
         if user_form.is_valid() and profile_form.is_valid():
-            user_form.save()
-            profile_form.save()
+            profile_form.store_avatar()
+            # The profile is saved first. It is the instance cached on
+            # request.user, so update_user_profile then finds nothing
+            # changed and doesn't save it a second time.
+            with transaction.atomic():
+                profile_form.save()
+                user_form.save()
             messages.success(request, 'Your profile was updated!')
             return HttpResponseRedirect(reverse('accounts:profile'))
         else:
@@ -100,20 +183,23 @@ def profile_edit(request):
 
 
 @login_required
-@transaction.atomic
 def change_password(request):
     """Change password in User model"""
     if request.method == 'POST':
-        form = PasswordChangeForm(request.user, request.POST)
+        form = ChangePasswordForm(request.user, request.POST)
+        # Checking the old password and hashing the new one happen
+        # outside the transaction, which only covers the update.
         if form.is_valid():
-            user = form.save()
+            user = form.save(commit=False)
+            with transaction.atomic():
+                user.save(update_fields=['password'])
             update_session_auth_hash(request, user)
             messages.success(request, 'You changed your password!')
             return redirect('accounts:profile')
         else:
             messages.error(request, 'Please correct the error below')
     else:
-        form = PasswordChangeForm(request.user)
+        form = ChangePasswordForm(request.user)
     return render(
         request, 'accounts/change_password.html', {'form': form}
     )
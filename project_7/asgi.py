@@ -0,0 +1,262 @@
+"""
+ASGI config for project_7 project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``, for any ASGI 3 server::
+
+    uvicorn project_7.asgi:application --workers 4
+
+Django 2.0 only runs WSGI applications, so requests are handed to the
+WSGI application from project_7.wsgi on a pool of ASGI_THREADS
+threads. Each request runs from start to finish on one thread,
+response iteration and close() included, so Django's per-thread
+database connections are opened and closed as they are under a WSGI
+server.
+
+The wait that would hold a thread longest happens before the handoff,
+on the event loop. For a profile_edit POST, the e-mail domain in its
+confirm_email field is looked up with AsyncDNSResolver, and the answer
+is cached. UserForm then finds it in the cache and doesn't wait on DNS.
+One process can keep many edits waiting on their lookups, and a thread
+is only taken once the answer is in. The lookup is bounded by
+EMAIL_DOMAIN_RESOLVER_TIMEOUT. If it fails, nothing is cached, and the
+view looks the domain up again itself.
+
+This happens before Django's authentication and CSRF checks, so it is
+only done for requests carrying a session cookie, and only domains
+that exist are cached; the view caches the others itself once the
+request has been let through. A forged cookie still gets a lookup, but
+can't make the cache reject a real domain.
+
+Settings and DJANGO_METRICS_DIR come from project_7.wsgi, as for a
+WSGI server.
+
+Request bodies are spooled to a temporary file past
+FILE_UPLOAD_MAX_MEMORY_SIZE, and responses are buffered, since the
+pages served here are small. Bodies larger than an avatar
+(AVATAR_MAX_UPLOAD_SIZE) plus the rest of a form
+(DATA_UPLOAD_MAX_MEMORY_SIZE) are answered with 413 as soon as their
+Content-Length, or the bytes received so far, say so.
+"""
+import asyncio
+import logging
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+
+from accounts.domain_verification import get_domain_cache
+
+from .wsgi import application as wsgi_application
+
+logger = logging.getLogger(__name__)
+
+# Only the start of a multipart body is searched for confirm_email;
+# the template puts UserForm's fields before the avatar.
+PREWARM_SCAN_BYTES = 64 * 2 ** 10
+MULTIPART_FIELD_RE = re.compile(
+    rb'name="confirm_email"\r\n(?:[^\r\n]+\r\n)*\r\n([^\r\n]*)\r\n'
+)
+
+
+def confirm_email(content_type, body):
+    """The confirm_email field of a form body, or None."""
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        values = parse_qs(body.decode('latin-1')).get('confirm_email')
+        return values[0] if values else None
+    if content_type.startswith('multipart/form-data'):
+        match = MULTIPART_FIELD_RE.search(body)
+        if match:
+            return match.group(1).decode('utf-8', 'replace')
+    return None
+
+
+def header(scope, name):
+    """The value of header ``name`` (lowercase bytes) in ``scope``."""
+    separator = '; ' if name == b'cookie' else ', '
+    return separator.join(value.decode('latin-1')
+                          for key, value in scope.get('headers', ())
+                          if key.lower() == name)
+
+
+def max_body_size():
+    """The largest request body accepted, or None for no limit."""
+    if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is None:
+        return None
+    return (settings.DATA_UPLOAD_MAX_MEMORY_SIZE +
+            settings.AVATAR_MAX_UPLOAD_SIZE)
+
+
+class RequestBodyTooLarge(Exception):
+    pass
+
+
+def wsgi_environ(scope, body, length):
+    """Build the WSGI environ for an ASGI HTTP request scope."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI strings hold bytes as latin-1 code points.
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8')
+                                                .decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version',
+                                                      '1.1')),
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+        if name in environ:
+            # HTTP/2 clients may split Cookie into several headers.
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = environ[name] + separator + value
+        environ[name] = value
+    return environ
+
+
+class ASGIApplication:
+    """Run ``wsgi_application`` for ASGI servers; see the module docstring."""
+    def __init__(self, wsgi_application, threads=None):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads or settings.ASGI_THREADS,
+            thread_name_prefix='asgi',
+        )
+        self.prewarm_path = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(
+                'Unsupported ASGI scope type {!r}.'.format(scope['type']))
+
+        try:
+            body, length = await self.read_body(scope, receive)
+        except RequestBodyTooLarge:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body',
+                        'body': b'Request body too large.'})
+            return
+        if body is None:
+            return
+        try:
+            if scope['method'] == 'POST':
+                await self.prewarm(scope, body)
+            status, headers, content = await asyncio.get_event_loop(
+                ).run_in_executor(self.executor, self.run,
+                                  wsgi_environ(scope, body, length))
+        finally:
+            body.close()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, scope, receive):
+        """
+        Return the request body, as a file positioned at its start, and
+        its length; or ``(None, 0)`` if the client went away. Raise
+        RequestBodyTooLarge past max_body_size().
+        """
+        limit = max_body_size()
+        declared = header(scope, b'content-length')
+        if (limit is not None and declared.isdigit() and
+                int(declared) > limit):
+            raise RequestBodyTooLarge
+        body = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        length = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None, 0
+            chunk = message.get('body', b'')
+            length += len(chunk)
+            if limit is not None and length > limit:
+                body.close()
+                raise RequestBodyTooLarge
+            body.write(chunk)
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body, length
+
+    async def prewarm(self, scope, body):
+        """Cache the MX lookup a profile_edit POST is about to need."""
+        if self.prewarm_path is None:
+            self.prewarm_path = reverse('accounts:profile_edit')
+        if scope['path'] != self.prewarm_path:
+            return
+        if settings.SESSION_COOKIE_NAME not in parse_cookie(
+                header(scope, b'cookie')):
+            # Not signed in: the view will only redirect.
+            return
+        content_type = header(scope, b'content-type').lower()
+        email = confirm_email(content_type, body.read(PREWARM_SCAN_BYTES))
+        body.seek(0)
+        if email and '@' in email:
+            try:
+                await get_domain_cache().averify(email.rpartition('@')[2],
+                                                 store_negative=False)
+            except Exception:
+                # The view will look the domain up itself.
+                logger.exception('Could not prewarm MX lookup')
+
+    def run(self, environ):
+        """Run the WSGI application, on an executor thread."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            # Sends request_finished, which closes this thread's
+            # database connections when they are due.
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], content
+
+
+application = ASGIApplication(wsgi_application)
@@ -0,0 +1,366 @@
+"""
+Cache backend kept in a memory-mapped file, shared by every worker on
+the host.
+
+The file holds a fixed number of equally sized slots, grouped into
+buckets of WAYS slots. A key can only live in its own bucket, so a
+lookup reads at most WAYS slot headers. When a bucket is full, setting
+a new key evicts the bucket's entry that expires soonest, so the cache
+never grows past MAX_ENTRIES * SLOT_SIZE bytes. Keys longer than
+MAX_KEY_LENGTH bytes are stored as a hash of the key. Values that don't
+fit in a slot are not cached, and a warning is logged. Keys don't
+spread evenly over buckets, so size MAX_ENTRIES at two to four times
+the number of live keys expected.
+
+The file's name is LOCATION with the layout appended
+(.<buckets>x<ways>x<slot size>), so workers started with different
+OPTIONS, as during a rolling deploy, use different files rather than
+resizing one the others have mapped. Remove the files of old layouts
+once no worker uses them. A file with the right name but the wrong
+contents is refused, never overwritten.
+
+Buckets are guarded by LOCK_STRIPES byte-range locks on the file
+(fcntl.lockf), which serialize writers across processes, together with
+a thread lock per stripe within a process. incr() reads and writes under
+one lock, so counters stay exact across workers.
+
+Example::
+
+    CACHES = {
+        'shared': {
+            'BACKEND': 'project_7.cache.SharedMemoryCache',
+            'LOCATION': '/var/tmp/project_7-cache',
+            'OPTIONS': {'MAX_ENTRIES': 16384, 'SLOT_SIZE': 4096},
+        },
+    }
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'P7CACHE1'
+# magic, number of buckets, slots per bucket, slot size
+HEADER = struct.Struct('<8sQII')
+# key hash (0 for an empty slot), expiry (0 for never), key length,
+# value length
+SLOT_HEADER = struct.Struct('<QdHI')
+# Lock ranges are taken on offsets past the end of the data, which
+# POSIX allows, so they don't need to be mapped.
+LOCK_BASE = 2 ** 40
+# Longer keys are replaced by a hash, so they still fit a slot.
+MAX_KEY_LENGTH = 250
+
+
+def layout_path(location, num_buckets, ways, slot_size):
+    """The cache file for ``location`` with this layout."""
+    return '{}.{}x{}x{}'.format(location, num_buckets, ways, slot_size)
+
+
+def key_hash(key):
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return struct.unpack('<Q', digest)[0] or 1
+
+
+class SharedMap:
+    """
+    The mapped cache file, shared by every SharedMemoryCache instance
+    (Django creates one per thread) using the same LOCATION.
+    """
+    def __init__(self, path, num_buckets, slot_size, ways, lock_stripes):
+        self.path = path
+        self.ways = ways
+        self.slot_size = slot_size
+        self.num_buckets = num_buckets
+        self.lock_stripes = min(lock_stripes, self.num_buckets)
+        self.thread_locks = [threading.Lock()
+                             for _ in range(self.lock_stripes)]
+        size = HEADER.size + self.num_buckets * ways * slot_size
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 0, 0)
+        try:
+            expected = HEADER.pack(MAGIC, self.num_buckets, ways, slot_size)
+            if os.fstat(self.fd).st_size == 0:
+                # A new file; nobody else can have it mapped yet.
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, expected, 0)
+            valid = (os.pread(self.fd, HEADER.size, 0) == expected and
+                     os.fstat(self.fd).st_size == size)
+            if valid:
+                self.map = mmap.mmap(self.fd, size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 0, 0)
+        if not valid:
+            os.close(self.fd)
+            raise ImproperlyConfigured(
+                '{} is not a cache file with this layout; remove it if '
+                'no worker is using it.'.format(path))
+
+    def stripe(self, bucket):
+        return bucket % self.lock_stripes
+
+    def lock(self, stripe):
+        self.thread_locks[stripe].acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, LOCK_BASE + stripe)
+
+    def unlock(self, stripe):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, LOCK_BASE + stripe)
+        self.thread_locks[stripe].release()
+
+    def slot_offsets(self, bucket):
+        start = HEADER.size + bucket * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size,
+                     self.slot_size)
+
+    def find(self, bucket, hashed, key, now):
+        """
+        Return ``(offset, value_length)`` of the live entry for ``key``,
+        or ``(None, None)``. Caller holds the bucket's lock.
+        """
+        data = self.map
+        for offset in self.slot_offsets(bucket):
+            slot_hash, expires, key_length, value_length = (
+                SLOT_HEADER.unpack_from(data, offset)
+            )
+            if slot_hash != hashed:
+                continue
+            start = offset + SLOT_HEADER.size
+            if data[start:start + key_length] != key:
+                continue
+            if expires and expires <= now:
+                SLOT_HEADER.pack_into(data, offset, 0, 0, 0, 0)
+                return None, None
+            return offset, value_length
+        return None, None
+
+    def read(self, offset, key_length, value_length):
+        start = offset + SLOT_HEADER.size + key_length
+        return self.map[start:start + value_length]
+
+    def write(self, bucket, hashed, key, value, expires, now,
+              only_if_missing=False):
+        """
+        Store ``value`` for ``key``, evicting if the bucket is full.
+        Caller holds the bucket's lock. Returns False if ``key`` was
+        already present and ``only_if_missing`` is set.
+        """
+        data = self.map
+        target = None
+        victim, victim_expires = None, None
+        for offset in self.slot_offsets(bucket):
+            slot_hash, slot_expires, key_length, _ = (
+                SLOT_HEADER.unpack_from(data, offset)
+            )
+            start = offset + SLOT_HEADER.size
+            live = slot_hash and not (slot_expires and slot_expires <= now)
+            if (slot_hash == hashed and
+                    data[start:start + key_length] == key):
+                if live and only_if_missing:
+                    return False
+                target = offset
+                break
+            if not live:
+                if target is None:
+                    target = offset
+                continue
+            # Entries that never expire sort after every other one.
+            rank = slot_expires or float('inf')
+            if victim is None or rank < victim_expires:
+                victim, victim_expires = offset, rank
+        if target is None:
+            target = victim
+        start = target + SLOT_HEADER.size
+        # Clear the header first, so a half-written slot never matches.
+        SLOT_HEADER.pack_into(data, target, 0, 0, 0, 0)
+        data[start:start + len(key)] = key
+        data[start + len(key):start + len(key) + len(value)] = value
+        SLOT_HEADER.pack_into(data, target, hashed, expires or 0,
+                              len(key), len(value))
+        return True
+
+    def clear(self):
+        for stripe in range(self.lock_stripes):
+            self.lock(stripe)
+        try:
+            for bucket in range(self.num_buckets):
+                for offset in self.slot_offsets(bucket):
+                    SLOT_HEADER.pack_into(self.map, offset, 0, 0, 0, 0)
+        finally:
+            for stripe in range(self.lock_stripes):
+                self.unlock(stripe)
+
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def get_shared_map(location, num_slots, slot_size, ways, lock_stripes):
+    """Return the process-wide SharedMap for ``location`` and layout."""
+    num_buckets = max(1, num_slots // ways)
+    path = layout_path(location, num_buckets, ways, slot_size)
+    shared_map = _maps.get(path)
+    if shared_map is None:
+        with _maps_lock:
+            shared_map = _maps.get(path)
+            if shared_map is None:
+                shared_map = _maps[path] = SharedMap(
+                    path, num_buckets, slot_size, ways, lock_stripes
+                )
+    return shared_map
+
+
+class SharedMemoryCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._map = get_shared_map(
+            os.path.abspath(location),
+            self._max_entries,
+            int(options.get('SLOT_SIZE', 4096)),
+            int(options.get('WAYS', 8)),
+            int(options.get('LOCK_STRIPES', 64)),
+        )
+
+    def _locate(self, key, version):
+        key = self.make_key(key, version=version)
+        if len(key.encode('utf-8')) > MAX_KEY_LENGTH:
+            key = 'sha1:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.validate_key(key)
+        encoded = key.encode('utf-8')
+        hashed = key_hash(encoded)
+        return encoded, hashed, hashed % self._map.num_buckets
+
+    def _fits(self, key, value):
+        return (SLOT_HEADER.size + len(key) + len(value) <=
+                self._map.slot_size)
+
+    def _store(self, key, value, timeout, version, only_if_missing):
+        key, hashed, bucket = self._locate(key, version)
+        value = pickle.dumps(value, self.pickle_protocol)
+        shared_map = self._map
+        stripe = shared_map.stripe(bucket)
+        fits = self._fits(key, value)
+        shared_map.lock(stripe)
+        try:
+            now = time.time()
+            if not fits:
+                logger.warning(
+                    'Not caching %s: its %d-byte value does not fit a '
+                    '%d-byte slot.', key.decode(), len(value),
+                    shared_map.slot_size)
+                # Don't leave an older value behind.
+                offset, _ = shared_map.find(bucket, hashed, key, now)
+                if offset is not None:
+                    SLOT_HEADER.pack_into(shared_map.map, offset, 0, 0, 0, 0)
+                return False
+            return shared_map.write(
+                bucket, hashed, key, value,
+                self.get_backend_timeout(timeout), now, only_if_missing,
+            )
+        finally:
+            shared_map.unlock(stripe)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version, False)
+
+    def get(self, key, default=None, version=None):
+        key, hashed, bucket = self._locate(key, version)
+        shared_map = self._map
+        stripe = shared_map.stripe(bucket)
+        shared_map.lock(stripe)
+        try:
+            offset, value_length = shared_map.find(
+                bucket, hashed, key, time.time()
+            )
+            if offset is None:
+                return default
+            value = shared_map.read(offset, len(key), value_length)
+        finally:
+            shared_map.unlock(stripe)
+        return pickle.loads(value)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key, hashed, bucket = self._locate(key, version)
+        shared_map = self._map
+        stripe = shared_map.stripe(bucket)
+        shared_map.lock(stripe)
+        try:
+            offset, value_length = shared_map.find(
+                bucket, hashed, key, time.time()
+            )
+            if offset is None:
+                return False
+            SLOT_HEADER.pack_into(
+                shared_map.map, offset, hashed,
+                self.get_backend_timeout(timeout) or 0,
+                len(key), value_length,
+            )
+            return True
+        finally:
+            shared_map.unlock(stripe)
+
+    def incr(self, key, delta=1, version=None):
+        key, hashed, bucket = self._locate(key, version)
+        shared_map = self._map
+        stripe = shared_map.stripe(bucket)
+        shared_map.lock(stripe)
+        try:
+            now = time.time()
+            offset, value_length = shared_map.find(bucket, hashed, key, now)
+            if offset is None:
+                raise ValueError("Key '%s' not found" % key.decode())
+            value = pickle.loads(
+                shared_map.read(offset, len(key), value_length)
+            ) + delta
+            expires = SLOT_HEADER.unpack_from(shared_map.map, offset)[1]
+            shared_map.write(bucket, hashed, key,
+                             pickle.dumps(value, self.pickle_protocol),
+                             expires, now)
+            return value
+        finally:
+            shared_map.unlock(stripe)
+
+    def delete(self, key, version=None):
+        key, hashed, bucket = self._locate(key, version)
+        shared_map = self._map
+        stripe = shared_map.stripe(bucket)
+        shared_map.lock(stripe)
+        try:
+            offset, _ = shared_map.find(bucket, hashed, key, time.time())
+            if offset is not None:
+                SLOT_HEADER.pack_into(shared_map.map, offset, 0, 0, 0, 0)
+        finally:
+            shared_map.unlock(stripe)
+
+    def has_key(self, key, version=None):
+        key, hashed, bucket = self._locate(key, version)
+        shared_map = self._map
+        stripe = shared_map.stripe(bucket)
+        shared_map.lock(stripe)
+        try:
+            offset, _ = shared_map.find(bucket, hashed, key, time.time())
+        finally:
+            shared_map.unlock(stripe)
+        return offset is not None
+
+    def clear(self):
+        self._map.clear()
@@ -0,0 +1,57 @@
+"""
+SQLite tuning for the production profile.
+
+configure_sqlite() runs on every new SQLite connection and applies
+settings.SQLITE_PRAGMAS. ReadOnlyRouter sends reads of users and
+profiles to the 'readonly' alias, a second, read-only connection to
+the same file; in WAL mode those reads never wait on writers.
+"""
+from django.conf import settings
+from django.db import connections
+
+# Pragmas that change the database file, and so can't be run on a
+# read-only connection.
+WRITE_PRAGMAS = ('journal_mode', 'synchronous')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver applying SQLITE_PRAGMAS."""
+    if connection.vendor != 'sqlite':
+        return
+    read_only = 'mode=ro' in connection.settings_dict['NAME']
+    cursor = connection.connection.cursor()
+    for pragma, value in settings.SQLITE_PRAGMAS.items():
+        if read_only and pragma in WRITE_PRAGMAS:
+            continue
+        cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    cursor.close()
+
+
+class ReadOnlyRouter:
+    """
+    Route reads of auth models and profiles to the 'readonly' database,
+    and everything else, including all writes, to 'default'.
+
+    Reads made while 'default' is inside a transaction stay on
+    'default', so they see that transaction's own writes.
+    """
+    READ_ONLY_APPS = ('auth',)
+    READ_ONLY_MODELS = (('accounts', 'profile'),)
+
+    def db_for_read(self, model, **hints):
+        meta = model._meta
+        if (meta.app_label in self.READ_ONLY_APPS or
+                (meta.app_label, meta.model_name) in self.READ_ONLY_MODELS):
+            if not connections['default'].in_atomic_block:
+                return 'readonly'
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,175 @@
+"""
+Per-request timing of the expensive phases of a request.
+
+InstrumentationMiddleware times every request, and counts and times its
+SQL queries through execute wrappers on each database connection. Code
+doing other slow work wraps it in ``timed(phase)``: MX lookups ('dns'),
+password hashing ('hash') and Pillow ('image'). TimedDjangoTemplates
+times template rendering ('template').
+
+For each request the phases are sent back in a Server-Timing header
+(when SERVER_TIMING is set, or to clients in INTERNAL_IPS) and logged
+as one JSON line on the 'project_7.requests' logger. A sample of
+requests (INSTRUMENTATION_PROFILE_RATE) also runs under cProfile; if
+one takes longer than INSTRUMENTATION_SLOW_REQUEST_MS, its profile is
+written to INSTRUMENTATION_PROFILE_DIR for pstats or snakeviz.
+
+Outside a request, timed() does nothing beyond checking a thread-local.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+from django.utils.text import slugify
+
+logger = logging.getLogger('project_7.requests')
+
+# Longest request path, once slugified, kept in a profile's file name.
+PROFILE_PATH_LENGTH = 50
+
+_local = threading.local()
+
+
+class RequestTimings:
+    """Total seconds and number of calls per phase, for one request."""
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, phase, duration):
+        total, count = self.phases.get(phase, (0.0, 0))
+        self.phases[phase] = (total + duration, count + 1)
+
+
+def current_timings():
+    """The RequestTimings of the request on this thread, if any."""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` of this request."""
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+def time_query(execute, sql, params, many, context):
+    """execute_wrapper timing queries as the 'db' phase."""
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.origin = template.origin
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend whose templates time their rendering."""
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def server_timing(phases, total):
+    """Format phases as a Server-Timing header value."""
+    metrics = [
+        '{};dur={:.1f};desc="{} calls"'.format(phase, seconds * 1000, count)
+        for phase, (seconds, count) in sorted(phases.items())
+    ]
+    metrics.append('total;dur={:.1f}'.format(total * 1000))
+    return ', '.join(metrics)
+
+
+class InstrumentationMiddleware:
+    """
+    Time each request and its phases; see the module docstring. Put it
+    first in MIDDLEWARE, so it also covers the other middleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.profile_rate = settings.INSTRUMENTATION_PROFILE_RATE
+        self.slow_seconds = settings.INSTRUMENTATION_SLOW_REQUEST_MS / 1000
+        self.profile_dir = settings.INSTRUMENTATION_PROFILE_DIR
+
+    def __call__(self, request):
+        timings = _local.timings = RequestTimings()
+        profiler = None
+        if self.profile_rate and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(time_query)
+                    )
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _local.timings = None
+        total = time.perf_counter() - started
+
+        if (settings.SERVER_TIMING or
+                request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS):
+            response['Server-Timing'] = server_timing(timings.phases, total)
+        profile_path = None
+        if profiler is not None and total >= self.slow_seconds:
+            profile_path = self.save_profile(profiler, request, total)
+        self.log(request, response, timings, total, profile_path)
+        return response
+
+    def save_profile(self, profiler, request, total):
+        if not self.profile_dir:
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, '{}-{}-{}-{:.0f}ms.prof'.format(
+            time.strftime('%Y%m%dT%H%M%S'), slugify(request.method),
+            slugify(request.path.replace('/', ' '))[:PROFILE_PATH_LENGTH]
+            .strip('-') or 'root',
+            total * 1000,
+        ))
+        profiler.dump_stats(path)
+        return path
+
+    def log(self, request, response, timings, total, profile_path):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+        }
+        for phase, (seconds, count) in timings.phases.items():
+            record[phase + '_ms'] = round(seconds * 1000, 1)
+            record[phase + '_count'] = count
+        if profile_path:
+            record['profile'] = profile_path
+        logger.info(json.dumps(record, sort_keys=True))
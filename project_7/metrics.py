@@ -0,0 +1,355 @@
+"""
+Counters and histograms, aggregated across worker processes.
+
+Each process keeps its samples in its own memory-mapped file,
+METRICS_DIR/metrics-<pid>.db, so recording a sample is a dictionary
+lookup and an in-place float update, with no cross-process locking.
+collect() reads every file in the directory and adds them up, so any
+worker can answer the metrics view for all of them. When a process
+opens its file, the files of exited processes are added into
+metrics-merged.db and removed, so counters never go backwards and the
+directory doesn't grow with every restart. Liveness is checked by pid,
+so processes in other pid namespaces (containers) must not share
+METRICS_DIR; clear it when deploying.
+
+Nothing is recorded while METRICS_DIR is None, its default. The WSGI
+and ASGI entry points set it for server processes, so tests and
+management commands leave no files behind.
+
+Metrics are declared once, at module level::
+
+    LOGINS = Counter('logins_total', 'Sign-in attempts.', ['result'])
+    LOGINS.inc(result='success')
+
+    HASH_SECONDS = Histogram('hash_seconds', 'Time spent hashing.')
+    HASH_SECONDS.observe(0.07)
+"""
+import fcntl
+import glob
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Bytes used, at the start of every file.
+USED = struct.Struct('<Q')
+# An entry is a key length, the UTF-8 key padded to 8 bytes, and a
+# float value.
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+INITIAL_SIZE = 64 * 2 ** 10
+
+FILE_PATTERN = 'metrics-*.db'
+PROCESS_FILE_RE = re.compile(r'metrics-(\d+)\.db$')
+MERGED_NAME = 'metrics-merged.db'
+# Held exclusively while merging, and shared while collecting, so that
+# no sample is counted both in a process's file and the merged one.
+LOCK_NAME = 'metrics.lock'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                   10)
+
+
+def entry_layout(key):
+    """Return the encoded key and its entry's size."""
+    encoded = key.encode('utf-8')
+    padded = (KEY_LENGTH.size + len(encoded) + 7) // 8 * 8
+    return encoded, padded + VALUE.size
+
+
+def read_entries(data):
+    """Yield ``(key, value)`` from the contents of a metrics file."""
+    used = USED.unpack_from(data, 0)[0] if len(data) >= USED.size else 0
+    position = USED.size
+    while position < min(used, len(data)):
+        length = KEY_LENGTH.unpack_from(data, position)[0]
+        key = data[position + KEY_LENGTH.size:
+                   position + KEY_LENGTH.size + length].decode('utf-8')
+        position += (KEY_LENGTH.size + length + 7) // 8 * 8
+        yield key, VALUE.unpack_from(data, position)[0]
+        position += VALUE.size
+
+
+class MetricsFile:
+    """
+    Append-only map of keys to floats in one process's mmap'd file.
+    Only its own process writes to it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size < INITIAL_SIZE:
+            self.file.truncate(INITIAL_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used = USED.unpack_from(self.map, 0)[0] or USED.size
+        # A file left by an earlier process with the same pid.
+        position = USED.size
+        for key, _ in read_entries(self.map):
+            _, size = entry_layout(key)
+            self.offsets[key] = position + size - VALUE.size
+            position += size
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def add(self, key, amount):
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        value = VALUE.unpack_from(self.map, offset)[0]
+        VALUE.pack_into(self.map, offset, value + amount)
+
+    def _append(self, key):
+        encoded, size = entry_layout(key)
+        if self.used + size > len(self.map):
+            new_size = max(self.used + size, len(self.map)) * 2
+            self.map.close()
+            self.file.truncate(new_size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        position = self.used
+        KEY_LENGTH.pack_into(self.map, position, len(encoded))
+        start = position + KEY_LENGTH.size
+        self.map[start:start + len(encoded)] = encoded
+        offset = position + size - VALUE.size
+        VALUE.pack_into(self.map, offset, 0.0)
+        # Publish the entry to readers only once it is complete.
+        self.used += size
+        USED.pack_into(self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+
+@contextmanager
+def directory_lock(directory, operation):
+    """Hold LOCK_NAME in ``directory`` with flock ``operation``."""
+    with open(os.path.join(directory, LOCK_NAME), 'a') as f:
+        fcntl.flock(f, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_exited(directory):
+    """
+    Add the files of processes that have exited into MERGED_NAME, and
+    remove them. Return how many were merged.
+    """
+    merged = None
+    count = 0
+    with directory_lock(directory, fcntl.LOCK_EX):
+        for path in glob.glob(os.path.join(directory, FILE_PATTERN)):
+            match = PROCESS_FILE_RE.search(path)
+            if not match or process_exists(int(match.group(1))):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            if merged is None:
+                merged = MetricsFile(os.path.join(directory, MERGED_NAME))
+            for key, value in read_entries(data):
+                merged.add(key, value)
+            os.remove(path)
+            count += 1
+        if merged is not None:
+            merged.close()
+    return count
+
+
+class Registry:
+    """Every declared metric, and this process's MetricsFile."""
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.file = None
+        self.pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def add(self, key, amount):
+        with self.lock:
+            if self.pid != os.getpid():
+                # First sample, or first since this process was forked.
+                self.pid = os.getpid()
+                self.file = None
+                directory = settings.METRICS_DIR
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                    merge_exited(directory)
+                    self.file = MetricsFile(os.path.join(
+                        directory, 'metrics-{}.db'.format(self.pid),
+                    ))
+            if self.file is not None:
+                self.file.add(key, amount)
+
+    def collect(self):
+        """Return ``{key: value}`` summed over every process's file."""
+        totals = {}
+        directory = settings.METRICS_DIR
+        if not directory or not os.path.isdir(directory):
+            return totals
+        with directory_lock(directory, fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(directory, FILE_PATTERN)):
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                for key, value in read_entries(data):
+                    totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def exposition(self):
+        """Render every metric in the Prometheus text format."""
+        totals = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            lines.extend(metric.samples(totals))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@receiver(setting_changed)
+def reset_metrics_file(setting, **kwargs):
+    if setting == 'METRICS_DIR':
+        with registry.lock:
+            registry.file = registry.pid = None
+
+
+def sample_key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    ))
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def parse_key(key):
+    name, labels = json.loads(key)
+    return name, [tuple(label) for label in labels]
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def check_labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} takes labels {}, got {}.'.format(
+                self.name, self.labelnames, tuple(labels)))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.check_labels(labels)
+        registry.add(sample_key(self.name, labels), amount)
+
+    def samples(self, totals):
+        for key, value in sorted(totals.items()):
+            name, labels = parse_key(key)
+            if name == self.name:
+                yield '{}{} {}'.format(name, format_labels(labels),
+                                       format_value(value))
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        self.check_labels(labels)
+        for bound in self.buckets:
+            if value <= bound:
+                break
+        # Buckets are stored per bound and made cumulative on export.
+        registry.add(sample_key(self.name + '_bucket',
+                                dict(labels, le=format_value(bound))), 1)
+        registry.add(sample_key(self.name + '_sum', labels), value)
+        registry.add(sample_key(self.name + '_count', labels), 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self, totals):
+        series = {}
+        for key, value in totals.items():
+            name, labels = parse_key(key)
+            if not name.startswith(self.name + '_'):
+                continue
+            suffix = name[len(self.name) + 1:]
+            labels = dict(labels)
+            bound = labels.pop('le', None)
+            entry = series.setdefault(tuple(sorted(labels.items())),
+                                      {'buckets': {}, 'sum': 0, 'count': 0})
+            if suffix == 'bucket':
+                entry['buckets'][bound] = value
+            elif suffix in ('sum', 'count'):
+                entry[suffix] = value
+
+        for labels, entry in sorted(series.items()):
+            cumulative = 0
+            for bound in self.buckets:
+                cumulative += entry['buckets'].get(format_value(bound), 0)
+                yield '{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(labels + (('le', format_value(bound)),)),
+                    format_value(cumulative),
+                )
+            yield '{}_sum{} {}'.format(self.name, format_labels(labels),
+                                       format_value(entry['sum']))
+            yield '{}_count{} {}'.format(self.name, format_labels(labels),
+                                         format_value(entry['count']))
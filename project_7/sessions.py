@@ -0,0 +1,386 @@
+"""
+Session engine with a cache read path and write-behind persistence.
+
+Sessions are read from the SESSION_CACHE_ALIAS cache and only fall back
+to django_session on a miss. A save updates the cache straight away and
+queues the row for SessionWriter, which writes everything queued since
+its last flush in one transaction every SESSION_WRITE_BEHIND_INTERVAL
+seconds. Saves that would not change the stored data are skipped,
+unless SESSION_SAVE_EVERY_REQUEST asks for the expiry to be refreshed.
+
+Until a queued write is flushed, only the process that made it can
+load the session after a cache miss. With more than one worker, point
+SESSION_CACHE_ALIAS at a cache they share.
+
+Each queued row remembers the database alias it was saved against and
+the database that alias pointed at. Rows whose alias has since been
+pointed elsewhere are dropped rather than written to the wrong
+database; code that swaps databases should call stop_session_writer()
+first. A process forked with rows queued leaves them to its parent and
+starts its own writer thread.
+
+Set SESSION_WRITE_BEHIND_INTERVAL to 0 to write rows on the request
+thread instead.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cached_db import (
+    SessionStore as CachedDBStore,
+)
+from django.core.signals import setting_changed
+from django.db import connections, router, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'project_7.sessions'
+
+SESSION_SAVES = Counter(
+    'sessions_saves_total',
+    'Session saves, by whether they were queued for writing (written) '
+    'or skipped because nothing changed (skipped).',
+    ['result'],
+)
+SESSION_ROWS_FLUSHED = Counter(
+    'sessions_rows_flushed_total',
+    'django_session rows written or deleted by the write-behind flush.',
+)
+
+
+class SessionWriter:
+    """
+    Queue of pending session rows, flushed to the database in batches.
+
+    ``pending`` maps a ``(database, session key)`` pair to the unsaved
+    Session to write, or to None if the row should be deleted. The
+    database is the ``(alias, NAME)`` the row was queued against. Later
+    writes to a key replace earlier ones, so a session saved several
+    times between flushes is written once. ``flushing`` holds the batch
+    being written, so it can still be read until it is committed.
+    """
+    def __init__(self, model, interval, batch_size):
+        self.model = model
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pid = os.getpid()
+        self.pending = {}
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopped = False
+        self.written = 0
+        self.deleted = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def _check_fork(self):
+        """
+        In a forked child, forget the parent's thread, locks and queue;
+        the parent flushes that queue itself.
+        """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.pending = {}
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def database(self):
+        """The alias session rows are written to, and its NAME."""
+        using = router.db_for_write(self.model)
+        return using, connections[using].settings_dict['NAME']
+
+    def write(self, session):
+        self._queue(session.session_key, session)
+
+    def delete(self, session_key):
+        self._queue(session_key, None)
+
+    def _queue(self, session_key, session):
+        self._check_fork()
+        key = (self.database(), session_key)
+        with self.lock:
+            self.pending[key] = session
+            if self.interval and self.thread is None:
+                self._start()
+        if not self.interval:
+            self.flush()
+        elif len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    def get(self, session_key):
+        """
+        Return ``(True, session)`` if a write or delete of ``session_key``
+        is waiting to be flushed, where ``session`` is None for a
+        delete, or ``(False, None)``.
+        """
+        self._check_fork()
+        key = (self.database(), session_key)
+        with self.lock:
+            for queue in (self.pending, self.flushing):
+                if key in queue:
+                    return True, queue[key]
+        return False, None
+
+    def _start(self):
+        self.thread = threading.Thread(
+            target=self._run, name='session-writer', daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped:
+                # stop() writes the rest, on its caller's thread.
+                return
+            self.flush()
+            # The database connection belongs to this thread; don't keep
+            # it open between flushes.
+            connections.close_all()
+
+    def stop(self):
+        """Stop the writer thread and write what is still queued."""
+        self.stopped = True
+        self.wakeup.set()
+        thread = self.thread
+        if (thread is not None and self.pid == os.getpid() and
+                thread is not threading.current_thread()):
+            thread.join()
+        self.flush()
+
+    def flush(self):
+        """Write every queued change. Returns the number of keys flushed."""
+        self._check_fork()
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                self.flushing = batch
+            if not batch:
+                return 0
+            keys = list(batch)
+            try:
+                for start in range(0, len(keys), self.batch_size):
+                    chunk = keys[start:start + self.batch_size]
+                    for database in {database for database, _ in chunk}:
+                        self._write_batch(database, {
+                            session_key: batch[database, session_key]
+                            for key_database, session_key in chunk
+                            if key_database == database
+                        })
+            except Exception:
+                logger.exception('Writing %d sessions failed', len(batch))
+                with self.lock:
+                    self.errors += 1
+                    # Keep anything not superseded since, for the next
+                    # flush.
+                    for key, session in batch.items():
+                        self.pending.setdefault(key, session)
+                    self.flushing = {}
+                return 0
+            with self.lock:
+                self.flushing = {}
+                self.flushes += 1
+            return len(batch)
+
+    def _write_batch(self, database, batch):
+        using, name = database
+        if connections[using].settings_dict['NAME'] != name:
+            logger.warning(
+                'Dropping %d session writes queued for %s, which %r no '
+                'longer points at.', len(batch), name, using
+            )
+            with self.lock:
+                self.dropped += len(batch)
+            return
+        manager = self.model._default_manager
+        deleted = [key for key, session in batch.items() if session is None]
+        sessions = [session for session in batch.values()
+                    if session is not None]
+        with transaction.atomic(using=using):
+            if deleted:
+                manager.using(using).filter(session_key__in=deleted).delete()
+            existing = set(
+                manager.using(using)
+                .filter(session_key__in=[s.session_key for s in sessions])
+                .values_list('session_key', flat=True)
+            ) if sessions else set()
+            manager.using(using).bulk_create(
+                [s for s in sessions if s.session_key not in existing]
+            )
+            for session in sessions:
+                if session.session_key in existing:
+                    manager.using(using).filter(
+                        session_key=session.session_key
+                    ).update(session_data=session.session_data,
+                             expire_date=session.expire_date)
+        with self.lock:
+            self.written += len(sessions)
+            self.deleted += len(deleted)
+        SESSION_ROWS_FLUSHED.inc(len(sessions) + len(deleted))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'written': self.written,
+                'deleted': self.deleted,
+                'dropped': self.dropped,
+                'flushes': self.flushes,
+                'errors': self.errors,
+            }
+
+
+_session_writer = None
+_session_writer_lock = threading.Lock()
+
+
+def get_session_writer():
+    """Return the process-wide SessionWriter."""
+    global _session_writer
+    if _session_writer is None:
+        with _session_writer_lock:
+            if _session_writer is None:
+                _session_writer = SessionWriter(
+                    SessionStore.get_model_class(),
+                    settings.SESSION_WRITE_BEHIND_INTERVAL,
+                    settings.SESSION_WRITE_BEHIND_BATCH_SIZE,
+                )
+    return _session_writer
+
+
+def stop_session_writer():
+    """
+    Write out the queued session rows and stop the writer thread. The
+    next session save starts a new writer.
+    """
+    global _session_writer
+    with _session_writer_lock:
+        writer, _session_writer = _session_writer, None
+    if writer is not None:
+        writer.stop()
+
+
+atexit.register(stop_session_writer)
+
+
+@receiver(setting_changed)
+def reset_session_writer(setting, **kwargs):
+    if setting.startswith('SESSION_WRITE_BEHIND_'):
+        stop_session_writer()
+
+
+class SessionStore(CachedDBStore):
+    """
+    cached_db SessionStore whose database writes go through the
+    SessionWriter, and which skips saving unchanged sessions.
+    """
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        # Serialized data as last loaded or saved, to detect no-op saves.
+        self._stored = None
+
+    def _serialize(self, data):
+        return self.serializer().dumps(data)
+
+    def _get_session_from_db(self):
+        queued, session = get_session_writer().get(self.session_key)
+        if queued:
+            if session is None or session.expire_date <= timezone.now():
+                self._session_key = None
+                return None
+            return session
+        return super()._get_session_from_db()
+
+    def load(self):
+        data = super().load()
+        if self.session_key is not None:
+            self._stored = self._serialize(data)
+        return data
+
+    def exists(self, session_key):
+        queued, session = get_session_writer().get(session_key)
+        if queued:
+            return session is not None
+        return super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        serialized = self._serialize(data)
+        if (not must_create and serialized == self._stored and
+                not settings.SESSION_SAVE_EVERY_REQUEST):
+            SESSION_SAVES.inc(result='skipped')
+            return
+        expiry = self.get_expiry_age()
+        if must_create:
+            if not self._cache.add(self.cache_key, data, expiry):
+                raise CreateError
+            if self.model.objects.filter(
+                    session_key=self.session_key).exists():
+                self._cache.delete(self.cache_key)
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, expiry)
+        get_session_writer().write(self.create_model_instance(data))
+        SESSION_SAVES.inc(result='written')
+        self._stored = serialized
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(self.cache_key_prefix + session_key)
+        get_session_writer().delete(session_key)
+        if session_key == self.session_key:
+            self._stored = None
+
+    @classmethod
+    def clear_expired(cls):
+        purge_expired_sessions(cls.get_model_class())
+
+
+def purge_expired_sessions(model, batch_size=500, pause=0.05):
+    """
+    Delete expired sessions ``batch_size`` rows at a time, each batch in
+    its own short transaction, sleeping ``pause`` seconds in between so
+    that request threads waiting to write get a turn. Returns the number
+    of rows deleted.
+    """
+    manager = model._default_manager
+    using = router.db_for_write(model)
+    now = timezone.now()
+    deleted = 0
+    while True:
+        keys = list(
+            manager.using(using).filter(expire_date__lt=now)
+            .values_list('session_key', flat=True)[:batch_size]
+        )
+        if not keys:
+            return deleted
+        with transaction.atomic(using=using):
+            deleted += manager.using(using).filter(
+                session_key__in=keys).delete()[0]
+        if len(keys) < batch_size:
+            return deleted
+        time.sleep(pause)
@@ -25,6 +25,10 @@ SECRET_KEY = '@^5abv&l*_)^swykr5itnt@5ud%n5llgj(!37w-g1nq2m5e03w'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# 'production' turns on the tuned database setup below. Set it with
+# the DJANGO_PROFILE environment variable.
+PROFILE = os.environ.get('DJANGO_PROFILE', 'development')
+
 ALLOWED_HOSTS = []
 
 
@@ -41,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'project_7.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,13 +53,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'accounts.middleware.HashingPoolMiddleware',
 ]
 
 ROOT_URLCONF = 'project_7.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'project_7.instrumentation.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,13 +70,29 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',
+                'project_7.staticfiles.critical_css',
             ],
         },
     },
 ]
 
+if PROFILE == 'production':
+    # Keep compiled templates for the life of the process, so
+    # project_7.warmup can compile them all before workers fork.
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'project_7.wsgi.application'
 
+# Threads project_7.asgi runs requests on, per process. Requests wait
+# for their MX lookup on the event loop before taking a thread.
+ASGI_THREADS = 16
+
 
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
@@ -82,6 +104,75 @@ DATABASES = {
     }
 }
 
+# Applied to every new SQLite connection (see project_7.db).
+SQLITE_PRAGMAS = {}
+
+if PROFILE == 'production':
+    # WAL lets readers and a writer work at the same time; writers
+    # wait up to busy_timeout ms for the lock instead of failing with
+    # "database is locked". Connections are kept for CONN_MAX_AGE
+    # seconds instead of being opened for every request.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 2 ** 20,
+        'temp_store': 'MEMORY',
+    }
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+    # Read-only connection to the same file, used by
+    # project_7.db.ReadOnlyRouter for user and profile reads.
+    DATABASES['readonly'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:{}?mode=ro'.format(DATABASES['default']['NAME']),
+        'OPTIONS': {'uri': True},
+        'CONN_MAX_AGE': 600,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['project_7.db.ReadOnlyRouter']
+
+
+# Caches
+# Rendered fragments, such as the profile page body, are only cached
+# when a 'template_fragments' alias is configured, and it must be
+# shared between workers (e.g. a FileBasedCache); a per-process
+# backend such as LocMemCache is ignored (see accounts.profile_cache).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+if PROFILE == 'production':
+    # A memory-mapped cache shared by every worker on the host (see
+    # project_7.cache). Sessions, sign-in throttling and profile
+    # fragments use it when it is configured.
+    CACHES['shared'] = {
+        'BACKEND': 'project_7.cache.SharedMemoryCache',
+        'LOCATION': os.path.join(BASE_DIR, 'shared_cache.mmap'),
+        'OPTIONS': {'MAX_ENTRIES': 4096, 'SLOT_SIZE': 16 * 2 ** 10},
+    }
+    CACHES['template_fragments'] = CACHES['shared']
+
+# Sessions
+# Read from the SESSION_CACHE_ALIAS cache; writes to django_session are
+# batched by a background thread every SESSION_WRITE_BEHIND_INTERVAL
+# seconds (0 writes them on the request thread). Use a cache shared by
+# all workers when running more than one.
+
+SESSION_ENGINE = 'project_7.sessions'
+SESSION_CACHE_ALIAS = 'shared' if 'shared' in CACHES else 'default'
+SESSION_WRITE_BEHIND_INTERVAL = 1.0
+SESSION_WRITE_BEHIND_BATCH_SIZE = 500
+
+# Seconds a rendered profile body stays cached. Saving the user or
+# profile invalidates it sooner.
+PROFILE_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# Longest bio ProfileForm accepts, in characters.
+PROFILE_BIO_MAX_LENGTH = 5000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -89,30 +180,63 @@ DATABASES = {
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
+    # One pass over the password for the username/name, length,
+    # special character, number and case rules (see
+    # accounts.custom_password_validators.PasswordPolicyValidator).
     {
-        'NAME': 'accounts.custom_password_validators.NameSimilarityValidator',
+        'NAME': 'accounts.custom_password_validators.PasswordPolicyValidator',
+        'OPTIONS': {
+            'min_length': 14,
+        },
     },
+    # Breached/common passwords, from a Bloom filter built with
+    # manage.py build_password_filter.
     {
-        'NAME': 'accounts.custom_password_validators.MinimumLengthValidator',
+        'NAME': 'accounts.custom_password_validators.BreachedPasswordValidator',
+        'OPTIONS': {
+            'path': os.path.join(BASE_DIR, 'breached_passwords.bloom'),
+        },
     },
     # {
-    #     'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
-    # },
-    # {
     #     'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
     # },
-    {
-        'NAME': 'accounts.custom_password_validators.SpecialCharacterValidator',
-    },
-    {
-        'NAME': 'accounts.custom_password_validators.NumberValidator',
-    },
-    {
-        'NAME': 'accounts.custom_password_validators.CaseValidator',
-    },
 ]
 
 
+# Authentication
+# ProfileModelBackend loads request.user and its profile in one query.
+# AUTH_USER_CACHE_SIZE > 0 also keeps recently seen users in each
+# process for up to AUTH_USER_CACHE_TTL seconds; changes made in other
+# processes (including password changes) show up once that runs out.
+
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.ProfileModelBackend',
+]
+
+AUTH_USER_CACHE_SIZE = 0
+AUTH_USER_CACHE_TTL = 30
+
+
+# Password hashing
+# Hashes run on a pool of PASSWORD_HASHING_WORKERS threads, with up to
+# PASSWORD_HASHING_QUEUE_DEPTH more waiting; beyond that, requests that
+# need a hash get a 503 (see accounts.hashing).
+
+PASSWORD_HASHERS = [
+    'accounts.hashing.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+PASSWORD_HASHING_WORKERS = os.cpu_count() or 1
+PASSWORD_HASHING_QUEUE_DEPTH = 16
+
+# User.last_login is only written on login once it is this many
+# seconds old.
+LAST_LOGIN_UPDATE_INTERVAL = 15 * 60
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
 
@@ -134,7 +258,112 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'assets'),
 ]
+STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+
+if PROFILE == 'production':
+    # collectstatic bundles and minifies CSS, hashes file names and
+    # writes .gz/.br copies; project_7.wsgi serves them from
+    # STATIC_ROOT (see project_7.staticfiles).
+    STATICFILES_STORAGE = (
+        'project_7.staticfiles.BundledManifestStaticFilesStorage'
+    )
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+
+# E-mail domain verification
+# MX lookups made by accounts.forms.UserForm are cached per process.
+# Domains without MX records are cached for EMAIL_DOMAIN_NEGATIVE_TTL
+# seconds; domains that exist are cached for their record TTL.
+
+EMAIL_DOMAIN_RESOLVER = 'accounts.domain_verification.DNSResolver'
+EMAIL_DOMAIN_RESOLVER_TIMEOUT = 3.0
+EMAIL_DOMAIN_CACHE_SIZE = 1024
+EMAIL_DOMAIN_NEGATIVE_TTL = 300
+
+
+# Avatar thumbnails
+# Rendered in AVATAR_THUMBNAIL_WORKERS background processes after a
+# profile is saved (0 renders them inline). Templates pick a size by
+# name with {% avatar profile 'small' %}.
+
+AVATAR_THUMBNAIL_SIZES = {
+    'small': 96,
+    'large': 450,
+}
+AVATAR_THUMBNAIL_WORKERS = 2
+
+# Avatar uploads are rejected while streaming once they go over
+# AVATAR_MAX_UPLOAD_SIZE bytes or AVATAR_MAX_DIMENSIONS (width, height).
+AVATAR_MAX_UPLOAD_SIZE = 5 * 2 ** 20
+AVATAR_MAX_DIMENSIONS = (4000, 4000)
+
+
+# Sign-in throttling
+# After LOGIN_THROTTLE_USERNAME_LIMIT failed sign-ins for one username,
+# or LOGIN_THROTTLE_IP_LIMIT from one client IP, within
+# LOGIN_THROTTLE_WINDOW seconds, sign_in answers 429 without checking
+# the password. Counts are per process unless LOGIN_THROTTLE_CACHE
+# names a CACHES alias.
+
+LOGIN_THROTTLE_USERNAME_LIMIT = 5
+LOGIN_THROTTLE_IP_LIMIT = 30
+LOGIN_THROTTLE_WINDOW = 300
+LOGIN_THROTTLE_CACHE = 'shared' if 'shared' in CACHES else None
+
+
+# Request instrumentation
+# project_7.instrumentation times SQL, MX lookups, password hashing,
+# Pillow and template rendering for every request. The timings are sent
+# in a Server-Timing header when SERVER_TIMING is set or the client is
+# in INTERNAL_IPS, and logged as a JSON line at INFO on the
+# 'project_7.requests' logger. The header tells anyone who can see it
+# how long queries, hashing and MX lookups took, so it is off in
+# production. Behind a proxy every client has the proxy's address:
+# leave INTERNAL_IPS empty there. A fraction
+# INSTRUMENTATION_PROFILE_RATE of requests run under cProfile; those
+# slower than INSTRUMENTATION_SLOW_REQUEST_MS have their profile saved
+# in INSTRUMENTATION_PROFILE_DIR.
+
+SERVER_TIMING = DEBUG
+INTERNAL_IPS = []
+INSTRUMENTATION_PROFILE_RATE = 0.0
+INSTRUMENTATION_SLOW_REQUEST_MS = 500
+INSTRUMENTATION_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+if PROFILE == 'production':
+    SERVER_TIMING = False
+    INSTRUMENTATION_PROFILE_RATE = 0.01
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'console': {'class': 'logging.StreamHandler'},
+        },
+        'loggers': {
+            'project_7.requests': {
+                'handlers': ['console'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+        },
+    }
+
+
+# Metrics
+# Each worker records counters and histograms in its own file in
+# METRICS_DIR; /metrics adds them up in the Prometheus text format.
+# Only server processes record: project_7.wsgi and project_7.asgi set
+# DJANGO_METRICS_DIR (to BASE_DIR/metrics unless it is already set)
+# before settings are loaded. runserver loads settings first, so export
+# it to record there. Clear METRICS_DIR on deploy.
+# /metrics answers requests carrying "Authorization: Bearer
+# <METRICS_TOKEN>" when METRICS_TOKEN is set, and otherwise requests
+# from METRICS_ALLOWED_IPS. Behind a reverse proxy on the same host
+# every request comes from the proxy's address, so set METRICS_TOKEN
+# there.
+
+METRICS_DIR = os.environ.get('DJANGO_METRICS_DIR') or None
+METRICS_TOKEN = os.environ.get('DJANGO_METRICS_TOKEN') or None
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
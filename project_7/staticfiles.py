@@ -0,0 +1,449 @@
+"""
+Static file pipeline and server.
+
+BundledManifestStaticFilesStorage runs at collectstatic time: it
+inlines local @import rules into the importing stylesheet, minifies
+CSS, gives every file a content-hashed name (as
+ManifestStaticFilesStorage does) and writes .gz and, when the brotli
+package is installed, .br copies of text files next to the hashed ones.
+It then writes CRITICAL_CSS_NAME: the rules of CRITICAL_CSS_SOURCE that
+the header and page layout need, plus its @font-face rules, with their
+url()s made absolute. The critical_css context processor inlines that
+file in a <style> element, so pages render before the full stylesheet
+has loaded. Outside the production profile, or before collectstatic
+has run, the rules are extracted from the source stylesheet instead,
+and again whenever it changes.
+
+PrecompressedStaticFiles is WSGI middleware serving STATIC_ROOT. It
+picks the smallest variant the client's Accept-Encoding allows, and
+marks hashed files immutable, so they are only ever requested once.
+A .gz or .br copy requested by its own name is served as is, as an
+application/gzip or application/x-brotli download.
+"""
+import gzip
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from email.utils import formatdate
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage, staticfiles_storage,
+)
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.safestring import mark_safe
+
+from .views import IMMUTABLE_CACHE_CONTROL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BLOCK_SIZE = 64 * 2 ** 10
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json')
+
+# (Content-Encoding, file extension), best first.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Content-Type of a compressed copy requested by its own name.
+COMPRESSED_CONTENT_TYPES = {
+    '.br': 'application/x-brotli',
+    '.gz': 'application/gzip',
+}
+
+# Strings and comments, which must not be read as CSS code.
+CSS_TOKEN_RE = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*.*?\*/)', re.S
+)
+CSS_IMPORT_RE = re.compile(
+    r'@import\s+(?:url\(\s*)?(["\']?)([^"\')\s]+)\1\s*\)?\s*([^;]*);'
+)
+CSS_URL_RE = re.compile(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)')
+
+CRITICAL_CSS_SOURCE = 'css/global.css'
+CRITICAL_CSS_NAME = 'css/critical.css'
+# Rules are critical if one of their selectors starts with one of
+# these: the reset and type rules, the grid, the header and the page.
+CRITICAL_SELECTOR_RE = re.compile(
+    r'(html|body|article|\[hidden\]|template|a|h1|h2|img|figure|p|ul|li|'
+    r'\.bounds|\.grid(-\d+)?|\.centered|\.hide-text|'
+    r'\.circle--(inline--list|header|fluid(--[\w-]+)?|page))'
+    r'(?![\w-])'
+)
+
+
+def split_css(content):
+    """
+    Yield ``(text, is_code)`` pieces of a stylesheet, where comments and
+    strings are not code.
+    """
+    position = 0
+    for match in CSS_TOKEN_RE.finditer(content):
+        yield content[position:match.start()], True
+        yield match.group(0), False
+        position = match.end()
+    yield content[position:], True
+
+
+def minify_css(content):
+    """Drop comments and whitespace that doesn't change the meaning."""
+    content = ''.join(text for text, is_code in split_css(content)
+                      if is_code or not text.startswith('/*'))
+    pieces = []
+    for text, is_code in split_css(content):
+        if is_code:
+            text = re.sub(r'\s+', ' ', text)
+            text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+            text = re.sub(r':\s+', ':', text)
+        pieces.append(text)
+    return ''.join(pieces).replace(';}', '}').strip()
+
+
+def is_local(url):
+    return not re.match(r'^([a-z][a-z0-9+.-]*:|//|#)', url, re.I)
+
+
+def rebase_urls(content, source, target):
+    """
+    Rewrite relative url()s in ``content``, a stylesheet at ``source``,
+    so they still resolve when it is inlined into ``target``.
+    """
+    source_dir = posixpath.dirname(source)
+    target_dir = posixpath.dirname(target)
+    if source_dir == target_dir:
+        return content
+
+    def rebase(match):
+        quote, url = match.groups()
+        if not is_local(url) or url.startswith('/'):
+            return match.group(0)
+        path = posixpath.normpath(posixpath.join(source_dir, url))
+        return 'url({0}{1}{0})'.format(
+            quote, posixpath.relpath(path, target_dir or '.')
+        )
+
+    return CSS_URL_RE.sub(rebase, content)
+
+
+def css_blocks(content):
+    """
+    Yield ``(prelude, body)`` for each top-level rule of a stylesheet
+    without comments, ``body`` being None for statements such as
+    @import.
+    """
+    depth = 0
+    start = body_start = 0
+    quote = None
+    for position, char in enumerate(content):
+        if quote:
+            if char == quote and content[position - 1] != '\\':
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                body_start = position
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                yield (content[start:body_start].strip(),
+                       content[body_start + 1:position])
+                start = position + 1
+        elif char == ';' and depth == 0:
+            yield content[start:position].strip(), None
+            start = position + 1
+
+
+def critical_rules(content):
+    """
+    The rules of a stylesheet the first render needs (those with a
+    selector matching CRITICAL_SELECTOR_RE) and its @font-face rules,
+    minified.
+    """
+    content = ''.join(text for text, is_code in split_css(content)
+                      if is_code or not text.startswith('/*'))
+    kept = []
+    for prelude, body in css_blocks(content):
+        if body is None:
+            continue
+        if prelude.startswith('@font-face'):
+            kept.append('{}{{{}}}'.format(prelude, body))
+        elif prelude.startswith('@media'):
+            rules = critical_rules(body)
+            if rules:
+                kept.append('{}{{{}}}'.format(prelude, rules))
+        elif not prelude.startswith('@') and any(
+                CRITICAL_SELECTOR_RE.match(selector.strip())
+                for selector in prelude.split(',')):
+            kept.append('{}{{{}}}'.format(prelude, body))
+    return minify_css('\n'.join(kept))
+
+
+def absolute_urls(content, name, url):
+    """
+    Rewrite the relative url()s of ``content``, the stylesheet at
+    ``name``, to ``url(path)``, so they resolve from any page.
+    """
+    def absolute(match):
+        quote, target = match.groups()
+        if not is_local(target) or target.startswith('/'):
+            return match.group(0)
+        target, suffix = re.match(r'([^?#]*)(.*)', target).groups()
+        path = posixpath.normpath(
+            posixpath.join(posixpath.dirname(name), target))
+        return 'url({0}{1}{2}{0})'.format(quote, url(path), suffix)
+
+    return CSS_URL_RE.sub(absolute, content)
+
+
+class BundledManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Without a manifest (collectstatic not run yet) fall back to
+    # unhashed names, so pages still render.
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if self.manifest_strict:
+                raise
+            return name
+
+    def read_text(self, name):
+        with self.open(name) as f:
+            return f.read().decode('utf-8')
+
+    def replace_text(self, name, content):
+        self.delete(name)
+        self._save(name, ContentFile(content.encode('utf-8')))
+
+    def inline_imports(self, name, seen=()):
+        """
+        Return stylesheet ``name`` with its local imports inlined.
+        Imports that can't be inlined (remote, or with media queries)
+        are moved to the top, where CSS requires them to be.
+        """
+        seen = seen + (name,)
+        content = ''.join(text for text, is_code
+                          in split_css(self.read_text(name))
+                          if is_code or not text.startswith('/*'))
+        kept = []
+
+        def inline(match):
+            _, url, media = match.groups()
+            imported = posixpath.normpath(
+                posixpath.join(posixpath.dirname(name), url)
+            )
+            if not imported.endswith('.css'):
+                imported += '.css'
+            if (not is_local(url) or media.strip() or imported in seen or
+                    not self.exists(imported)):
+                kept.append(match.group(0))
+                return ''
+            return rebase_urls(self.inline_imports(imported, seen),
+                               imported, name)
+
+        content = CSS_IMPORT_RE.sub(inline, content)
+        return '\n'.join(kept + [content])
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            # Bundle and minify the collected copies first, and hash
+            # those rather than the originals.
+            paths = dict(paths)
+            for name in paths:
+                if name.endswith('.css'):
+                    self.replace_text(name,
+                                      minify_css(self.inline_imports(name)))
+                    paths[name] = (self, name)
+
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if (not dry_run and hashed_name and
+                    not isinstance(processed, Exception) and
+                    name.endswith(COMPRESSIBLE_EXTENSIONS)):
+                self.compress(name)
+                self.compress(hashed_name)
+            yield name, hashed_name, processed
+
+        if not dry_run and self.exists(CRITICAL_CSS_SOURCE):
+            # From the hashed copy, whose url()s name hashed files.
+            source = self.stored_name(CRITICAL_CSS_SOURCE)
+            self.replace_text(CRITICAL_CSS_NAME, absolute_urls(
+                critical_rules(self.read_text(source)), source,
+                lambda path: FileSystemStorage.url(self, path),
+            ))
+            yield CRITICAL_CSS_NAME, CRITICAL_CSS_NAME, True
+
+    def compress(self, name):
+        """Write the .gz and .br variants of ``name``, where smaller."""
+        with self.open(name) as f:
+            content = f.read()
+        variants = {'.gz': gzip.compress(content, 9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content)
+        for extension, compressed in variants.items():
+            if len(compressed) < len(content):
+                if self.exists(name + extension):
+                    self.delete(name + extension)
+                self._save(name + extension, ContentFile(compressed))
+
+
+# (source key, content); the key is None for collectstatic's output.
+_critical_css = None
+
+
+def get_critical_css():
+    """
+    The critical CSS. In the production profile, CRITICAL_CSS_NAME as
+    collectstatic wrote it, read once. Otherwise, or before collectstatic
+    has run, extracted from CRITICAL_CSS_SOURCE, again only when that
+    file has changed.
+    """
+    global _critical_css
+    if settings.PROFILE == 'production':
+        if _critical_css is not None and _critical_css[0] is None:
+            return _critical_css[1]
+        if staticfiles_storage.exists(CRITICAL_CSS_NAME):
+            with staticfiles_storage.open(CRITICAL_CSS_NAME) as f:
+                _critical_css = None, f.read().decode('utf-8')
+            return _critical_css[1]
+    path = finders.find(CRITICAL_CSS_SOURCE)
+    if path is None:
+        return ''
+    key = path, os.stat(path).st_mtime_ns
+    if _critical_css is None or _critical_css[0] != key:
+        with open(path, encoding='utf-8') as f:
+            _critical_css = key, absolute_urls(critical_rules(f.read()),
+                                               CRITICAL_CSS_SOURCE,
+                                               staticfiles_storage.url)
+    return _critical_css[1]
+
+
+@receiver(setting_changed)
+def reset_critical_css(setting, **kwargs):
+    global _critical_css
+    if setting.startswith('STATIC') or setting == 'PROFILE':
+        _critical_css = None
+
+
+def critical_css(request):
+    """Context processor adding the critical CSS, for layout.html."""
+    return {'critical_css': mark_safe(get_critical_css())}
+
+
+def accepted_encodings(header):
+    """Content-codings an Accept-Encoding header allows."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                pass
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles:
+    """
+    Serve files below STATIC_URL from STATIC_ROOT, before Django sees
+    the request. Other requests go to the wrapped application.
+
+    The file list is read on the first static request; files added to
+    STATIC_ROOT later are only served after a restart.
+    """
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = root or settings.STATIC_ROOT
+        self.prefix = prefix or settings.STATIC_URL
+        self.files = None
+        self.immutable = frozenset()
+
+    def load(self):
+        files = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root)
+                files[relative.replace(os.sep, '/')] = (path, os.stat(path))
+        self.immutable = frozenset(self.hashed_names(files))
+        self.files = files
+
+    def hashed_names(self, files):
+        manifest = files.get(ManifestStaticFilesStorage.manifest_name)
+        if manifest is None:
+            return ()
+        with open(manifest[0]) as f:
+            return json.load(f).get('paths', {}).values()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if (not self.root or not path.startswith(self.prefix) or
+                environ['REQUEST_METHOD'] not in ('GET', 'HEAD')):
+            return self.application(environ, start_response)
+        if self.files is None:
+            self.load()
+        name = unquote(path[len(self.prefix):])
+        if name not in self.files:
+            return self.application(environ, start_response)
+        return self.serve(environ, start_response, name)
+
+    def serve(self, environ, start_response, name):
+        file_path, stat = self.files[name]
+        extension = posixpath.splitext(name)[1]
+        if extension in COMPRESSED_CONTENT_TYPES:
+            # guess_type() would give the type of the uncompressed file.
+            content_type = COMPRESSED_CONTENT_TYPES[extension]
+        else:
+            content_type, _ = mimetypes.guess_type(name)
+        headers = [
+            ('Content-Type', content_type or 'application/octet-stream'),
+            ('Vary', 'Accept-Encoding'),
+            ('Last-Modified', formatdate(stat.st_mtime, usegmt=True)),
+        ]
+        if name in self.immutable:
+            headers.append(('Cache-Control', IMMUTABLE_CACHE_CONTROL))
+
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        for encoding, extension in ENCODINGS:
+            variant = self.files.get(name + extension)
+            if encoding in accepted and variant is not None:
+                file_path, stat = variant
+                headers.append(('Content-Encoding', encoding))
+                break
+
+        etag = '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+        headers.append(('ETag', etag))
+        if etag in environ.get('HTTP_IF_NONE_MATCH', ''):
+            start_response('304 Not Modified', headers)
+            return []
+
+        headers.append(('Content-Length', str(stat.st_size)))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        f = open(file_path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, BLOCK_SIZE)
+        return read_blocks(f)
+
+
+def read_blocks(f):
+    with f:
+        yield from iter(lambda: f.read(BLOCK_SIZE), b'')
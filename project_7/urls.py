@@ -26,8 +26,10 @@ urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^accounts/', include(('accounts.urls', 'accounts'), namespace='accounts')),
     url(r'^$', views.home, name='home'),
+    url(r'^metrics$', views.metrics, name='metrics'),
 ]
 urlpatterns += staticfiles_urlpatterns()
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=views.serve_media,
+                          document_root=settings.MEDIA_ROOT)
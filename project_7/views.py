@@ -1,5 +1,76 @@
+import os
+import posixpath
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+from django.views.static import serve
+
+from accounts.storage import is_immutable_name
+
+from .metrics import registry
+
+# Content-hashed media never changes, so it can be cached for a year.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
 
 def home(request):
-    return render(request, 'home.html')
\ No newline at end of file
+    return render(request, 'home.html')
+
+
+def metrics(request):
+    """
+    Every metric, summed over all workers, in the Prometheus text
+    format. Only answers requests with METRICS_TOKEN as their bearer
+    token or, without one configured, from METRICS_ALLOWED_IPS.
+    """
+    if settings.METRICS_TOKEN:
+        allowed = constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''),
+            'Bearer ' + settings.METRICS_TOKEN,
+        )
+    else:
+        allowed = (request.META.get('REMOTE_ADDR') in
+                   settings.METRICS_ALLOWED_IPS)
+    if not allowed:
+        raise Http404
+    return HttpResponse(registry.exposition(),
+                        content_type='text/plain; version=0.0.4')
+
+
+def media_etag(path, stat):
+    """
+    ETag of a media file: the content hash in its name if it has one,
+    otherwise its modification time and size.
+    """
+    if is_immutable_name(path):
+        return quote_etag(os.path.splitext(posixpath.basename(path))[0])
+    return quote_etag('{:x}-{:x}'.format(int(stat.st_mtime), stat.st_size))
+
+
+def serve_media(request, path, document_root=None):
+    """
+    Serve MEDIA_ROOT in development, with ETag and Last-Modified
+    validators, and marking hashed files immutable.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        stat = os.stat(safe_join(document_root, path))
+    except OSError:
+        # Let serve() answer for missing files and directories.
+        return serve(request, path, document_root=document_root)
+
+    etag = media_etag(path, stat)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is None:
+        response = serve(request, path, document_root=document_root)
+    response['ETag'] = etag
+    if is_immutable_name(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -0,0 +1,130 @@
+"""
+Work a worker process would otherwise do on its first requests.
+
+warmup() imports the modules that are only imported on first use,
+builds the URL resolvers, compiles every project template and reads
+the critical CSS. Under a preforking server, run it in the master
+process after the application is loaded. Forked workers then start
+with all of it in memory they share with the master. With gunicorn::
+
+    # gunicorn.conf.py
+    preload_app = True
+
+    def when_ready(server):
+        from project_7.warmup import warmup
+        warmup()
+
+    def post_fork(server, worker):
+        from project_7.warmup import prime_connections
+        prime_connections()
+
+Templates stay compiled only with the cached template loader, which
+the production profile configures. warmup() closes the database
+connections it opened, because a connection must not be shared
+across a fork. prime_connections() then opens each worker's own
+connections before its first request. This only helps when
+CONN_MAX_AGE keeps them open.
+
+``manage.py import_report`` measures what this saves.
+"""
+import logging
+import os
+import time
+from importlib import import_module
+
+import django
+from django.db import connections
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.template.utils import get_app_template_dirs
+from django.urls import URLResolver, get_resolver
+
+from .staticfiles import get_critical_css
+
+logger = logging.getLogger(__name__)
+
+# Imported on first use by the code that needs them.
+LAZY_MODULES = (
+    'dns.exception',
+    'dns.flags',
+    'dns.message',
+    'dns.rcode',
+    'dns.rdatatype',
+    'dns.resolver',
+    'PIL.Image',
+    'PIL.ImageOps',
+)
+
+
+def import_lazy_modules():
+    for name in LAZY_MODULES:
+        import_module(name)
+    # Pillow registers its file format plugins on the first
+    # Image.open().
+    from PIL import Image
+    Image.init()
+
+
+def compile_patterns(resolver):
+    """Compile the regex of every pattern below ``resolver``."""
+    count = 0
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        count += 1
+        if isinstance(pattern, URLResolver):
+            count += compile_patterns(pattern)
+    return count
+
+
+def load_urls():
+    """Import the URLconf and views, and build the URL resolvers."""
+    resolver = get_resolver()
+    count = compile_patterns(resolver)
+    # Builds the reverse() lookup tables.
+    resolver.reverse_dict
+    return count
+
+
+def compile_templates():
+    """
+    Compile every template in the project's template directories.
+    Django's own (admin) templates are left alone.
+    """
+    django_dir = os.path.dirname(django.__file__)
+    count = 0
+    for backend in engines.all():
+        if not isinstance(backend, DjangoTemplates):
+            continue
+        # template_dirs leaves out app directories when the loaders
+        # are configured explicitly, as for the cached loader.
+        directories = (tuple(backend.engine.dirs) +
+                       tuple(get_app_template_dirs('templates')))
+        for directory in directories:
+            if directory.startswith(django_dir):
+                continue
+            for root, _, names in os.walk(directory):
+                for name in names:
+                    template_name = os.path.relpath(
+                        os.path.join(root, name), directory
+                    ).replace(os.sep, '/')
+                    backend.engine.get_template(template_name)
+                    count += 1
+    return count
+
+
+def warmup():
+    """Do the first-request work now; see the module docstring."""
+    started = time.perf_counter()
+    import_lazy_modules()
+    patterns = load_urls()
+    templates = compile_templates()
+    get_critical_css()
+    connections.close_all()
+    logger.info('Warmed up in %.0fms: %d URL patterns, %d templates.',
+                (time.perf_counter() - started) * 1000, patterns, templates)
+
+
+def prime_connections():
+    """Open this process's database connections."""
+    for connection in connections.all():
+        connection.ensure_connection()
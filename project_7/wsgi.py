@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/1.9/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project_7.settings")
+# Server processes record metrics (see project_7.metrics).
+os.environ.setdefault("DJANGO_METRICS_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metrics"))
 
 application = get_wsgi_application()
+
+# In production, files collected into STATIC_ROOT are served here,
+# precompressed, before requests reach Django.
+if settings.PROFILE == 'production':
+    from .staticfiles import PrecompressedStaticFiles
+    application = PrecompressedStaticFiles(application)